@@ -1,48 +1,40 @@
 import os
-import re
+
+from utils.chapter_store import open_chapter_source
 
 def merge_files_by_number(input_dir: str, output_file: str = "merged_output.txt", show_name: bool = False) -> None:
     """
     按编号顺序合并目录中的所有txt文件
     
     Args:
-        input_dir: 输入目录路径
+        input_dir: 输入目录路径（也可以是章节打包文件，按章节号顺序合并）
         output_file: 输出文件名（默认为merged_output.txt）
         show_name: 是否在合并时显示文件名（默认为False）
     """
-    # 获取目录中所有的txt文件
-    files = [f for f in os.listdir(input_dir) if f.endswith('.txt')]
-    
-    # 按文件名中的数字排序
-    def extract_number(filename):
-        # 专门提取后缀数字
-        match = re.search(r'_(\d+)\.txt$', filename)
-        return int(match.group(1)) if match else 0
-    
-    files.sort(key=extract_number)
-    
+    # 章节目录按 index.json 的顺序（缺失或过期时自动重建），打包文件按索引顺序
+    source = open_chapter_source(input_dir)
+    entries = source.entries
+
     # 合并文件
     merged_count = 0
     with open(output_file, 'w', encoding='utf-8') as outfile:
-        for filename in files:
-            filepath = os.path.join(input_dir, filename)
-            with open(filepath, 'r', encoding='utf-8') as infile:
-                content = infile.read().strip()  # 去除首尾空白
-                if content:  # 只写入非空内容
-
-                    if show_name:
-                        # ✅ 新增：写入文件名 + 分隔线
-                        outfile.write("\n\n"+"-" * len(filename))  # 分隔线长度匹配文件名
-                        outfile.write(f"{filename}\n\n")
-                    else:
-                        outfile.write('\n\n')  # 每个文件后加两个换行，确保明显分隔
-                    
-                    outfile.write(content)
-                    
-                    merged_count += 1
-    
-    print(f"已处理 {len(files)} 个文件，实际合并了 {merged_count} 个非空文件到 {output_file}")
-    print(f"章节范围: 第{extract_number(files[0])}章 到 第{extract_number(files[-1])}章")
+        for entry, text in zip(entries, source.iter_read(entries)):
+            content = text.strip()  # 去除首尾空白
+            if content:  # 只写入非空内容
+                if show_name:
+                    # ✅ 新增：写入文件名 + 分隔线
+                    outfile.write("\n\n"+"-" * len(entry.filename))  # 分隔线长度匹配文件名
+                    outfile.write(f"{entry.filename}\n\n")
+                else:
+                    outfile.write('\n\n')  # 每个文件后加两个换行，确保明显分隔
+                
+                outfile.write(content)
+                
+                merged_count += 1
+    
+    print(f"已处理 {len(entries)} 个文件，实际合并了 {merged_count} 个非空文件到 {output_file}")
+    if entries:
+        print(f"章节范围: 第{entries[0].number}章 到 第{entries[-1].number}章")
 
 def main():
     import sys
@@ -50,7 +42,7 @@ def main():
     
     # 创建参数解析器
     parser = argparse.ArgumentParser(description='按编号顺序合并目录中的txt文件')
-    parser.add_argument('input_dir',  help='输入目录路径')
+    parser.add_argument('input_dir',  help='输入目录路径或章节打包文件')
     parser.add_argument('-o', '--output',help='输出文件名')
     parser.add_argument('--show_name', action='store_true', help='合并文件时是否显示文件名')    
     args = parser.parse_args()
@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import argparse
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.query import Query
+from utils.chapter_store import ChapterEntry, open_chapter_source
+from utils.text_cache import get_text_cache
+
+"""
+多个 prompt 共用一次输入
+对同一章节目录运行多个 prompt 时，每个 prompt 单独一个 Query 会各自列出、排序、读取全部章节，
+各自的并发数也在争抢同一厂商的配额。这里把多个任务（各自的 prompt、模型、批次大小与输出前缀）
+放进同一个调度：章节输入只打开一次，相同的批次内容只组装一次，
+全部 prompt × 批次 的工作单元共用一个全局并发上限，并按前缀缓存友好的顺序排队
+"""
+
+
+class SharedBatchContent:
+    """
+    各任务共享的批次内容：按 Query.content_key 缓存组装好的（或正在组装的）批次内容，
+    所有用到它的工作单元结束后释放
+    """
+
+    def __init__(self):
+        self._contents: Dict[tuple, asyncio.Future] = {}
+        self._pending: Counter = Counter()
+        self.built = 0
+        self.reused = 0
+
+    def expect(self, key: tuple):
+        """登记一个会用到该内容的工作单元"""
+        self._pending[key] += 1
+
+    async def fetch(self, key: tuple, build: Callable[[], Awaitable[str]]) -> str:
+        """取得批次内容：已在组装或已组装好时等待同一结果，否则调用 build 组装"""
+        future = self._contents.get(key)
+        if future is not None:
+            self.reused += 1
+            return await asyncio.shield(future)
+        self.built += 1
+        future = asyncio.ensure_future(build())
+        if self._pending[key] > 0:
+            self._contents[key] = future
+        return await asyncio.shield(future)
+
+    def release(self, key: tuple):
+        """一个工作单元结束（完成、失败或取消）"""
+        self._pending[key] -= 1
+        if self._pending[key] <= 0:
+            self._pending.pop(key, None)
+            self._contents.pop(key, None)
+
+
+class MultiQuery:
+    def __init__(self, input_path: str, output_path: str, jobs: List[Dict[str, Any]], concurrent: int,
+                 prefetch: Optional[int] = None, **common):
+        """
+        Args:
+            input_path: 章节目录或章节打包文件（所有任务共用）
+            output_path: 默认输出目录（任务中可用 output_path 覆盖）
+            jobs: 任务列表，每项为 Query 的参数（至少包含 prompt_path；name_prefix 默认为 prompt 文件名），
+                  未给出的参数取 common 中的值
+            concurrent: 全局并发上限（所有任务共用）
+            prefetch: 提前读取内容的工作单元数（None 表示与并发数相同）
+            common: 各任务共用的 Query 参数，如 provider_id、model_id、batch_size、start_pos、end_pos
+        """
+        if not jobs:
+            raise ValueError("没有任务")
+        known = set(inspect.signature(Query.__init__).parameters) - {"self"}
+        self.input_path = input_path
+        self.concurrent = concurrent
+        self.prefetch = prefetch
+        self.queries: List[Query] = []
+        seen = set()
+        for i, job in enumerate(jobs, 1):
+            unknown = set(job) - known
+            if unknown:
+                raise ValueError(f"任务 {i} 中有未知的参数: {', '.join(sorted(unknown))}")
+            if not job.get("prompt_path"):
+                raise ValueError(f"任务 {i} 缺少 prompt_path")
+            params = {"batch_size": 10, **{k: v for k, v in common.items() if v is not None}, **job}
+            params.setdefault("name_prefix", os.path.splitext(os.path.basename(job["prompt_path"]))[0])
+            params.update(input_path=input_path, concurrent=concurrent)
+            params.setdefault("output_path", output_path)
+            if not params.get("provider_id") or not params.get("model_id"):
+                raise ValueError(f"任务 {i} 没有指定 provider/model（任务中或命令行中给出）")
+            target = (os.path.abspath(params["output_path"]), params["name_prefix"], str(params["batch_size"]))
+            if target in seen:
+                raise ValueError(f"任务 {i} 与之前的任务输出到同一位置（{params['name_prefix']}_bs{params['batch_size']}），"
+                                 f"请使用不同的 name_prefix")
+            seen.add(target)
+            query = Query(**params)
+            query.label = f"「{query.name_prefix}」"
+            self.queries.append(query)
+        self._contents = SharedBatchContent()
+
+    def request_cancel(self):
+        """由外部（如UI）调用，发出中止请求"""
+        for query in self.queries:
+            query.request_cancel()
+
+    def _schedule(self, plans: List[Tuple[Query, List[Tuple[int, List[ChapterEntry]]]]]):
+        """
+        排列全部工作单元，使相邻的请求尽量共享前缀（便于厂商的前缀缓存命中）：
+
+        - 同一模型、prompt 开头（{input_content} 之前的部分）相同的单元排在一起，按任务顺序分组
+        - 组内按批次排列，内容相同的批次（不同 prompt、批次划分相同）相邻；
+          批次的先后沿用各任务自己的执行顺序（如按检索预筛得分）
+
+        Returns:
+            [(任务, 批次号, 章节列表, 内容标识)]
+        """
+        first_seen: Dict[tuple, int] = {}
+        longest = max(len(plan) for _, plan in plans)
+        for rank in range(longest):
+            for query, plan in plans:
+                if rank < len(plan):
+                    first_seen.setdefault(query.content_key(plan[rank][1]), len(first_seen))
+        groups: Dict[tuple, int] = {}
+        units = []
+        for index, (query, plan) in enumerate(plans):
+            group = groups.setdefault((query.provider_id, query.model_id, query.prompt_head), len(groups))
+            for batch_num, batch_files in plan:
+                key = query.content_key(batch_files)
+                units.append(((group, first_seen[key], index), query, batch_num, batch_files, key))
+        units.sort(key=lambda unit: unit[0])
+        return [unit[1:] for unit in units]
+
+    async def _run_unit(self, query: Query, batch_files: List[ChapterEntry], batch_num: int, key: tuple):
+        try:
+            return await query._process_batch(batch_files, batch_num)
+        finally:
+            self._contents.release(key)
+
+    async def process(self):
+        """规划各任务的批次，在一个全局并发上限下执行全部 prompt × 批次"""
+        try:
+            source = open_chapter_source(self.input_path)
+            plans = []
+            for query in self.queries:
+                print(f"==== 任务{query.label}: {query.prompt_path}（{query.provider_id}/{query.model_id}，"
+                      f"批次大小 {query.batch_size}）====")
+                plan = query.plan_batches(source)
+                if not plan:
+                    query._assemble_chapters()
+                    continue
+                plan = query._order_plan(plan)
+                if query._prepare_stop_condition():
+                    continue
+                plans.append((query, plan))
+            if not plans:
+                print("所有任务都已完成，无需重新处理")
+                return
+
+            # 各任务共用并发槽位（只在请求模型期间占用）与流水线位置（多出的 prefetch 个用于提前读取内容）
+            prefetch = self.concurrent if self.prefetch is None else max(0, self.prefetch)
+            slots, pipeline = asyncio.Semaphore(self.concurrent), asyncio.Semaphore(self.concurrent + prefetch)
+            for query, _ in plans:
+                query._prepare_run(slots, pipeline)
+            units = self._schedule(plans)
+            for query, _, _, key in units:
+                query._content_cache = self._contents
+                self._contents.expect(key)
+            distinct = len({key for _, _, _, key in units})
+            print(f"共 {len(units)} 个工作单元（{len(plans)} 个任务），不同的批次内容 {distinct} 个，"
+                  f"全局并发数 {self.concurrent}")
+
+            deadline_at = {}
+            for query, _ in plans:
+                if query.deadline is not None:
+                    query._deadline_at = deadline_at.setdefault(query.deadline, time.monotonic() + query.deadline)
+                query._tasks = {}
+
+            tasks = []
+            for query, batch_num, batch_files, key in units:
+                if query._cancel_event.is_set():
+                    self._contents.release(key)
+                    continue
+                task = asyncio.create_task(self._run_unit(query, batch_files, batch_num, key))
+                query._tasks[batch_num] = task
+                tasks.append((query, batch_num, task))
+            if not tasks:
+                print("没有任务需要执行或已被中止")
+                return
+
+            results = await asyncio.gather(*(task for _, _, task in tasks), return_exceptions=True)
+
+            for query, _ in plans:
+                done = [(batch_num, result) for (q, batch_num, _), result in zip(tasks, results) if q is query]
+                if done:
+                    print(f"==== 任务{query.label} ====")
+                    query._report_results([n for n, _ in done], [r for _, r in done])
+            print(f"批次内容: 组装 {self._contents.built} 次，各任务间复用 {self._contents.reused} 次")
+            stats = get_text_cache().stats()
+            print(f"文本缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，"
+                  f"占用 {stats['bytes'] / 1024 / 1024:.1f}/{stats['max_bytes'] / 1024 / 1024:.0f} MB")
+        finally:
+            for query in self.queries:
+                query._cancel_event.clear()
+                query._deadline_at = None
+                query._tasks = {}
+                query._content_cache = None
+            self._contents = SharedBatchContent()
+
+
+def load_jobs(path: str) -> List[Dict[str, Any]]:
+    """读取任务文件：任务列表，或 {"jobs": [...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    jobs = data.get("jobs") if isinstance(data, dict) else data
+    if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+        raise ValueError(f"任务文件 {path} 应为任务对象的列表，或包含 jobs 列表的对象")
+    # 与 app/query.py 的命令行参数写法保持一致
+    aliases = {"provider": "provider_id", "model": "model_id"}
+    return [{aliases.get(k, k): v for k, v in job.items()} for job in jobs]
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    parser = argparse.ArgumentParser(description="多个 prompt 共用一次输入的批量Query-Answer处理工具")
+    parser.add_argument("--input_path", required=True, help="输入目录或章节打包文件（所有任务共用）")
+    parser.add_argument("--output_path", required=True, help="默认输出目录（任务中可用 output_path 覆盖）")
+    parser.add_argument("--jobs", required=True,
+                        help="任务文件（JSON）：每个任务为 Query 的参数，如 prompt_path、name_prefix、provider、model、batch_size")
+    parser.add_argument("--concurrent", type=int, default=1, help="全局并发数（所有任务共用）")
+    parser.add_argument("--provider", default=None, help="任务中未指定时使用的提供商ID")
+    parser.add_argument("--model", default=None, help="任务中未指定时使用的模型ID")
+    parser.add_argument("--batch_size", default=None, help="任务中未指定时使用的批次大小（默认10）")
+    parser.add_argument("--start_pos", type=int, default=None, help="起始位置（从1开始）")
+    parser.add_argument("--end_pos", type=int, default=None, help="终止位置")
+    parser.add_argument("--deadline", type=float, default=None, help="截止时间（秒），超时未开始的批次跳过")
+    parser.add_argument("--prefetch", type=int, default=None, help="提前读取内容的工作单元数（默认与并发数相同）")
+    args = parser.parse_args()
+
+    try:
+        multi = MultiQuery(args.input_path, args.output_path, load_jobs(args.jobs), args.concurrent, args.prefetch,
+                           provider_id=args.provider, model_id=args.model, batch_size=args.batch_size,
+                           start_pos=args.start_pos, end_pos=args.end_pos, deadline=args.deadline)
+        asyncio.run(multi.process())
+    except Exception as e:
+        print(f"处理过程发生错误，总耗时: {time.perf_counter() - start_time:.6f} 秒")
+        print(f"错误信息: {str(e)}")
+        sys.exit(1)
+    print(f"所有任务处理完成，总耗时: {time.perf_counter() - start_time:.6f} 秒")
+
+
+"""
+示例用法:
+任务文件 jobs.json:
+[
+    {"prompt_path": "prompts指令/世界地图提炼prompt.txt", "name_prefix": "世界地图", "batch_size": 50},
+    {"prompt_path": "prompts指令/逐章压缩prompt.txt", "name_prefix": "逐章压缩", "batch_size": 1,
+     "provider": "aliyun", "model": "qwen3-30b-a3b-instruct-2507"},
+    {"prompt_path": "prompts指令/战斗描述prompt.txt", "name_prefix": "战斗描述", "batch_size": 50}
+]
+
+python -m app.multi_query --input_path wyft_chapters --output_path outputs --jobs jobs.json \
+    --provider aliyun --model qwen3-next-80b-a3b-instruct --concurrent 20
+"""
@@ -2,40 +2,557 @@
 预处理一部小说，将它逐章节拆分为txt供后续使用
 """
 import os
+import json
+import hashlib
 import argparse
+from typing import Any, Dict, Iterable, List, Optional
 
 
-from utils.text_processor import TextProcessor
-from utils.readtxt import read_text_file
+from utils.text_processor import TextProcessor, Chapter
+from utils.readtxt import read_text_file, iter_text_chunks, detect_encoding
+from utils.text_processor import estimate_tokens
+from utils.heading_grammar import HeadingGrammar, StructureState, load_heading_grammar, PROLOGUE, EXTRA, EXTRA_BASE
+from utils.chapter_store import (ChapterEntry, ChapterStoreWriter, DirectoryChapterSource, PACK_SUFFIX,
+                                 INDEX_FILENAME, write_directory_index, load_directory_index, text_entry)
+from utils.near_duplicates import (DuplicateGroup, NearDuplicateConfig, find_near_duplicates,
+                                   load_near_duplicate_config)
+
+# 输入文件超过该大小（字节）时默认流式拆分，内存占用只与最长的一章有关
+STREAM_THRESHOLD = 64 * 1024 * 1024
+# 输出目录中记录上次拆分位置的文件，供增量拆分使用
+STATE_FILENAME = "split_state.json"
+# 增量拆分按字节偏移续读，只支持换行符为单字节 0x0A 且不会出现在多字节字符中的编码
+# （GBK 按其超集 GB18030 解码，见 utils/readtxt.py 的 stream_encoding）
+_TAIL_CODECS = {"utf-8": "utf-8", "utf-8-sig": "utf-8", "gbk": "gb18030", "gb18030": "gb18030"}
+# 结构报告中单章估算token数超过该值时给出警告（一章就可能撑满 Query 的一个批次）
+LARGE_CHAPTER_TOKENS = 30000
+
+
+def _number_label(number: int) -> str:
+    """第X章；番外为 番外N"""
+    return f"番外{number - EXTRA_BASE}" if number > EXTRA_BASE else f"第{number}章"
+
+
+def _chapter_label(chapter: Chapter) -> str:
+    """第X章_标题；番外（章节号大于 EXTRA_BASE）为 番外N_标题"""
+    return f"{_number_label(chapter.number)}_{chapter.title.replace(' ', '').replace('　', '')}"
+
+
+def chapter_filename(chapter: Chapter) -> str:
+    """生成章节文件名：第X章_标题_X.txt，番外为 番外N_标题_X.txt（已清理非法字符）"""
+    filename = f"{_chapter_label(chapter)}_{chapter.number}.txt"
+    return "".join(c for c in filename if c not in r'\/:*?"<>|')
+
+
+def chapter_header(chapter: Chapter) -> str:
+    """章节文件开头的标题行（含空行）"""
+    return f"{_chapter_label(chapter)}\n\n"
+
+
+def save_chapters(chapters: Iterable[Chapter], output_path: str) -> List[str]:
+    """
+    将章节逐个保存为独立txt文件
+
+    章节号重复出现时（流式拆分会按出现顺序产出），正文以换行追加到已写出的同号文件，
+    结果与整本拆分后合并同号章节一致。写完后在输出目录生成章节索引 index.json
+    （章节号、标题、文件名、字节数、字数、估算token数、sha1），供 Query、合并与阅读页直接使用
+
+    Args:
+        chapters: 章节列表或按顺序产出章节的生成器
+        output_path: 输出目录
+
+    Returns:
+        写入的文件名列表
+    """
+    os.makedirs(output_path, exist_ok=True)
+
+    filenames = []
+    written: Dict[int, str] = {}
+    # 章节号 -> [索引项, sha1]，正文写出时顺带累计统计信息
+    stats: Dict[int, list] = {}
+
+    def write_parts(f, parts, stat):
+        for part in parts:
+            f.write(part)
+            stat[0].chars += len(part)
+            stat[0].tokens += estimate_tokens(part)
+            stat[1].update(part.encode('utf-8'))
+
+    for chapter in chapters:
+        if chapter.number in written:
+            with open(os.path.join(output_path, written[chapter.number]), 'a', encoding='utf-8') as f:
+                write_parts(f, ['\n', *chapter.iter_parts()], stats[chapter.number])
+            print(f"追加章节: {written[chapter.number]}")
+            continue
+
+        filename = chapter_filename(chapter)
+        stat = stats[chapter.number] = [ChapterEntry(chapter.number, filename, chapter.title, volume=chapter.volume),
+                                        hashlib.sha1()]
+
+        # 保存文件
+        output_file = os.path.join(output_path, filename)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            # 正文按片段直接写出，不在内存中拼出整章
+            write_parts(f, [chapter_header(chapter), *chapter.iter_parts()], stat)
+        print(f"保存章节: {filename}")
+        filenames.append(filename)
+        written[chapter.number] = filename
+
+    entries = []
+    for number in sorted(stats):
+        entry, sha1 = stats[number]
+        file_stat = os.stat(os.path.join(output_path, entry.filename))
+        entry.size, entry.mtime_ns, entry.sha1 = file_stat.st_size, file_stat.st_mtime_ns, sha1.hexdigest()
+        entries.append(entry)
+    write_directory_index(output_path, entries)
+    print(f"已写入章节索引: {INDEX_FILENAME}")
+    return filenames
+
+
+def pack_chapters(chapters: Iterable[Chapter], pack_path: str, compress: bool = False) -> int:
+    """
+    将章节写入单个打包文件（内容与逐章txt文件完全相同）
+
+    Args:
+        chapters: 章节列表或按顺序产出章节的生成器
+        pack_path: 打包文件路径
+        compress: 是否逐章 zlib 压缩
+
+    Returns:
+        打包的章节数
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(pack_path)), exist_ok=True)
+    with ChapterStoreWriter(pack_path, compress=compress) as writer:
+        for chapter in chapters:
+            # 重复章节号由 writer 以换行追加到同号章节，与 save_chapters 一致
+            text = chapter.content if chapter.number in writer else chapter_header(chapter) + chapter.content
+            writer.add(chapter.number, chapter_filename(chapter), chapter.title, text)
+    entries = writer.entries
+    print(f"已打包 {len(entries)} 个章节: {pack_path}")
+    return len(entries)
+
+
+def flag_near_duplicates(output_path: str,
+                         config: Optional[NearDuplicateConfig] = None) -> List[DuplicateGroup]:
+    """
+    检测章节目录中内容近似重复的章节，并在 index.json 中标记（duplicate_of 为保留的较早章节号）
+
+    Args:
+        output_path: 章节目录
+        config: 检测设置，为None时读取 config.json 中的 NEAR_DUPLICATES
+
+    Returns:
+        重复分组（键为索引项）；未启用时为空列表
+    """
+    config = config or load_near_duplicate_config()
+    if not config.enabled:
+        return []
+    source = DirectoryChapterSource(output_path)
+    entries = source.entries
+    groups = find_near_duplicates(((i, source.read(e)) for i, e in enumerate(entries)),
+                                  threshold=config.threshold, min_chars=config.min_chars,
+                                  reader=lambda i: source.read(entries[i]))
+    for entry in entries:
+        entry.duplicate_of = 0
+    tokens = 0
+    for group in groups:
+        keep = entries[group.keep]
+        for i, score in group.duplicates:
+            entries[i].duplicate_of = keep.number
+            tokens += entries[i].tokens
+            print(f"近似重复: {entries[i].filename} ≈ {keep.filename}（相似度 {score:.0%}）")
+    write_directory_index(output_path, entries)
+    if groups:
+        count = sum(len(group.duplicates) for group in groups)
+        print(f"发现 {len(groups)} 组近似重复章节，共 {count} 章重复，约 {tokens} tokens；"
+              f"已在 {INDEX_FILENAME} 中标记，Query 可选择跳过")
+    return groups
+
+
+def split_novel_file(input_path: str, output_path: str, stream: Optional[bool] = None,
+                     pack: bool = False, compress: bool = False, grammar: Optional[HeadingGrammar] = None) -> int:
+    """
+    拆分整本小说并保存章节文件
+
+    Args:
+        input_path: 小说txt路径
+        output_path: 输出目录；打包时为打包文件路径（没有 .nepack 扩展名时自动补上）
+        stream: 是否流式拆分，为None时按文件大小（STREAM_THRESHOLD）自动选择
+        pack: 是否输出为单个打包文件而不是逐章txt
+        compress: 打包时是否压缩
+        grammar: 章节标题文法，为None时读取 config.json 中的 HEADING_GRAMMAR
+
+    Returns:
+        保存的章节数
+    """
+    processor = TextProcessor(grammar or load_heading_grammar())
+    if stream is None:
+        stream = os.path.getsize(input_path) > STREAM_THRESHOLD
+    if stream:
+        print("流式拆分章节")
+        chapters = processor.iter_chapters(iter_text_chunks(input_path))
+    else:
+        chapters = processor.split_chapters(read_text_file(input_path))
+    if pack:
+        if not output_path.endswith(PACK_SUFFIX):
+            output_path = output_path.rstrip("/\\") + PACK_SUFFIX
+        return pack_chapters(chapters, output_path, compress=compress)
+    count = len(save_chapters(chapters, output_path))
+    flag_near_duplicates(output_path)
+    _save_split_state(input_path, output_path, processor, [])
+    return count
+
+
+def analyze_structure(input_path: str, grammar: Optional[HeadingGrammar] = None,
+                      large_tokens: int = LARGE_CHAPTER_TOKENS) -> Dict[str, Any]:
+    """
+    预演拆分：流式扫描全文，只统计识别出的结构，不写任何文件
+
+    用于在运行 Query 之前发现拆分问题：没有识别出标题（整本成为一章"全文"）、
+    章节号重复或跳号、单章过大等。
+
+    Args:
+        input_path: 小说txt路径
+        grammar: 章节标题文法，为None时读取 config.json 中的 HEADING_GRAMMAR
+        large_tokens: 单章估算token数超过该值时列为过大章节
+
+    Returns:
+        结构报告字典，可用 format_structure_report 转为文字
+    """
+    processor = TextProcessor(grammar or load_heading_grammar())
+    order: List[int] = []
+    merged: Dict[int, Dict[str, Any]] = {}
+    duplicates, out_of_order = set(), 0
+    volumes: List[Dict[str, Any]] = []
+    for chapter in processor.iter_chapters(iter_text_chunks(input_path)):
+        content = chapter.content
+        tokens = estimate_tokens(content)
+        # 番外单独编号（大于 EXTRA_BASE），不参与倒退与跳号的检查
+        regular = [n for n in order if n <= EXTRA_BASE]
+        if chapter.number <= EXTRA_BASE and regular and chapter.number < regular[-1]:
+            out_of_order += 1
+        order.append(chapter.number)
+        if chapter.number in merged:
+            duplicates.add(chapter.number)
+            merged[chapter.number]["chars"] += len(content)
+            merged[chapter.number]["tokens"] += tokens
+        else:
+            merged[chapter.number] = {"number": chapter.number, "title": chapter.title,
+                                      "chars": len(content), "tokens": tokens}
+        if chapter.volume:
+            if not volumes or volumes[-1]["name"] != chapter.volume:
+                volumes.append({"name": chapter.volume, "first": chapter.number, "last": chapter.number, "chapters": 0})
+            volumes[-1]["last"] = chapter.number
+            volumes[-1]["chapters"] += 1
+
+    state = processor.structure
+    numbers = sorted(n for n in merged if n <= EXTRA_BASE)
+    gaps = [(a + 1, b - 1) for a, b in zip(numbers, numbers[1:]) if b - a > 1]
+    by_size = sorted(merged.values(), key=lambda c: c["tokens"], reverse=True)
+    return {
+        "source": input_path,
+        "whole_text": not any(state.counts.get(kind) for kind in ("chapter", "section", PROLOGUE, EXTRA)),
+        "segments": len(order),
+        "chapters": len(merged),
+        "counts": dict(state.counts),
+        "volumes": volumes,
+        "renumbered": [{"volume": name, "offset": offset} for name, offset in state.renumbered],
+        "leading_chars": state.leading_chars,
+        "attached": [{"volume": name, "chars": chars} for name, chars in state.attached],
+        "duplicates": sorted(duplicates),
+        "gaps": gaps,
+        "out_of_order": out_of_order,
+        "total_tokens": sum(c["tokens"] for c in merged.values()),
+        "largest": by_size[:5],
+        "oversized": [c for c in by_size if c["tokens"] > large_tokens],
+        "large_tokens": large_tokens,
+        "first": [merged[n] for n in order[:3]],
+        "last": [merged[n] for n in order[-3:]],
+    }
+
+
+def format_structure_report(report: Dict[str, Any]) -> str:
+    """把 analyze_structure 的结果整理为便于检查的文字报告"""
+    counts = report["counts"]
+    lines = [f"结构预演: {report['source']}"]
+    if report["whole_text"]:
+        lines.append("⚠️ 没有识别出任何章节标题，整本将作为一章\"全文\"，请检查 HEADING_GRAMMAR")
+    lines.append(f"章节: {report['chapters']} 章（{report['segments']} 个片段），估算共 {report['total_tokens']} tokens")
+    kinds = [("chapter", "章节标题"), ("section", "小节当作章节"), (PROLOGUE, "序章/楔子"), (EXTRA, "番外/尾声"),
+             ("volume", "卷标题"), ("ignored", "留在正文中的小节/行首标题")]
+    if counts:
+        lines.append("标题: " + "，".join(f"{label} {counts[kind]}" for kind, label in kinds if counts.get(kind)))
+    for volume in report["volumes"]:
+        lines.append(f"  {volume['name']}: {_number_label(volume['first'])} - {_number_label(volume['last'])}，共 {volume['chapters']} 章")
+    for item in report["renumbered"]:
+        lines.append(f"  {item['volume']} 的章节号从头开始，已顺延编号（+{item['offset']}）")
+    if report["leading_chars"]:
+        lines.append(f"第一个章节标题之前的 {report['leading_chars']} 字（书名、简介等）不归入任何章节")
+    if report["attached"]:
+        lines.append(f"章节之间的卷标题 {len(report['attached'])} 处，卷标题及其后到下一章之间的文字归入上一章: " +
+                     "，".join(f"{item['volume']}({item['chars']}字)" for item in report["attached"][:10]))
+    if report["first"]:
+        lines.append("开头: " + "，".join(f"{_number_label(c['number'])} {c['title']}" for c in report["first"]))
+        lines.append("结尾: " + "，".join(f"{_number_label(c['number'])} {c['title']}" for c in report["last"]))
+    if report["duplicates"]:
+        lines.append(f"⚠️ 重复的章节号（内容将合并）: {report['duplicates'][:20]}")
+    if report["gaps"]:
+        gaps = [f"{a}" if a == b else f"{a}-{b}" for a, b in report["gaps"][:20]]
+        lines.append(f"⚠️ 缺少的章节号: {', '.join(gaps)}")
+    if report["out_of_order"]:
+        lines.append(f"⚠️ 章节号倒退 {report['out_of_order']} 次")
+    if report["oversized"]:
+        lines.append(f"⚠️ 超过 {report['large_tokens']} tokens 的章节: " +
+                     "，".join(f"{_number_label(c['number'])}({c['tokens']})" for c in report["oversized"][:10]))
+    lines.append("最大的章节: " + "，".join(f"{_number_label(c['number'])} {c['tokens']} tokens" for c in report["largest"]))
+    return "\n".join(lines)
+
+
+def locate_last_heading(input_path: str, codec: str, processor: TextProcessor,
+                        window: int = 1024 * 1024) -> Optional[Dict[str, Any]]:
+    """
+    从文件末尾向前查找最后一个章节标题行
+
+    processor 须是刚拆分完该文件的处理器：按它结束时的层级状态判断哪些行是章节标题，
+    按它记录的最后一个标题之前的状态确定该章的章节号。
+
+    Returns:
+        {"offset": 标题行起始字节偏移, "heading_len": 标题行字节数, "heading_sha1",
+         "number": 章节号, "segment_chars": 该标题之后正文的字数,
+         "structure": 该标题之前的层级状态}；没有标题或无法解码时返回None
+    """
+    grammar = processor.grammar
+    final = processor.structure.to_dict()
+    resume = processor.structure.before_last
+    scanner = TextProcessor(grammar)
+    size = os.path.getsize(input_path)
+    with open(input_path, "rb") as f:
+        while True:
+            start = max(0, size - window)
+            f.seek(start)
+            data = f.read()
+            skip = 0
+            if start > 0:
+                # 从窗口内第一个完整行开始解码，0x0A 不会出现在多字节字符中间
+                skip = data.find(b"\n") + 1
+            elif data.startswith(b"\xef\xbb\xbf"):
+                skip = 3
+            if start == 0 or skip > 0:
+                try:
+                    text = data[skip:].decode(codec)
+                except UnicodeDecodeError:
+                    return None
+                headings = scanner.scan_headings(text, StructureState.from_dict(grammar, final))
+                if headings:
+                    line_start, line_end, _, _ = headings[-1]
+                    heading = text[line_start:line_end].encode(codec)
+                    last = next(scanner.iter_chapters([text[line_start:]], StructureState.from_dict(grammar, resume)))
+                    return {
+                        "offset": start + skip + len(text[:line_start].encode(codec)),
+                        "heading_len": len(heading),
+                        "heading_sha1": hashlib.sha1(heading).hexdigest(),
+                        "number": last.number,
+                        "segment_chars": len(last.content),
+                        "structure": resume,
+                    }
+            if start == 0:
+                return None
+            window *= 2
+
+
+def _load_split_state(output_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(output_path, STATE_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_split_state(input_path: str, output_path: str, processor: TextProcessor, new_chapters: List[int]):
+    """记录最后一个标题的位置，供下次增量拆分；编码不支持时不记录"""
+    encoding = detect_encoding(input_path)
+    codec = _TAIL_CODECS.get(encoding)
+    last = locate_last_heading(input_path, codec, processor) if codec else None
+    state_path = os.path.join(output_path, STATE_FILENAME)
+    if last is None:
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return
+    state = {"source": os.path.abspath(input_path), "encoding": encoding, "codec": codec,
+             "size": os.path.getsize(input_path), "grammar": processor.grammar.to_dict(),
+             "last_heading": last, "new_chapters": new_chapters}
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+
+
+def _check_split_state(state: Optional[Dict[str, Any]], input_path: str, grammar: HeadingGrammar) -> Optional[str]:
+    """检查上次的拆分位置是否仍然有效，返回不能增量的原因，可以增量时返回None"""
+    if not state:
+        return "没有上次拆分的记录"
+    if state.get("source") != os.path.abspath(input_path):
+        return "源文件与上次不同"
+    if state.get("grammar") != grammar.to_dict():
+        return "章节标题文法与上次不同"
+    try:
+        if os.path.getsize(input_path) < state["size"]:
+            return "源文件变小了"
+        last = state["last_heading"]
+        with open(input_path, "rb") as f:
+            f.seek(last["offset"])
+            heading = f.read(last["heading_len"])
+    except (KeyError, TypeError):
+        return "上次拆分的记录格式不正确"
+    if hashlib.sha1(heading).hexdigest() != last["heading_sha1"]:
+        return "上次最后一个章节标题的位置已变化（源文件前部被修改）"
+    return None
+
+
+def split_novel_incremental(input_path: str, output_path: str, grammar: Optional[HeadingGrammar] = None) -> List[int]:
+    """
+    增量拆分：从上次最后一个章节标题处续读源文件，只重写内容有变化的章节文件
+
+    上次最后一章可能在源文件末尾继续增长，因此从它的标题开始重新拆分；
+    之后出现的章节是新章节，与已有章节号重复的内容追加到该章。
+    没有上次的记录、源文件前部被修改或编码不支持时，退回完整拆分（同样只重写有变化的文件，
+    并删除源文件中已不存在的章节）。
+
+    Args:
+        input_path: 小说txt路径
+        output_path: 章节输出目录
+        grammar: 章节标题文法，为None时读取 config.json 中的 HEADING_GRAMMAR
+
+    Returns:
+        新增的章节号列表
+    """
+    processor = TextProcessor(grammar or load_heading_grammar())
+    os.makedirs(output_path, exist_ok=True)
+    state = _load_split_state(output_path)
+    indexed = load_directory_index(output_path) or []
+    by_number = {e.number: e for e in indexed}
+
+    reason = _check_split_state(state, input_path, processor.grammar)
+    if reason is None and not indexed:
+        reason = "输出目录中没有章节索引"
+    text = None
+    resume = None
+    if reason is None:
+        last = state["last_heading"]
+        with open(input_path, "rb") as f:
+            f.seek(last["offset"])
+            tail = f.read()
+        try:
+            text = tail.decode(state["codec"])
+        except UnicodeDecodeError:
+            reason = "新增内容无法按上次的编码解码"
+    if text is None:
+        print(f"无法增量拆分（{reason}），完整拆分并跳过未变化的章节")
+        text = read_text_file(input_path)
+        by_number_old = by_number
+        by_number = {}
+        offset = 0
+        full = True
+    else:
+        by_number_old = by_number
+        offset = state["last_heading"]["offset"]
+        full = False
+        # 从上次最后一个标题续读：恢复该标题之前的层级状态（卷名、章节号偏移）
+        resume = StructureState.from_dict(processor.grammar, state["last_heading"].get("structure"))
+        print(f"增量拆分：从第 {offset} 字节（{_number_label(state['last_heading']['number'])}）开始，读取 {len(tail)} 字节")
+
+    # 按章节号汇总本次读到的内容（同号内容按出现顺序以换行拼接）
+    segments: Dict[int, List[str]] = {}
+    titles: Dict[int, str] = {}
+    volumes: Dict[int, str] = {}
+    for chapter in processor.iter_chapters([text], resume):
+        if chapter.number not in segments:
+            segments[chapter.number] = []
+            titles[chapter.number] = chapter.title
+            volumes[chapter.number] = chapter.volume
+        segments[chapter.number].append(chapter.content)
+
+    new_chapters, updated = [], []
+    for number, contents in segments.items():
+        body = '\n'.join(contents)
+        old_entry = by_number.get(number)
+        if old_entry is not None:
+            filename = old_entry.filename
+            old_text = read_text_file(os.path.join(output_path, filename))
+            if offset and number == state["last_heading"]["number"]:
+                # 上次最后一章：保留它在标题之前的内容（重复章节号的早先片段），替换最后一段
+                prefix = old_text[:len(old_text) - state["last_heading"]["segment_chars"]]
+                new_text = prefix + body
+            else:
+                new_text = old_text + '\n' + body
+        else:
+            chapter = Chapter(number, titles[number], content=body, volume=volumes[number])
+            filename = chapter_filename(chapter)
+            new_text = chapter_header(chapter) + body
+
+        previous = by_number_old.get(number)
+        if previous is None:
+            entry = text_entry(number, filename, titles[number], new_text, volumes[number])
+        else:
+            entry = text_entry(number, filename, previous.title, new_text, previous.volume)
+        output_file = os.path.join(output_path, filename)
+        if previous is not None and previous.sha1 == entry.sha1 and os.path.exists(output_file):
+            continue
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(new_text)
+        if previous is not None and previous.filename != filename:
+            # 完整拆分时标题变了：删除旧文件名的章节文件
+            stale = os.path.join(output_path, previous.filename)
+            if os.path.exists(stale):
+                os.remove(stale)
+        file_stat = os.stat(output_file)
+        entry.size, entry.mtime_ns = file_stat.st_size, file_stat.st_mtime_ns
+        if previous is None:
+            new_chapters.append(number)
+            print(f"新增章节: {filename}")
+        else:
+            updated.append(number)
+            print(f"更新章节: {filename}")
+        by_number_old[number] = entry
+
+    removed = []
+    if full:
+        # 完整拆分：源文件前部改动后不再出现的章节，从索引与输出目录中删除，避免 Query/合并继续处理它们
+        for number in sorted(set(by_number_old) - set(segments)):
+            stale = os.path.join(output_path, by_number_old.pop(number).filename)
+            if os.path.exists(stale):
+                os.remove(stale)
+            removed.append(number)
+            print(f"删除章节: {os.path.basename(stale)}（源文件中已没有该章）")
+
+    write_directory_index(output_path, [by_number_old[n] for n in sorted(by_number_old)])
+    if new_chapters or updated or removed:
+        flag_near_duplicates(output_path)
+    _save_split_state(input_path, output_path, processor, new_chapters)
+    print(f"增量拆分完成：新增 {len(new_chapters)} 章 {new_chapters}，更新 {len(updated)} 章 {updated}"
+          + (f"，删除 {len(removed)} 章 {removed}" if removed else ""))
+    return new_chapters
 
 
 if __name__ == "__main__":
  
     # 创建参数解析器
-    parser = argparse.ArgumentParser(description='按编号顺序合并目录中的txt文件')
+    parser = argparse.ArgumentParser(description='将整本小说按章节拆分为txt文件')
     parser.add_argument('-i', '--input_path', help='输入文件路径')
     parser.add_argument('-o', '--output_path', help='输出文件路径')    
+    parser.add_argument('--stream', action=argparse.BooleanOptionalAction, default=None,
+                        help='流式拆分（默认按文件大小自动选择）')
+    parser.add_argument('--pack', action='store_true', help=f'输出为单个打包文件（{PACK_SUFFIX}）')
+    parser.add_argument('--compress', action='store_true', help='打包时逐章压缩')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量拆分：只处理源文件新增的内容，只重写有变化的章节文件')
+    parser.add_argument('--dry-run', action='store_true', help='只输出识别出的章节结构报告，不写文件')
     args = parser.parse_args()
 
-    processor = TextProcessor()
-    test_text = read_text_file(args.input_path)
-    chapters = processor.split_chapters(test_text)
-    
-    # 创建输出目录
-    os.makedirs(args.output_path, exist_ok=True)
-    
-    # 保存每个章节为独立txt文件
-    for chapter in chapters:
-        # 生成文件名：第X章_标题_X.txt
-        chapter_title = f"第{chapter.number}章_{chapter.title.replace(' ', '').replace('　', '')}"
-        filename = f"{chapter_title}_{chapter.number}.txt"
-        # 清理非法字符
-        filename = "".join(c for c in filename if c not in r'\/:*?"<>|')
-        
-        # 保存文件
-        output_file = os.path.join(args.output_path, filename)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(f"{chapter_title}\n\n{chapter.content}")
-        print(f"保存章节: {filename}")
-    
-    print(f"完成！共保存 {len(chapters)} 个章节文件")
+    if args.dry_run:
+        print(format_structure_report(analyze_structure(args.input_path)))
+    elif args.incremental:
+        split_novel_incremental(args.input_path, args.output_path)
+    else:
+        # 保存每个章节为独立txt文件（或打包文件）
+        count = split_novel_file(args.input_path, args.output_path, stream=args.stream,
+                                 pack=args.pack, compress=args.compress)
+        print(f"完成！共保存 {count} 个章节文件")
@@ -3,24 +3,42 @@ import re
 import glob
 import asyncio
 import threading
+import contextlib
 import sys
+import time
 import argparse
 import json
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
 
 from utils.unified_chat import ModelRouter
+from utils.text_cache import get_text_cache
+from utils.chapter_store import ChapterEntry, open_chapter_source, is_chapter_store
+from utils.text_normalizer import TextNormalizer, load_normalization_config
+from utils.near_duplicates import DEDUPE_MODES, find_near_duplicates, load_near_duplicate_config
+from utils.search_index import ChapterSearchIndex
+from utils.retrieval import load_retrieval_config, select_regions
+from utils.cascade import CascadeConfig, build_question, load_cascade_config, parse_relevance, should_audit
+from utils.early_stop import ORDERS, StopCondition, load_early_stop_config
+from utils.summary_tier import SummaryTier, chapter_ref, choose_tier, read_manifest, same_chapters, write_manifest
+from utils.chapter_results import (ChapterResultStore, PerChapterConfig, build_prompt_template,
+                                   load_per_chapter_config, split_sections)
+from utils.structured_output import (StructuredOutputConfig, append_result, build_instruction, build_repair_prompt,
+                                     load_schema, load_structured_output_config, parse_and_validate, results_path)
+from utils.text_processor import estimate_tokens
 
 """
 使用LLM对小说章节进行批量的Query-Answer操作
 支持并发控制和断点重续
 """
 class Query:
-    def __init__(self, input_path:str, output_path:str,provider_id:str, model_id:str,concurrent:int,batch_size:int,prompt_path:str,name_prefix:str,start_pos:Optional[int]=None,end_pos:Optional[int]=None):
+    def __init__(self, input_path:str, output_path:str,provider_id:str, model_id:str,concurrent:int,batch_size:int,prompt_path:str,name_prefix:str,start_pos:Optional[int]=None,end_pos:Optional[int]=None,profile:Optional[str]=None,deadline:Optional[float]=None,max_retries:int=2,normalize:Optional[bool]=None,dedupe:Optional[str]=None,match:Optional[str]=None,retrieve:Optional[str]=None,keywords:Optional[List[str]]=None,top_k:Optional[int]=None,cascade:Optional[bool]=None,cascade_provider:Optional[str]=None,cascade_model:Optional[str]=None,cascade_threshold:Optional[float]=None,audit_rate:Optional[float]=None,stop_after:Optional[int]=None,stop_pattern:Optional[str]=None,stop_json:Optional[str]=None,order:Optional[str]=None,tiers:Optional[List[str]]=None,per_chapter:Optional[bool]=None,schema:Optional[str]=None,prefetch:Optional[int]=None):
         self.input_path = input_path
         self.output_path = output_path
         self.concurrent = concurrent
+        # 提前读取内容的批次数（None 表示与并发数相同）
+        self.prefetch = prefetch
         self.batch_size = batch_size
         self.prompt_path = prompt_path
         self.name_prefix = name_prefix
@@ -28,12 +46,87 @@ class Query:
         self.model_id = model_id
         self.start_pos = start_pos
         self.end_pos = end_pos
+        # 生成参数档案名（None 表示按 MODEL_PROFILES 映射或全局默认值）
+        self.profile = profile or None
+        # 整个任务的截止时间（秒，None 表示不限制）与单批次超时重试次数
+        self.deadline = deadline or None
+        self.max_retries = max_retries
+        # 是否规范化送入模型的文本（None 表示按 config.json 中 NORMALIZATION.enabled）
+        self.normalize = normalize
+        # 近似重复章节的处理方式（off/skip/stub，None 表示按 config.json 中 NEAR_DUPLICATES.query_mode）
+        if dedupe is not None and dedupe not in DEDUPE_MODES:
+            raise ValueError(f"未知的重复章节处理方式: {dedupe}（可选 {', '.join(DEDUPE_MODES)}）")
+        self.dedupe = dedupe
+        # 全文检索条件：只处理命中的章节（见 utils/search_index.py 的查询语法）
+        self.match = (match or "").strip() or None
+        # 检索预筛：按 BM25 与该描述最相关的 top_k 个区域（及相邻章节）才发送；keywords/top_k 为None时按 config.json 中 RETRIEVAL
+        self.retrieve = (retrieve or "").strip() or None
+        self.keywords = keywords
+        self.top_k = top_k
+        # 预筛得分：文件名 -> BM25 得分（只含选中的章节）
+        self._scores: Dict[str, float] = {}
+        # 级联：先由初筛模型判断批次是否相关（None 表示按 config.json 中 CASCADE）
+        self.cascade = cascade
+        self.cascade_provider = cascade_provider
+        self.cascade_model = cascade_model
+        self.cascade_threshold = cascade_threshold
+        self.audit_rate = audit_rate
+        self._cascade: Optional[CascadeConfig] = None
+        # 级联统计：初筛批次数、转发、跳过、抽查、抽查中主模型有结果、跳过的主模型输入token
+        self._cascade_stats = {"classified": 0, "forwarded": 0, "filtered": 0, "audited": 0,
+                               "audit_positive": 0, "saved_tokens": 0}
+        # 提前结束：命中 stop_after 个结果（可附加正则/JSON谓词）后取消其余批次；order 为批次执行顺序
+        if order is not None and order not in ORDERS:
+            raise ValueError(f"未知的批次执行顺序: {order}（可选 {', '.join(ORDERS)}）")
+        self.stop_after = stop_after
+        self.stop_pattern = stop_pattern or None
+        self.stop_json = stop_json or None
+        self.order = order
+        self._stop: Optional[StopCondition] = None
+        # 可用作输入的摘要结果目录：能覆盖所需章节且更便宜时代替原文（见 utils/summary_tier.py）
+        self.tiers = [d for d in (tiers or []) if d]
+        self._tier: Optional[SummaryTier] = None
+        # 本次规划的各批次覆盖的原文章节（批次号 -> 来源清单记录），批次完成后写入来源清单
+        self._provenance: Dict[int, List[Dict[str, object]]] = {}
+        self._kept_batches: List[int] = []
+        self._manifest_lock = threading.Lock()
+        # 逐章模式：回答按章节分段保存为逐章结果，可跨批次大小复用（None 表示按 config.json 中 PER_CHAPTER.enabled）
+        self.per_chapter = per_chapter
+        self._per_chapter: Optional[PerChapterConfig] = None
+        self._chapter_store: Optional[ChapterResultStore] = None
+        # 逐章模式下本次范围内的全部章节（含已有结果的），用于汇总
+        self._chapter_entries: List[ChapterEntry] = []
+        # 结构化输出：JSON Schema 文件路径；回答到达时校验，不合格的交给修复模型，结果写入 JSONL 结果库
+        self.schema = schema or None
+        self._schema: Optional[dict] = None
+        self._structured: Optional[StructuredOutputConfig] = None
+        # 结构化输出统计：首次合格、修复后合格、仍不合格、修复请求数
+        self._structured_stats = {"valid": 0, "repaired": 0, "invalid": 0, "repair_calls": 0}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._deadline_at = None
+        self._source = None
+        self._normalizer = None
+        # 规范化前后的输入token估算 [原始, 规范化后]
+        self._token_stats = [0, 0]
+        # stub 模式下重复章节的文件名 -> 保留的章节
+        self._duplicates: Dict[str, ChapterEntry] = {}
+        # 多个 prompt 共用一次读取时（见 app/multi_query.py）共享的批次内容缓存，以及日志中区分任务的标签
+        self._content_cache = None
+        self.label = ""
         self.router = ModelRouter()
 
         # 并发状态与取消控制
         self._active = 0
-        self._active_lock = asyncio.Lock()
         self._cancel_event = threading.Event()
+        # 并发槽位（只在请求模型期间占用）与流水线位置（读取内容到批次结束），由 _prepare_run 设置
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pipeline: Optional[asyncio.Semaphore] = None
+        self._prompt_template = ""
+        self._prompt_parts: List[str] = ["", ""]
+        self._question_parts: Optional[List[str]] = None
+        self._stats_lock = threading.Lock()
+        # 在线程池中写结果库、逐章结果索引时串行化（同一文件的追加与整体替换不能交错）
+        self._io_lock = threading.Lock()
 
     def request_cancel(self):
         """由外部（如UI）调用，发出中止请求。
@@ -45,6 +138,36 @@ class Query:
         """清理中止标志，避免影响下次运行。"""
         self._cancel_event.clear()
 
+    def _prepare_run(self, slots: asyncio.Semaphore, pipeline: asyncio.Semaphore):
+        """
+        开始执行前的准备：设置并发槽位与流水线位置，编译 prompt 模板（每个任务只读取、拼接一次）
+
+        Args:
+            slots: 并发槽位，只在请求模型期间占用
+            pipeline: 流水线位置，从读取批次内容到批次结束期间占用
+        """
+        self._slots = slots
+        self._pipeline = pipeline
+        self._prompt_template = self._load_prompt_template()
+        template = self._prompt_template
+        # 逐章模式：要求模型按章节分段作答；结构化输出：要求输出符合 schema 的JSON
+        if self._per_chapter is not None:
+            template = build_prompt_template(self._per_chapter, template)
+        if self._schema is not None:
+            template += build_instruction(self._structured, self._schema)
+        self._prompt_parts = template.split("{input_content}")
+        self._question_parts = (build_question(self._cascade, self._prompt_template).split("{input_content}")
+                                if self._cascade is not None else None)
+
+    def _render_prompt(self, batch_content: str) -> str:
+        """用编译好的模板生成主模型的 prompt"""
+        return batch_content.join(self._prompt_parts)
+
+    @property
+    def prompt_head(self) -> str:
+        """编译好的 prompt 中 {input_content} 之前的部分（同一任务各请求的公共前缀）"""
+        return self._prompt_parts[0]
+
     def _load_prompt_template(self) -> str:
         try:
             with open(self.prompt_path, "r", encoding="utf-8") as f:
@@ -53,23 +176,60 @@ class Query:
             raise RuntimeError(f"读取 Prompt 文件 '{self.prompt_path}' 时发生未知错误: {str(e)}")
         return prompt_template
     
-    async def _call_llm(self,prompt:str)->str:
+    def _remaining_time(self) -> Optional[float]:
+        """距离任务截止时间的剩余秒数，未设置截止时间时返回None"""
+        if self._deadline_at is None:
+            return None
+        return self._deadline_at - time.monotonic()
+
+    async def _call_llm(self,prompt:str,provider:Optional[str]=None,model:Optional[str]=None,profile:Optional[str]=None,json_schema:Optional[dict]=None)->str:
+        """调用模型（默认为主模型），只在超时时退避重试；给出 json_schema 时要求结构化输出"""
+        provider = provider or self.provider_id
+        model = model or self.model_id
+        profile = profile or self.profile
+        extra = {"json_schema": json_schema} if json_schema is not None else {}
         try:
-            # 使用LLMrouter调用API
-            response = await self.router.chat(
-                model_name=self.model_id,
-                provider=self.provider_id,
-                message=prompt
-            )
-            # 检查响应是否成功
-            if response.get("success", True) and "content" in response:
-                return response["content"]
-            else:
+            for attempt in range(self.max_retries + 1):
+                remaining = self._remaining_time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("已超过任务截止时间")
+
+                # 使用LLMrouter调用API，单次请求不会超过任务剩余时间；只在请求期间占用并发槽位
+                async with self._slots if self._slots is not None else contextlib.nullcontext():
+                    # 等待槽位期间可能已收到中止请求或超过截止时间
+                    if self._cancel_event.is_set():
+                        raise RuntimeError("收到中止请求")
+                    remaining = self._remaining_time()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("已超过任务截止时间")
+                    self._active += 1
+                    try:
+                        response = await self.router.chat(
+                            model_name=model,
+                            provider=provider,
+                            message=prompt,
+                            profile=profile,
+                            deadline=remaining,
+                            **extra
+                        )
+                        # 档案中 stream 为 true 时在占用槽位期间读完各块，拼接为完整回答
+                        response = await self.router.collect_stream(response)
+                    finally:
+                        self._active -= 1
+                # 检查响应是否成功
+                if response.get("success", True) and "content" in response:
+                    return response["content"]
+
                 error_msg = response.get("error", "未知错误")
+                # 只有超时才重试，退避后再发起
+                if response.get("error_type") == "timeout" and attempt < self.max_retries:
+                    print(f"{error_msg}，第 {attempt + 1} 次重试")
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                    continue
                 raise Exception(f"API调用失败: {error_msg}")
 
         except Exception as e:
-            raise Exception(f"调用{self.provider_id}/{self.model_id} API失败: {str(e)}")
+            raise Exception(f"调用{provider}/{model} API失败: {str(e)}")
 
     def _get_existing_results(self) -> set:
         """
@@ -89,93 +249,537 @@ class Query:
                 batch_num = int(match.group(1))
                 existing.add(batch_num)
 
+        if self._cascade is not None:
+            # 级联模式下被初筛判为无关（且未抽查）的批次也算已完成
+            pattern = os.path.join(self.output_path, f"{self.name_prefix}_bs{self.batch_size}_批次*_初筛.json")
+            for file_path in glob.glob(pattern):
+                try:
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        record = json.load(f)
+                    if not record.get("forwarded"):
+                        existing.add(int(record["batch"]))
+                except (OSError, ValueError, KeyError, TypeError):
+                    continue
+
         return existing
 
-    def _natural_sort_files(self, files: List[str]) -> List[str]:
+    def plan_batches(self, source=None) -> List[Tuple[int, List[ChapterEntry]]]:
         """
-        对文件列表进行自然排序，只提取最后的下划线后面的数字进行排序
-        例如：第140章__不懂规矩？_140.txt → 提取140，章节提取_140.txt → 提取140
+        规划本次需要处理的批次：列出并排序输入章节、应用位置范围、跳过已完成的批次
+
+        输入可以是章节目录（顺序与统计信息来自 index.json，缺失或过期时自动重建），也可以是章节打包文件
+
+        Args:
+            source: 已打开的章节输入（多个任务共用同一输入时传入，避免重复列出与排序），None 时按 input_path 打开
+
+        Returns:
+            [(批次号, 该批次的章节列表)]，批次号从1开始；没有需要处理的批次时返回空列表
         """
-        def natural_key(filename):
-            # 提取文件名中的数字
-            basename = os.path.basename(filename)
-            
-            # 只匹配最后的下划线后面的数字（如_140.txt中的140）
-            match = re.search(r'_(\d+)\.txt$', basename)
-            if match:
-                return int(match.group(1))
-            
-            # 如果没有找到最后的下划线数字，按文件名排序
-            return (float('inf'), basename)
-        
-        return sorted(files, key=natural_key)
+        self._source = source if source is not None else open_chapter_source(self.input_path)
+        self._cascade = self._resolve_cascade()
+        self._resolve_structured()
+        txt_files = self._source.entries
+        if not txt_files:
+            if is_chapter_store(self.input_path):
+                print(f"打包文件 {self.input_path} 中没有章节")
+            else:
+                print(f"在 {self.input_path} 中没有找到txt文件")
+            return []
+        self._prepare_normalizer(txt_files)
 
-    async def process_query(self):
+        # 应用起始和终止位置过滤（左闭右闭，以1为开始）
+        if self.start_pos is not None or self.end_pos is not None:
+            start_idx = (self.start_pos - 1) if self.start_pos is not None else 0
+            end_idx = self.end_pos if self.end_pos is not None else len(txt_files)
+            # 确保索引在有效范围内
+            start_idx = max(0, start_idx)
+            end_idx = min(len(txt_files), end_idx)
+            if start_idx >= end_idx:
+                print(f"起始位置 {self.start_pos} 大于等于终止位置 {self.end_pos}，没有文件需要处理")
+                return []
+            txt_files = txt_files[start_idx:end_idx]
+            print(f"根据位置范围 [{self.start_pos or 1}, {self.end_pos or len(txt_files)}] 过滤后，找到 {len(txt_files)} 个txt文件")
+        else:
+            print(f"总共找到 {len(txt_files)} 个txt文件")
+        if self.match:
+            txt_files = self._apply_match(txt_files)
+            if not txt_files:
+                return []
+        if self.retrieve:
+            txt_files = self._apply_retrieval(txt_files)
+            if not txt_files:
+                return []
+        self._tier = None
+        if self.tiers:
+            txt_files = self._apply_tier(txt_files)
+        txt_files = self._apply_dedupe(txt_files)
+        print(f"输入共约 {sum(e.tokens for e in txt_files):,} tokens（估算）")
+
+        batch_size = int(self.batch_size)
+        self._per_chapter = self._resolve_per_chapter()
+        if self._per_chapter is not None and self._schema is not None:
+            raise ValueError("结构化输出要求整个回答是一个JSON，不能与逐章模式同时使用")
+        if self._per_chapter is not None:
+            # 逐章模式：已有结果的章节不再发送，其余章节重新划分批次（批次号只在本次运行内有效）
+            txt_files = self._pending_chapters(txt_files)
+            existing = set()
+        else:
+            # 检查已存在的批次
+            existing = self._get_existing_results()
+
+        # 计算批次信息（批次号从1开始）
+        total_batches = (len(txt_files) + batch_size - 1) // batch_size
+        self._provenance = {}
+        if self._per_chapter is None:
+            self._provenance = self._plan_provenance(txt_files, batch_size)
+            existing = self._drop_stale(existing)
+
+        missing_batches = [i+1 for i in range(total_batches) if i+1 not in existing]
+        # 本次规划中沿用的已有批次（不含章节与规划不符、将重新处理的批次），供停止条件计入之前的命中
+        self._kept_batches = sorted(n for n in existing if 1 <= n <= total_batches)
+
+        if not missing_batches:
+            print("所有批次都已完成，无需重新处理")
+            return []
+
+        print(f"需要处理 {len(missing_batches)} 个批次")
+
+        # 批次号从1开始，计算文件索引时要减1
+        # 输入批次和处理批次的顺序是对应上的，是从头开始按顺序读
+        plan = []
+        for batch_num in missing_batches:
+            start_idx = (batch_num - 1) * batch_size
+            end_idx = min(start_idx + batch_size, len(txt_files))
+            plan.append((batch_num, txt_files[start_idx:end_idx]))
+        return plan
+
+    def _apply_tier(self, entries: List[ChapterEntry]) -> List[ChapterEntry]:
+        """在原文与 self.tiers 中的摘要层级之间选出最便宜且覆盖全部所需章节的输入"""
+        tier, tier_entries = choose_tier(entries, self.tiers)
+        raw_tokens = sum(e.tokens for e in entries)
+        if tier is None:
+            print(f"输入层级: 原文（{len(entries)} 章，约 {raw_tokens:,} tokens）")
+            return entries
+        tokens = sum(e.tokens for e in tier_entries)
+        print(f"输入层级: {tier.name}（{len(tier_entries)} 项，约 {tokens:,} tokens，原文约 {raw_tokens:,} tokens）")
+        if self._scores:
+            # 检索预筛得分换算到摘要项：取其覆盖章节的最高分
+            self._scores = {e.filename: max(self._scores.get(c["filename"], 0.0) for c in tier.covers[e.filename])
+                            for e in tier_entries}
+        self._tier = tier
+        self._source = tier
+        self._prepare_normalizer(tier.entries)
+        return tier_entries
+
+    def _plan_provenance(self, entries: List[ChapterEntry], batch_size: int) -> Dict[int, List[Dict[str, object]]]:
+        """本次规划的每个批次覆盖的原文章节（使用摘要层级时为摘要所覆盖的原文章节）"""
+        batches = {}
+        for i in range(0, len(entries), batch_size):
+            chapters = []
+            for entry in entries[i:i + batch_size]:
+                chapters.extend(self._tier.covers[entry.filename] if self._tier is not None else [chapter_ref(entry)])
+            batches[i // batch_size + 1] = chapters
+        return batches
+
+    def _drop_stale(self, existing: set) -> set:
         """
-        对input_path下的所有txt文件进行处理，每次处理batch_size个文件，
-        分别调用_process_with_semaphore处理
+        已有批次的来源清单记录与本次规划的章节不同（换了位置范围、检索条件、去重方式等，批次号对应的章节变了）时，
+        该批次的结果不是本次规划的内容，不算已完成，重新处理后覆盖。没有清单记录的旧结果仍视为已完成
         """
+        recorded = read_manifest(self.output_path, self.name_prefix, self.batch_size)
+        stale = sorted(n for n in existing
+                       if n in recorded and n in self._provenance and not same_chapters(recorded[n], self._provenance[n]))
+        if stale:
+            print(f"批次 {stale} 的已有结果对应的章节与本次规划不同，将重新处理并覆盖"
+                  f"（如需保留旧结果，请换用新的输出前缀）")
+        return existing - set(stale)
+
+    def _record_provenance(self, batch_num: int):
+        """批次完成后在来源清单中记录它覆盖的原文章节"""
+        chapters = self._provenance.get(batch_num)
+        if chapters is None:
+            return
         try:
-            # 获取所有txt文件
-            txt_files = glob.glob(os.path.join(self.input_path, "*.txt"))
-            if not txt_files:
-                print(f"在 {self.input_path} 中没有找到txt文件")
-                return
+            with self._manifest_lock:
+                write_manifest(self.output_path, self.name_prefix, self.batch_size, self.input_path, self.prompt_path,
+                               {batch_num: chapters}, tier=self._tier.name if self._tier is not None else "raw")
+        except OSError as e:
+            print(f"写入来源清单失败（不影响本次处理）: {str(e)}")
 
-            # 按自然排序对文件进行排序
-            txt_files = self._natural_sort_files(txt_files)
-
-            # 应用起始和终止位置过滤（左闭右闭，以1为开始）
-            if self.start_pos is not None or self.end_pos is not None:
-                start_idx = (self.start_pos - 1) if self.start_pos is not None else 0
-                end_idx = self.end_pos if self.end_pos is not None else len(txt_files)
-                # 确保索引在有效范围内
-                start_idx = max(0, start_idx)
-                end_idx = min(len(txt_files), end_idx)
-                if start_idx >= end_idx:
-                    print(f"起始位置 {self.start_pos} 大于等于终止位置 {self.end_pos}，没有文件需要处理")
-                    return
-                txt_files = txt_files[start_idx:end_idx]
-                print(f"根据位置范围 [{self.start_pos or 1}, {self.end_pos or len(txt_files)}] 过滤后，找到 {len(txt_files)} 个txt文件")
+    def _resolve_structured(self):
+        """读取 JSON Schema 与 STRUCTURED_OUTPUT 设置；未指定 schema 时关闭结构化输出"""
+        self._schema = None
+        self._structured = None
+        if not self.schema:
+            return
+        self._schema = load_schema(self.schema)
+        self._structured = load_structured_output_config()
+        repair = (f"{self._structured.repair_provider}/{self._structured.repair_model}"
+                  if self._structured.repair_model else "主模型")
+        print(f"结构化输出: {self.schema}，不合格的回答最多修复 {self._structured.max_repairs} 次（{repair}），"
+              f"结果库 {results_path(self.output_path, self.name_prefix, self.batch_size)}")
+
+    async def _check_structured(self, result: str, batch_files: List[ChapterEntry], batch_num: int) -> str:
+        """
+        校验结构化输出，不合格时只把回答与错误说明交给修复模型；结果（含不合格的）追加到结果库
+
+        Returns:
+            合格结果的JSON文本（统一格式）
+
+        Raises:
+            Exception: 修复后仍不合格（不写批次文件，下次运行时重新处理）
+        """
+        config = self._structured
+        value, errors = parse_and_validate(result, self._schema)
+        repairs = 0
+        while errors and repairs < config.max_repairs:
+            repairs += 1
+            self._structured_stats["repair_calls"] += 1
+            print(f"批次 {batch_num} 的回答未通过校验（{'；'.join(errors[:3])}），第 {repairs} 次修复")
+            result = await self._call_llm(build_repair_prompt(config, self._schema, result, errors),
+                                          config.repair_provider or None, config.repair_model or None,
+                                          config.repair_profile or None, json_schema=self._schema)
+            value, errors = parse_and_validate(result, self._schema)
+        record = {"batch": batch_num, "chapters": [{"number": e.number, "filename": e.filename} for e in batch_files],
+                  "valid": not errors, "repairs": repairs, "data": value if not errors else None,
+                  "errors": errors, "raw": result if errors else None}
+        await asyncio.to_thread(self._locked, append_result,
+                                results_path(self.output_path, self.name_prefix, self.batch_size), record)
+        if errors:
+            self._structured_stats["invalid"] += 1
+            raise Exception(f"结构化输出修复 {repairs} 次后仍不合格: {'；'.join(errors[:3])}")
+        self._structured_stats["repaired" if repairs else "valid"] += 1
+        return json.dumps(value, ensure_ascii=False, indent=1)
+
+    def _resolve_per_chapter(self) -> Optional[PerChapterConfig]:
+        """合并 config.json 中的 PER_CHAPTER 与构造参数；未启用时返回None"""
+        self._chapter_store = None
+        config = load_per_chapter_config()
+        if not (config.enabled if self.per_chapter is None else self.per_chapter):
+            return None
+        self._chapter_store = ChapterResultStore(self.output_path, self.name_prefix)
+        return config
+
+    def _pending_chapters(self, entries: List[ChapterEntry]) -> List[ChapterEntry]:
+        """逐章模式：去掉已有结果（且原文未改动）的章节；级联模式下被初筛判为无关的章节也去掉"""
+        self._chapter_entries = entries
+        cascade = self._cascade is not None
+        pending = [e for e in entries if not self._chapter_store.has(e, cascade)]
+        print(f"逐章模式: {len(entries)} 章中已有 {len(entries) - len(pending)} 章的结果"
+              f"（{self._chapter_store.path}），本次处理 {len(pending)} 章")
+        return pending
+
+    def _assemble_chapters(self):
+        """逐章模式：按章节顺序汇总已有的逐章结果"""
+        if self._chapter_store is None or not self._chapter_entries:
+            return
+        path = self._chapter_store.assemble(self._chapter_entries)
+        if path:
+            print(f"逐章结果已汇总到: {path}")
+
+    async def _demux_result(self, result: str, batch_files: List[ChapterEntry], batch_num: int) -> Dict[str, str]:
+        """
+        逐章模式：把批次回答拆成逐章结果并保存；缺失的章节按设置单独重新发送
+
+        Returns:
+            {文件名: 该章的回答}（按批次中的章节顺序）
+        """
+        sections = split_sections(result, batch_files)
+        missing = [e for e in batch_files if e.filename not in sections]
+        if missing:
+            print(f"批次 {batch_num} 的回答缺少 {len(missing)} 章: {[e.filename for e in missing]}")
+        for entry in missing:
+            keep = self._duplicates.get(entry.filename)
+            if keep is not None:
+                sections[entry.filename] = f"（与第{keep.number}章内容近似重复，见该章结果）"
+                continue
+            if not self._per_chapter.requeue:
+                continue
+            if self._cancel_event.is_set() or (self._stop is not None and self._stop.hits >= self._stop.after):
+                break
+            content = await self._read_batch_content([entry])
+            if not content:
+                continue
+            answer = await self._call_llm(self._render_prompt(content))
+            section = split_sections(answer, [entry]).get(entry.filename)
+            if section:
+                sections[entry.filename] = section
+                print(f"批次 {batch_num}: 单独重新发送 {entry.filename}，已补全")
             else:
-                print(f"总共找到 {len(txt_files)} 个txt文件")
+                print(f"批次 {batch_num}: 单独重新发送 {entry.filename} 仍没有结果，下次运行时会继续处理")
+        ordered = {e.filename: sections[e.filename] for e in batch_files if e.filename in sections}
+        await asyncio.to_thread(self._save_chapters, [(e, ordered[e.filename]) for e in batch_files
+                                                      if e.filename in ordered])
+        return ordered
 
-            if self._cancel_event.is_set():
-                print("收到中止请求，未开始创建任务，直接退出")
-                return
+    def _save_chapters(self, results: List[Tuple[ChapterEntry, Optional[str]]]):
+        """逐章模式：保存逐章结果（结果为None表示被初筛判为无关）并写出索引，在线程池中调用"""
+        with self._io_lock:
+            for entry, result in results:
+                if result is None:
+                    self._chapter_store.mark_filtered(entry)
+                else:
+                    self._chapter_store.put(entry, result)
+            self._chapter_store.save()
 
-            # 检查已存在的批次
-            existing = self._get_existing_results()
+    def _locked(self, func, *args):
+        """持有 _io_lock 调用 func，在线程池中调用"""
+        with self._io_lock:
+            return func(*args)
+
+    def _prepare_normalizer(self, entries: List[ChapterEntry]):
+        """按设置创建文本规范化器，并从全部章节中均匀抽样学习水印/广告行"""
+        config = load_normalization_config()
+        enabled = config.enabled if self.normalize is None else self.normalize
+        if not enabled:
+            self._normalizer = None
+            return
+        self._normalizer = TextNormalizer(config)
+        if not config.learn_boilerplate:
+            return
+        step = max(1, -(-len(entries) // max(1, config.boilerplate_sample)))
+        sample = entries[::step]
+        learned = self._normalizer.learn(self._source.iter_read(sample))
+        print(f"文本规范化: 从 {len(sample)} 章中学习到 {len(learned)} 条水印/广告行")
+        for line, count in learned[:5]:
+            print(f"  [{count}章] {line}")
+
+    def _order_plan(self, plan: List[Tuple[int, List[ChapterEntry]]]) -> List[Tuple[int, List[ChapterEntry]]]:
+        """按执行顺序排列批次：ranked 时按批次内章节的最高检索预筛得分从高到低"""
+        order = self.order or load_early_stop_config().order
+        if order != "ranked":
+            return plan
+        if not self._scores:
+            print("没有检索预筛得分（未使用 --retrieve），按批次顺序执行")
+            return plan
+        print("按检索预筛得分从高到低执行批次")
+        return sorted(plan, key=lambda item: -max(self._scores.get(e.filename, 0.0) for e in item[1]))
+
+    def _prepare_stop_condition(self) -> bool:
+        """
+        创建停止条件，并计入之前运行已完成、且本次沿用的批次中的命中
+
+        Returns:
+            是否已经满足停止条件（无需再运行）
+        """
+        self._stop = None
+        if self.stop_after is None and self.stop_pattern is None and self.stop_json is None:
+            return False
+        config = load_early_stop_config()
+        self._stop = StopCondition(self.stop_after, self.stop_pattern, self.stop_json, config.negative_pattern)
+        print(f"停止条件: {self._stop.describe()}")
+        if self._chapter_store is not None:
+            # 逐章模式：已有的逐章结果逐条计入
+            for entry in self._chapter_entries:
+                result = self._chapter_store.read(entry)
+                if result is not None and self._stop.record(result):
+                    print(f"已有的逐章结果中已有 {self._stop.hits} 个命中，满足停止条件，无需继续")
+                    return True
+            if self._stop.hits:
+                print(f"已有的逐章结果中已有 {self._stop.hits} 个命中")
+            return False
+        for batch_num in self._kept_batches:
+            output_file = os.path.join(self.output_path, f"{self.name_prefix}_bs{self.batch_size}_批次{batch_num}.txt")
+            try:
+                with open(output_file, "r", encoding="utf-8") as f:
+                    done = self._stop.record(f.read())
+            except OSError:
+                continue
+            if done:
+                print(f"之前完成的批次中已有 {self._stop.hits} 个命中，满足停止条件，无需继续")
+                return True
+        if self._stop.hits:
+            print(f"之前完成的批次中已有 {self._stop.hits} 个命中")
+        return False
+
+    def _check_stop(self, batch_num: int, result: str):
+        """记录一个批次的结果；满足停止条件时取消其余批次（排队中与请求中的）"""
+        if self._stop is None or self._stop.hits >= self._stop.after:
+            return
+        hit = self._stop.is_hit(result)
+        if not self._stop.record(result):
+            if hit:
+                print(f"批次 {batch_num} 命中（{self._stop.hits}/{self._stop.after}）")
+            return
+        print(f"批次 {batch_num} 命中（{self._stop.hits}/{self._stop.after}），满足停止条件，取消其余批次")
+        current = asyncio.current_task()
+        for task in self._tasks.values():
+            if task is not current and not task.done():
+                task.cancel()
+
+    def _resolve_cascade(self) -> Optional[CascadeConfig]:
+        """合并 config.json 中的 CASCADE 与构造参数；未启用时返回None"""
+        config = load_cascade_config()
+        if not (config.enabled if self.cascade is None else self.cascade):
+            return None
+        config.provider = self.cascade_provider or config.provider
+        config.model = self.cascade_model or config.model
+        if self.cascade_threshold is not None:
+            config.threshold = self.cascade_threshold
+        if self.audit_rate is not None:
+            config.audit_rate = self.audit_rate
+        if not config.provider or not config.model:
+            raise ValueError("级联模式需要指定初筛模型（CASCADE.provider 与 CASCADE.model，或 --cascade_provider/--cascade_model）")
+        print(f"级联模式: 初筛模型 {config.provider}/{config.model}，阈值 {config.threshold}，抽查比例 {config.audit_rate:.0%}")
+        return config
+
+    def _cascade_record_path(self, batch_num: int) -> str:
+        return os.path.join(self.output_path, f"{self.name_prefix}_bs{self.batch_size}_批次{batch_num}_初筛.json")
 
-            # 计算批次信息（批次号从1开始）
-            batch_size = int(self.batch_size)
-            total_batches = (len(txt_files) + batch_size - 1) // batch_size
+    async def _classify_batch(self, batch_content: str, batch_files: List[ChapterEntry], batch_num: int) -> bool:
+        """
+        级联初筛：由初筛模型判断批次是否相关，记录到 *_初筛.json
+
+        Returns:
+            是否交给主模型（相关，或被抽查）
+        """
+        config = self._cascade
+        question = batch_content.join(self._question_parts)
+        answer = await self._call_llm(question, config.provider, config.model, config.profile or None)
+        score = parse_relevance(answer)
+        relevant = score is None or score >= config.threshold
+        audit = not relevant and should_audit(f"{self.name_prefix}-{batch_num}", config.audit_rate)
+        record = {"batch": batch_num, "chapters": [e.filename for e in batch_files],
+                  "model": f"{config.provider}/{config.model}", "answer": answer.strip(), "score": score,
+                  "threshold": config.threshold, "forwarded": relevant or audit, "audit": audit}
+        await asyncio.to_thread(self._write_json, self._cascade_record_path(batch_num), record)
 
-            missing_batches = [i+1 for i in range(total_batches) if i+1 not in existing]
+        stats = self._cascade_stats
+        stats["classified"] += 1
+        if relevant or audit:
+            stats["forwarded"] += 1
+            stats["audited"] += audit
+        else:
+            stats["filtered"] += 1
+            stats["saved_tokens"] += estimate_tokens(self._prompt_template) + estimate_tokens(batch_content)
+        verdict = "相关" if relevant else ("无关，抽查" if audit else "无关，跳过")
+        print(f"批次 {batch_num} 初筛: {'无法解析' if score is None else score}（{verdict}）")
+        return relevant or audit
+
+    def _finish_audit(self, batch_num: int, result: str):
+        """抽查批次的主模型结果：记录主模型是否有结果，用于估计漏检率（读写记录文件，在线程池中调用）"""
+        path = self._cascade_record_path(batch_num)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not record.get("audit"):
+            return
+        record["main_positive"] = not re.search(self._cascade.negative_pattern, result.strip())
+        with self._stats_lock:
+            self._cascade_stats["audit_positive"] += record["main_positive"]
+        self._write_json(path, record)
+
+    def _apply_match(self, entries: List[ChapterEntry]) -> List[ChapterEntry]:
+        """按全文检索只保留命中 self.match 的章节（索引缺失或过期时先增量更新）"""
+        index = ChapterSearchIndex.open(self.input_path, source=self._source)
+        hits = index.search(self.match, max_snippets=0)
+        matched = {hit.filename for hit in hits}
+        entries = [e for e in entries if e.filename in matched]
+        if not entries:
+            print(f"检索「{self.match}」没有命中的章节，没有文件需要处理")
+            return []
+        print(f"检索「{self.match}」命中 {len(entries)} 章: {[e.number for e in entries][:50]}"
+              f"{' …' if len(entries) > 50 else ''}")
+        return entries
+
+    def _apply_retrieval(self, entries: List[ChapterEntry]) -> List[ChapterEntry]:
+        """检索预筛：在当前章节中按 BM25 选出与 self.retrieve 最相关的区域（索引缺失或过期时先增量更新）"""
+        config = load_retrieval_config()
+        index = ChapterSearchIndex.open(self.input_path, source=self._source)
+        keywords = config.keywords if self.keywords is None else self.keywords
+        ranked = index.rank(self.retrieve, keywords, config.keyword_weight, config.k1, config.b)
+        local = {e.filename: i for i, e in enumerate(entries, 1)}
+        all_entries = self._source.entries
+        ranked = [(local[all_entries[p - 1].filename], score) for p, score in ranked
+                  if all_entries[p - 1].filename in local]
+        top_k = config.top_k if self.top_k is None else self.top_k
+        regions = select_regions(ranked, len(entries), top_k, config.neighbors, config.window,
+                                 config.min_score_ratio)
+        if not regions:
+            print("检索预筛: 没有与描述相关的章节，没有文件需要处理")
+            return []
+        scores = dict(ranked)
+        selected = [entries[p - 1] for start, end in regions for p in range(start, end + 1)]
+        self._scores = {entries[p - 1].filename: scores.get(p, 0.0)
+                        for start, end in regions for p in range(start, end + 1)}
+        print(f"检索预筛: 从 {len(entries)} 章中选出 {len(selected)} 章（{len(regions)} 个区域，top_k={top_k}，"
+              f"前后各扩展 {config.neighbors} 章），约 {sum(e.tokens for e in selected):,} / "
+              f"{sum(e.tokens for e in entries):,} tokens")
+        print("  区域: " + "，".join(f"第{entries[s - 1].number}-{entries[e - 1].number}章" if s != e
+                                   else f"第{entries[s - 1].number}章" for s, e in regions))
+        return selected
+
+    def _apply_dedupe(self, entries: List[ChapterEntry]) -> List[ChapterEntry]:
+        """
+        检测本次范围内的近似重复章节：skip 模式下移除重复章节，stub 模式下记录下来在组装批次时以一行说明代替正文
+
+        Returns:
+            处理后的章节列表
+        """
+        config = load_near_duplicate_config()
+        mode = self.dedupe or config.query_mode
+        self._duplicates = {}
+        if mode == "off":
+            return entries
+        groups = find_near_duplicates(((i, self._source.read(e)) for i, e in enumerate(entries)),
+                                      threshold=config.threshold, min_chars=config.min_chars,
+                                      reader=lambda i: self._source.read(entries[i]))
+        duplicates = {}
+        for group in groups:
+            for i, score in group.duplicates:
+                duplicates[i] = entries[group.keep]
+                print(f"近似重复: {entries[i].filename} ≈ {entries[group.keep].filename}（相似度 {score:.0%}）")
+        if not duplicates:
+            print("没有发现近似重复章节")
+            return entries
+        tokens = sum(entries[i].tokens for i in duplicates)
+        if mode == "skip":
+            print(f"近似重复: 跳过 {len(duplicates)} 章，约 {tokens:,} tokens 不再发送")
+            return [e for i, e in enumerate(entries) if i not in duplicates]
+        self._duplicates = {entries[i].filename: keep for i, keep in duplicates.items()}
+        print(f"近似重复: {len(duplicates)} 章以说明代替正文，约 {tokens:,} tokens 不再发送")
+        return entries
+
+    async def process_query(self):
+        """
+        对input_path下的所有txt文件进行处理，每次处理batch_size个文件，
+        分别调用_process_with_semaphore处理
+        """
+        try:
+            plan = self.plan_batches()
+            if not plan:
+                self._assemble_chapters()
+                return
+            plan = self._order_plan(plan)
+            if self._prepare_stop_condition():
+                return
 
-            if not missing_batches:
-                print("所有批次都已完成，无需重新处理")
+            if self._cancel_event.is_set():
+                print("收到中止请求，未开始创建任务，直接退出")
                 return
 
-            print(f"需要处理 {len(missing_batches)} 个批次")
+            if self.deadline is not None:
+                self._deadline_at = time.monotonic() + self.deadline
+                print(f"任务截止时间: {self.deadline} 秒，超时未开始的批次将被跳过")
 
-            # 使用信号量控制并发数
-            semaphore = asyncio.Semaphore(self.concurrent)
+            # 并发槽位控制同时进行的请求数；流水线位置多出 prefetch 个，用于提前读取后续批次的内容
+            prefetch = self.concurrent if self.prefetch is None else max(0, self.prefetch)
+            self._prepare_run(asyncio.Semaphore(self.concurrent), asyncio.Semaphore(self.concurrent + prefetch))
 
             # 准备异步任务
             tasks = []
-            for batch_num in missing_batches:
+            missing_batches = []
+            self._tasks = {}
+            for batch_num, batch_files in plan:
                 if self._cancel_event.is_set():
                     print("收到中止请求，停止创建剩余任务")
                     break
-                # 批次号从1开始，计算文件索引时要减1
-                # 输入批次和处理批次的顺序是对应上的，是从头开始按顺序读
-                start_idx = (batch_num - 1) * batch_size
-                end_idx = min(start_idx + batch_size, len(txt_files))
-                batch_files = txt_files[start_idx:end_idx]
-
-                task = asyncio.create_task(self._process_batch_with_semaphore(semaphore, batch_files, batch_num))
+                missing_batches.append(batch_num)
+                task = asyncio.create_task(self._process_batch(batch_files, batch_num))
                 tasks.append(task)
+                self._tasks[batch_num] = task
 
             if not tasks:
                 print("没有任务需要执行或已被中止")
@@ -186,27 +790,117 @@ class Query:
             # 直接执行所有任务
             results = await asyncio.gather(*tasks, return_exceptions=True)
 
-            # 处理结果
-            for i, result in enumerate(results):
-                batch_no = missing_batches[i]
-                if isinstance(result, Exception):
-                    print(f"批次 {batch_no} 处理失败: {str(result)}")
-                elif isinstance(result, str) and result == "cancelled":
-                    #print(f"批次 {batch_no} 已跳过（收到中止请求）")
-                    pass
-                else:
-                    print(f"批次 {batch_no} 处理成功")
+            self._report_results(missing_batches, results)
+            stats = get_text_cache().stats()
+            print(f"文本缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，"
+                  f"占用 {stats['bytes'] / 1024 / 1024:.1f}/{stats['max_bytes'] / 1024 / 1024:.0f} MB")
         finally:
             # 清理取消标志，避免影响下次运行
             # 能确保无论函数如何退出（正常返回、异常抛出、或中途被取消），_cancel_event.clear() 都会被执行
             self._cancel_event.clear()
+            self._deadline_at = None
+            self._tasks = {}
+
+    def _build_batch_content(self, batch_files: List[ChapterEntry]) -> str:
+        """
+        组装批次内容：每章以文件名为标题（规范化时按设置压缩标题），stub 模式下的重复章节以一行说明代替
+
+        Returns:
+            批次内容，没有有效内容时为空字符串
+        """
+        batch_content = ""
+        for entry in batch_files:
+            try:
+                keep = self._duplicates.get(entry.filename)
+                if keep is not None:
+                    batch_content += f"\n=== {entry.filename} ===\n（与第{keep.number}章内容近似重复，已省略）\n"
+                    continue
+                content = self._source.read(entry).strip()
+                if not content:
+                    continue
+                # 添加文件名作为标识
+                piece = f"\n=== {entry.filename} ===\n{content}\n"
+                if self._normalizer is not None:
+                    raw_tokens = estimate_tokens(piece)
+                    content = self._normalizer.normalize(content)
+                    piece = self._normalizer.render(entry.filename, entry.number, content) if content else ""
+                    with self._stats_lock:
+                        self._token_stats[0] += raw_tokens
+                        self._token_stats[1] += estimate_tokens(piece) if piece else 0
+                batch_content += piece
+            except Exception as e:
+                print(f"读取文件 {entry.filename} 失败: {str(e)}")
+                continue
+        return batch_content
+
+    async def _read_batch_content(self, batch_files: List[ChapterEntry]) -> str:
+        """在线程池中组装批次内容，不阻塞事件循环；多个任务共用输入时，相同的批次内容只组装一次"""
+        if self._content_cache is None:
+            return await asyncio.to_thread(self._build_batch_content, batch_files)
+        return await self._content_cache.fetch(self.content_key(batch_files),
+                                               lambda: asyncio.to_thread(self._build_batch_content, batch_files))
+
+    def content_key(self, batch_files: List[ChapterEntry]) -> tuple:
+        """批次内容的标识：输入（原文或摘要层级）、是否规范化、各章及其是否以说明代替正文"""
+        return (id(self._source), self._normalizer is not None,
+                tuple((e.filename, e.sha1, self._duplicates[e.filename].number if e.filename in self._duplicates else 0)
+                      for e in batch_files))
 
-    async def _process_batch_with_semaphore(self, semaphore: asyncio.Semaphore, batch_files: List[str], batch_num: int) -> str:
+    def _report_results(self, batch_nums: List[int], results: list):
         """
-        使用信号量控制并发处理单个批次
+        打印各批次的处理结果与本次运行的统计（级联、逐章汇总、结构化输出、文本规范化）
+
+        Args:
+            batch_nums: 批次号，与 results 一一对应
+            results: asyncio.gather(..., return_exceptions=True) 的结果
+        """
+        # 处理结果
+        expired, stopped = [], []
+        for i, result in enumerate(results):
+            batch_no = batch_nums[i]
+            if isinstance(result, asyncio.CancelledError):
+                stopped.append(batch_no)
+            elif isinstance(result, Exception):
+                print(f"{self.label}批次 {batch_no} 处理失败: {str(result)}")
+            elif isinstance(result, str) and result == "cancelled":
+                #print(f"批次 {batch_no} 已跳过（收到中止请求）")
+                pass
+            elif isinstance(result, str) and result == "expired":
+                expired.append(batch_no)
+            elif isinstance(result, str) and result == "filtered":
+                print(f"{self.label}批次 {batch_no} 初筛判为无关，未交给主模型")
+            else:
+                print(f"{self.label}批次 {batch_no} 处理成功")
+        if expired:
+            print(f"{len(expired)} 个批次因超过任务截止时间未执行，下次运行时会继续处理: {expired}")
+        if stopped:
+            print(f"已满足停止条件，取消 {len(stopped)} 个未完成的批次（下次运行时会继续处理）: {sorted(stopped)}")
+        if self._cascade is not None and self._cascade_stats["classified"]:
+            stats = self._cascade_stats
+            print(f"级联: 初筛 {stats['classified']} 个批次，交给主模型 {stats['forwarded']} 个"
+                  f"（含抽查 {stats['audited']} 个），跳过 {stats['filtered']} 个，"
+                  f"主模型少处理约 {stats['saved_tokens']:,} tokens")
+            if stats["audited"]:
+                print(f"级联抽查: {stats['audited']} 个判为无关的批次中，主模型有结果的 {stats['audit_positive']} 个"
+                      f"（估计漏检率 {stats['audit_positive'] / stats['audited']:.0%}）")
+        self._assemble_chapters()
+        if self._schema is not None and any(self._structured_stats.values()):
+            stats = self._structured_stats
+            print(f"结构化输出: 首次即合格 {stats['valid']} 个批次，修复后合格 {stats['repaired']} 个，"
+                  f"仍不合格 {stats['invalid']} 个（共 {stats['repair_calls']} 次修复请求）")
+        if self._normalizer is not None and self._token_stats[0]:
+            raw, normalized = self._token_stats
+            print(f"文本规范化: 输入约 {raw:,} -> {normalized:,} tokens，"
+                  f"节省 {raw - normalized:,} tokens（{(raw - normalized) / raw:.1%}）")
+
+    async def _process_batch(self, batch_files: List[ChapterEntry], batch_num: int) -> str:
+        """
+        处理单个批次：占用一个流水线位置读取批次内容（线程池中进行），只在请求模型时占用并发槽位
+
+        流水线位置比并发槽位多 prefetch 个，正在请求的批次之后的若干批次会提前读好内容排队，
+        已读好内容的批次数因此有上限
 
         Args:
-            semaphore: 信号量，用于控制并发数
             batch_files: 该批次要处理的文件列表
             batch_num: 批次号
 
@@ -217,68 +911,82 @@ class Query:
         if self._cancel_event.is_set():
             return "cancelled"
 
-        async with semaphore:
-            # 更新活跃任务数并打印诊断日志
-            async with self._active_lock:
-                self._active += 1
-                active = self._active
-            print(f"[active {active}/{self.concurrent}] 正在处理批次 {batch_num}")
+        async with self._pipeline:
+            if self._cancel_event.is_set():
+                return "cancelled"
+            # 排队期间已超过任务截止时间，放弃该批次
+            remaining = self._remaining_time()
+            if remaining is not None and remaining <= 0:
+                return "expired"
 
             try:
-
-                # 读取批次中的所有文件内容
-                batch_content = ""
-                for file_path in batch_files:
-                    try:
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            content = f.read().strip()
-                            if content:
-                                # 添加文件名作为标识
-                                filename = os.path.basename(file_path)
-                                batch_content += f"\n=== {filename} ===\n{content}\n"
-                    except Exception as e:
-                        print(f"读取文件 {file_path} 失败: {str(e)}")
-                        continue
+                # 在线程池中读取批次中的所有文件内容，不阻塞其他批次的请求
+                batch_content = await self._read_batch_content(batch_files)
 
                 if not batch_content:
                     raise Exception("批次中没有有效的文件内容")
 
-                # 加载prompt模板
-                prompt_template = self._load_prompt_template()
-
-                # 替换prompt模板中的占位符
-                prompt = prompt_template.replace("{input_content}", batch_content)
+                print(f"[active {self._active}/{self.concurrent}] 正在处理{self.label}批次 {batch_num}")
 
+                # 级联模式：初筛判为无关（且未抽查）的批次不交给主模型
+                if self._cascade is not None and not await self._classify_batch(batch_content, batch_files, batch_num):
+                    if self._chapter_store is not None:
+                        await asyncio.to_thread(self._save_chapters, [(entry, None) for entry in batch_files])
+                    else:
+                        # 该批次号若有章节不同的旧结果，删除它，避免来源清单指向内容不符的文件
+                        output_file = os.path.join(self.output_path, f"{self.name_prefix}_bs{self.batch_size}_批次{batch_num}.txt")
+                        if os.path.exists(output_file):
+                            await asyncio.to_thread(os.remove, output_file)
+                        await asyncio.to_thread(self._record_provenance, batch_num)
+                    return "filtered"
 
                 # 调用LLM API
-                result = await self._call_llm(prompt)
-
-                # 保存结果到文件
-                output_file = os.path.join(self.output_path, f"{self.name_prefix}_bs{self.batch_size}_批次{batch_num}.txt")
-                os.makedirs(self.output_path, exist_ok=True)
+                result = await self._call_llm(self._render_prompt(batch_content), json_schema=self._schema)
+                if self._schema is not None:
+                    result = await self._check_structured(result, batch_files, batch_num)
 
-                with open(output_file, "w", encoding="utf-8") as f:
-                    f.write(result)
+                if self._per_chapter is not None:
+                    # 逐章模式：结果保存为逐章记录（<前缀>_逐章/），不写批次文件
+                    sections = await self._demux_result(result, batch_files, batch_num)
+                    if self._cascade is not None:
+                        await asyncio.to_thread(self._finish_audit, batch_num, result)
+                    for section in sections.values():
+                        self._check_stop(batch_num, section)
+                else:
+                    # 保存结果到文件
+                    output_file = os.path.join(self.output_path, f"{self.name_prefix}_bs{self.batch_size}_批次{batch_num}.txt")
+                    await asyncio.to_thread(self._write_text, output_file, result)
+                    await asyncio.to_thread(self._record_provenance, batch_num)
+                    if self._cascade is not None:
+                        await asyncio.to_thread(self._finish_audit, batch_num, result)
+                    self._check_stop(batch_num, result)
 
                 # 打印成功日志
-                async with self._active_lock:
-                    active = self._active
-                print(f"[active {active}/{self.concurrent}] 批次 {batch_num} 成功完成")
+                print(f"[active {self._active}/{self.concurrent}] {self.label}批次 {batch_num} 成功完成")
 
                 return result
 
             except Exception as e:
-                async with self._active_lock:
-                    active = self._active
-                print(f"[active {active}/{self.concurrent}] 批次 {batch_num} 失败: {str(e)}")
+                if self._cancel_event.is_set():
+                    return "cancelled"
+                remaining = self._remaining_time()
+                if remaining is not None and remaining <= 0:
+                    # 等待并发槽位或请求期间超过了任务截止时间，与排队超时一样留到下次运行
+                    return "expired"
+                print(f"[active {self._active}/{self.concurrent}] {self.label}批次 {batch_num} 失败: {str(e)}")
                 raise
 
-            finally:
-                # 释放活跃计数
-                async with self._active_lock:
-                    self._active -= 1
-                    active = self._active
-                print(f"[active {active}/{self.concurrent}] 批次 {batch_num} 释放信号量")
+    @staticmethod
+    def _write_text(path: str, text: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    @staticmethod
+    def _write_json(path: str, record: dict):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
 
 
 import time
@@ -300,6 +1008,39 @@ if __name__ == "__main__":
     parser.add_argument("--name_prefix", default="查询结果", help="输出文件名前缀")
     parser.add_argument("--start_pos", type=int, default=None, help="起始位置（从1开始）")
     parser.add_argument("--end_pos", type=int, default=None, help="终止位置")
+    parser.add_argument("--profile", default=None, help="生成参数档案名（config.json 中 GENERATION_PROFILES 的键）")
+    parser.add_argument("--deadline", type=float, default=None, help="整个任务的截止时间（秒），超时未开始的批次跳过")
+    parser.add_argument("--max_retries", type=int, default=2, help="单批次请求超时后的重试次数")
+    parser.add_argument("--normalize", action=argparse.BooleanOptionalAction, default=None,
+                        help="规范化送入模型的文本：去水印/广告行、清理空白、压缩章节标题（默认按 config.json）")
+    parser.add_argument("--dedupe", choices=DEDUPE_MODES, default=None,
+                        help="近似重复章节：off 照常发送，skip 跳过（批次划分会变化，建议换用新的输出前缀），"
+                             "stub 以一行说明代替正文（默认按 config.json）")
+    parser.add_argument("--match", default=None,
+                        help="只处理全文检索命中的章节，如 '紫霄神雷 \"青云门\"'（批次划分会变化，建议换用新的输出前缀）")
+    parser.add_argument("--retrieve", default=None,
+                        help="检索预筛：只把与该剧情描述最相关（BM25）的区域发送给模型（批次划分会变化，建议换用新的输出前缀）")
+    parser.add_argument("--keywords", nargs="*", default=None, help="检索预筛的额外关键词（默认按 config.json）")
+    parser.add_argument("--top_k", type=int, default=None, help="检索预筛选取的区域数（默认按 config.json）")
+    parser.add_argument("--cascade", action=argparse.BooleanOptionalAction, default=None,
+                        help="级联模式：先由初筛模型判断批次是否相关，只把相关的批次交给主模型（默认按 config.json）")
+    parser.add_argument("--cascade_provider", default=None, help="初筛模型的提供商ID（默认按 config.json）")
+    parser.add_argument("--cascade_model", default=None, help="初筛模型ID（默认按 config.json）")
+    parser.add_argument("--cascade_threshold", type=float, default=None, help="相关性阈值（0~1，默认按 config.json）")
+    parser.add_argument("--audit_rate", type=float, default=None, help="判为无关的批次中抽查的比例（默认按 config.json）")
+    parser.add_argument("--stop_after", type=int, default=None, help="命中该数量的结果后停止，取消其余批次")
+    parser.add_argument("--stop_pattern", default=None, help="只有匹配该正则的结果才算命中（给出时默认命中1个即停止）")
+    parser.add_argument("--stop_json", default=None,
+                        help='只有其中的JSON满足该谓词的结果才算命中，如 \'{"found": true}\'（给出时默认命中1个即停止）')
+    parser.add_argument("--order", choices=ORDERS, default=None,
+                        help="批次执行顺序：sequential 按批次号，ranked 按检索预筛得分（默认按 config.json）")
+    parser.add_argument("--tiers", nargs="*", default=None,
+                        help="可用作输入的摘要结果目录（如逐章压缩的输出），能覆盖所需章节且更便宜时代替原文")
+    parser.add_argument("--per_chapter", action=argparse.BooleanOptionalAction, default=None,
+                        help="逐章模式：要求模型按章节分段作答，结果按章保存，换批次大小后仍可复用（默认按 config.json）")
+    parser.add_argument("--schema", default=None,
+                        help="JSON Schema 文件：要求结构化输出，回答到达时校验并修复，结果写入 <前缀>_bs<批次大小>_结果.jsonl")
+    parser.add_argument("--prefetch", type=int, default=None, help="提前读取内容的批次数（默认与并发数相同）")
     args = parser.parse_args()
     
     try:
@@ -314,7 +1055,29 @@ if __name__ == "__main__":
             prompt_path=args.prompt_path,
             name_prefix=args.name_prefix,
             start_pos=args.start_pos,
-            end_pos=args.end_pos
+            end_pos=args.end_pos,
+            profile=args.profile,
+            deadline=args.deadline,
+            max_retries=args.max_retries,
+            normalize=args.normalize,
+            dedupe=args.dedupe,
+            match=args.match,
+            retrieve=args.retrieve,
+            keywords=args.keywords,
+            top_k=args.top_k,
+            cascade=args.cascade,
+            cascade_provider=args.cascade_provider,
+            cascade_model=args.cascade_model,
+            cascade_threshold=args.cascade_threshold,
+            audit_rate=args.audit_rate,
+            stop_after=args.stop_after,
+            stop_pattern=args.stop_pattern,
+            stop_json=args.stop_json,
+            order=args.order,
+            tiers=args.tiers,
+            per_chapter=args.per_chapter,
+            schema=args.schema,
+            prefetch=args.prefetch
         )
         
         # 开始处理
@@ -0,0 +1,145 @@
+"""
+Query 负载测试
+在本地模拟服务（或任意已配置的厂商）上扫描 并发数 × 批次大小，
+统计吞吐与失败情况，给出该厂商画像下吞吐最优的设置
+"""
+
+import os
+import io
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+from typing import Dict, List, Optional
+
+from benchmarks.mock_server import MockOpenAIServer, build_profile, add_profile_arguments
+from utils import unified_chat
+from app.query import Query
+
+
+def write_synthetic_chapters(directory: str, chapters: int, chars: int):
+    """生成用于压测的章节文件（命名与预处理输出一致）"""
+    os.makedirs(directory, exist_ok=True)
+    line = "孟浩站在山门前，望着云海翻涌，心中默念口诀。"
+    body = (line * (chars // len(line) + 1))[:chars]
+    for i in range(1, chapters + 1):
+        with open(os.path.join(directory, f"第{i}章_压测_{i}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"第{i}章_压测\n\n{body}")
+
+
+async def run_one(args, input_path: str, prompt_path: str, concurrent: int, batch_size: int) -> Dict[str, float]:
+    """运行一次 Query 并统计结果"""
+    with tempfile.TemporaryDirectory() as output_path:
+        query = Query(
+            input_path=input_path,
+            output_path=output_path,
+            provider_id=args.provider,
+            model_id=args.model,
+            concurrent=concurrent,
+            batch_size=batch_size,
+            prompt_path=prompt_path,
+            name_prefix="压测",
+            profile=args.query_profile,
+            deadline=args.deadline,
+        )
+        log = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            await query.process_query()
+        elapsed = time.perf_counter() - start
+
+        total_files = len([f for f in os.listdir(input_path) if f.endswith(".txt")])
+        total_batches = (total_files + batch_size - 1) // batch_size
+        completed = len(query._get_existing_results())
+        completed_chapters = min(completed * batch_size, total_files)
+        return {
+            "concurrent": concurrent,
+            "batch_size": batch_size,
+            "elapsed": elapsed,
+            "batches": total_batches,
+            "completed": completed,
+            "failed": total_batches - completed,
+            "chapters_per_sec": completed_chapters / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+async def sweep(args) -> List[Dict[str, float]]:
+    server: Optional[MockOpenAIServer] = None
+    if args.provider == "mock":
+        server = MockOpenAIServer(build_profile(args), port=0)
+        await server.start()
+        # 运行时注入厂商配置，与在 config.json 中配置 base_url 等价
+        unified_chat.PROVIDER_CONFIG["mock"] = {
+            "type": "openai", "base_url": server.base_url, "api_key": "mock", "models": [args.model]}
+        print(f"已启动模拟服务: {server.base_url}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = args.input_path
+        if not input_path:
+            input_path = os.path.join(workdir, "chapters")
+            write_synthetic_chapters(input_path, args.chapters, args.chapter_chars)
+        prompt_path = args.prompt_path
+        if not prompt_path:
+            prompt_path = os.path.join(workdir, "prompt.txt")
+            with open(prompt_path, "w", encoding="utf-8") as f:
+                f.write("压缩下面的内容：\n{input_content}")
+
+        results = []
+        try:
+            for batch_size in args.batch_sizes:
+                for concurrent in args.concurrency:
+                    before = dict(server.stats) if server else {}
+                    result = await run_one(args, input_path, prompt_path, concurrent, batch_size)
+                    if server:
+                        result["http_429"] = server.stats["429"] - before.get("429", 0)
+                        result["http_5xx"] = server.stats["5xx"] - before.get("5xx", 0)
+                    results.append(result)
+                    print(f"bs={batch_size:<4} 并发={concurrent:<5} 耗时={result['elapsed']:8.2f}s "
+                          f"完成={result['completed']}/{result['batches']} "
+                          f"吞吐={result['chapters_per_sec']:8.2f} 章/秒"
+                          + (f" 429={result['http_429']} 5xx={result['http_5xx']}" if server else ""))
+        finally:
+            if server:
+                await server.stop()
+    return results
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query 并发/批次大小扫描")
+    parser.add_argument("--provider", default="mock", help="厂商ID，mock 表示启动内置模拟服务")
+    parser.add_argument("--model", default="mock-model")
+    parser.add_argument("--input_path", default=None, help="章节目录，不指定时生成合成章节")
+    parser.add_argument("--prompt_path", default=None)
+    parser.add_argument("--chapters", type=int, default=200, help="合成章节数")
+    parser.add_argument("--chapter_chars", type=int, default=3000, help="合成章节字数")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[10, 50, 100, 200])
+    parser.add_argument("--batch_sizes", type=parse_int_list, default=[5, 10, 20])
+    parser.add_argument("--query_profile", default=None, help="Query 使用的生成参数档案")
+    parser.add_argument("--deadline", type=float, default=None, help="每次运行的任务截止时间（秒）")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(sweep(args))
+    if not results:
+        sys.exit(1)
+
+    # 优先选择没有失败批次的设置，其次看吞吐
+    best = max(results, key=lambda r: (r["failed"] == 0, r["chapters_per_sec"]))
+    print(f"吞吐最优设置: 批次大小={best['batch_size']} 并发={best['concurrent']} "
+          f"({best['chapters_per_sec']:.2f} 章/秒, 失败批次 {best['failed']})")
+
+
+"""
+示例用法:
+# 用内置 flaky 画像、等待时间缩放为 1/10 扫描
+python -m benchmarks.load_test --profile flaky --time_scale 0.1 --concurrency 20,50,100,200 --batch_sizes 5,10
+
+# 对真实厂商（或 config.json 中指向模拟服务的厂商）扫描
+python -m benchmarks.load_test --provider mock_local --model mock-model --input_path ../wyft/chapters
+"""
@@ -0,0 +1,289 @@
+"""
+本地模拟的 OpenAI 兼容服务
+实现 /v1/chat/completions（流式与非流式），可配置延迟分布、输出速度、
+429/5xx 比例、Retry-After、上下文超长错误和服务端并发上限，用于不花钱地压测 Query
+"""
+
+import asyncio
+import json
+import random
+import time
+import uuid
+import argparse
+from dataclasses import dataclass, fields, asdict
+from typing import Any, Dict, Optional, Tuple
+
+from utils.text_processor import estimate_tokens
+
+
+@dataclass
+class MockProfile:
+    """模拟厂商的行为参数"""
+    latency_dist: str = "lognormal"     # 首字延迟分布: fixed / uniform / lognormal
+    latency_median: float = 1.0         # 首字延迟中位数（秒）
+    latency_sigma: float = 0.5          # lognormal 的 sigma；uniform 时为 ±范围（秒）
+    tokens_per_sec: float = 80.0        # 单请求输出速度
+    output_ratio: float = 0.25          # 输出token数 = 输入token数 * output_ratio
+    max_output_tokens: int = 4000
+    rate_429: float = 0.0               # 随机返回429的比例
+    rate_5xx: float = 0.0               # 随机返回500/503的比例
+    retry_after: Optional[float] = 1.0  # 429/503 响应的 Retry-After（秒），None 不返回
+    context_limit: int = 128000         # 输入token超过该值时返回上下文超长错误
+    max_concurrency: int = 0            # 服务端同时处理的请求上限，超出返回429；0 表示不限制
+    time_scale: float = 1.0             # 所有等待时间的缩放系数，0 表示不等待
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MockProfile":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+# 内置的厂商画像，可用 --profile 选择，再用命令行参数覆盖个别字段
+BUILTIN_PROFILES = {
+    "flash": MockProfile(latency_median=0.6, tokens_per_sec=150, max_concurrency=200, context_limit=128000),
+    "reasoning": MockProfile(latency_median=8.0, latency_sigma=0.8, tokens_per_sec=40, max_concurrency=50),
+    "flaky": MockProfile(latency_median=1.5, latency_sigma=1.0, rate_429=0.05, rate_5xx=0.02, max_concurrency=60),
+}
+
+
+class MockOpenAIServer:
+    """基于 asyncio streams 的最小 HTTP/1.1 服务"""
+
+    def __init__(self, profile: MockProfile, host: str = "127.0.0.1", port: int = 8000):
+        self.profile = profile
+        self.host = host
+        self.port = port
+        self.random = random.Random(profile.seed)
+        self.active = 0
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "context_length": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+        self._server = None
+        self._connections = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # 端口传 0 时取实际分配的端口
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # 主动关闭保持中的连接，让各连接协程正常退出
+            tasks = list(self._connections)
+            for task, writer in tasks:
+                writer.close()
+            await asyncio.gather(*(task for task, _ in tasks), return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"模拟服务已启动: {self.base_url}  画像: {asdict(self.profile)}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _sleep(self, seconds: float):
+        if seconds > 0 and self.profile.time_scale > 0:
+            await asyncio.sleep(seconds * self.profile.time_scale)
+
+    def _first_token_latency(self) -> float:
+        p = self.profile
+        if p.latency_dist == "fixed":
+            return p.latency_median
+        if p.latency_dist == "uniform":
+            return max(0.0, self.random.uniform(p.latency_median - p.latency_sigma, p.latency_median + p.latency_sigma))
+        return self.random.lognormvariate(0.0, p.latency_sigma) * p.latency_median
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        entry = (asyncio.current_task(), writer)
+        self._connections.add(entry)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, body = request
+                keep_alive = await self._dispatch(method, path, body, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(entry)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        body = await reader.readexactly(length) if length else b""
+        return method, path, body
+
+    async def _write_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any],
+                          extra_headers: Optional[Dict[str, str]] = None) -> bool:
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+                   500: "Internal Server Error", 503: "Service Unavailable"}
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Content-Length": str(len(data)), **(extra_headers or {})}
+        head = f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await writer.drain()
+        return True
+
+    def _error(self, kind: str, message: str, code: Optional[str] = None) -> Dict[str, Any]:
+        return {"error": {"message": message, "type": kind, "code": code}}
+
+    async def _dispatch(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+            return await self._write_json(writer, 404, self._error("not_found", f"{method} {path}"))
+
+        self.stats["requests"] += 1
+        request = json.loads(body or b"{}")
+        p = self.profile
+        retry_headers = {"Retry-After": f"{p.retry_after:g}"} if p.retry_after is not None else {}
+
+        # 服务端容量与随机故障
+        if p.max_concurrency and self.active >= p.max_concurrency:
+            self.stats["429"] += 1
+            return await self._write_json(writer, 429, self._error("rate_limit", "服务端并发已满"), retry_headers)
+        roll = self.random.random()
+        if roll < p.rate_429:
+            self.stats["429"] += 1
+            return await self._write_json(writer, 429, self._error("rate_limit", "模拟限流"), retry_headers)
+        if roll < p.rate_429 + p.rate_5xx:
+            self.stats["5xx"] += 1
+            status = self.random.choice((500, 503))
+            return await self._write_json(writer, status, self._error("server_error", "模拟服务端错误"),
+                                          retry_headers if status == 503 else None)
+
+        prompt = "".join(str(m.get("content", "")) for m in request.get("messages", []))
+        prompt_tokens = estimate_tokens(prompt)
+        if prompt_tokens > p.context_limit:
+            self.stats["context_length"] += 1
+            return await self._write_json(writer, 400, self._error(
+                "invalid_request_error",
+                f"输入 {prompt_tokens} tokens 超过上下文上限 {p.context_limit}",
+                "context_length_exceeded"))
+
+        limit = request.get("max_tokens") or p.max_output_tokens
+        completion_tokens = max(1, min(int(prompt_tokens * p.output_ratio), limit, p.max_output_tokens))
+        self.active += 1
+        try:
+            await self._sleep(self._first_token_latency())
+            if request.get("stream"):
+                await self._stream_completion(writer, request, prompt_tokens, completion_tokens)
+                keep_alive = False
+            else:
+                await self._sleep(completion_tokens / p.tokens_per_sec)
+                keep_alive = await self._write_json(writer, 200, self._completion(request, prompt_tokens, completion_tokens))
+        finally:
+            self.active -= 1
+        self.stats["ok"] += 1
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += completion_tokens
+        return keep_alive
+
+    def _completion(self, request: Dict[str, Any], prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "模" * completion_tokens}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    async def _stream_completion(self, writer: asyncio.StreamWriter, request: Dict[str, Any],
+                                 prompt_tokens: int, completion_tokens: int):
+        """以 SSE 输出，连接关闭表示响应结束"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        step = 16
+        for sent in range(0, completion_tokens, step):
+            n = min(step, completion_tokens - sent)
+            await self._sleep(n / self.profile.tokens_per_sec)
+            chunk = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": request.get("model", "mock"),
+                     "choices": [{"index": 0, "delta": {"content": "模" * n}, "finish_reason": None}]}
+            writer.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await writer.drain()
+        final = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": request.get("model", "mock"),
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                 "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                           "total_tokens": prompt_tokens + completion_tokens}}
+        writer.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        await writer.drain()
+
+
+def build_profile(args) -> MockProfile:
+    """内置画像或JSON文件，再用命令行显式给出的字段覆盖"""
+    if args.profile in BUILTIN_PROFILES:
+        data = asdict(BUILTIN_PROFILES[args.profile])
+    elif args.profile:
+        with open(args.profile, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        data = {}
+    for f in fields(MockProfile):
+        value = getattr(args, f.name, None)
+        if value is not None:
+            data[f.name] = value
+    return MockProfile.from_dict(data)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """注册画像相关的命令行参数（供负载测试脚本复用）"""
+    parser.add_argument("--profile", default=None,
+                        help=f"内置画像（{'/'.join(BUILTIN_PROFILES)}）或画像JSON文件路径")
+    parser.add_argument("--latency_dist", choices=["fixed", "uniform", "lognormal"], default=None)
+    parser.add_argument("--latency_median", type=float, default=None, help="首字延迟中位数（秒）")
+    parser.add_argument("--latency_sigma", type=float, default=None)
+    parser.add_argument("--tokens_per_sec", type=float, default=None, help="单请求输出速度")
+    parser.add_argument("--output_ratio", type=float, default=None, help="输出token数相对输入的比例")
+    parser.add_argument("--rate_429", type=float, default=None)
+    parser.add_argument("--rate_5xx", type=float, default=None)
+    parser.add_argument("--retry_after", type=float, default=None)
+    parser.add_argument("--context_limit", type=int, default=None)
+    parser.add_argument("--max_concurrency", type=int, default=None, help="服务端并发上限，超出返回429")
+    parser.add_argument("--time_scale", type=float, default=None, help="等待时间缩放，0 表示不等待")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(build_profile(args), args.host, args.port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print(f"统计: {server.stats}")
+
+
+"""
+示例用法:
+python -m benchmarks.mock_server --profile flaky --port 8000
+
+然后在 config.json 中添加厂商:
+"mock": {"type": "openai", "base_url": "http://127.0.0.1:8000/v1", "api_key": "mock", "models": ["mock-model"]}
+"""
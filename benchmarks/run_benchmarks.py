@@ -0,0 +1,253 @@
+"""
+端到端基准测试
+用合成小说（UTF-8 与 GBK）依次计时各个阶段：读取、章节拆分、流式拆分写出、章节写出、合并、打包写出与打包合并、
+阅读页目录加载、Query 规划与执行（本地模拟服务），记录耗时与峰值内存，
+结果写入JSON并与基线比较，超过容差的阶段视为性能回退
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+from typing import Any, Callable, Dict
+
+from benchmarks.synthetic_novel import generate_novel, write_novel
+from utils.readtxt import read_text_file, iter_text_chunks
+from utils.text_processor import TextProcessor
+from app.novel_pre_processor import save_chapters, pack_chapters
+from app.merge_files import merge_files_by_number
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# 阅读页计时用的 QApplication，须在整个测量期间保持存活
+_qt_app = None
+
+
+class SkipStage(Exception):
+    """当前环境无法运行该阶段（缺少可选依赖等）"""
+
+
+def measure(func: Callable[[], Any], trace_memory: bool = True) -> Dict[str, Any]:
+    """
+    计时运行一个阶段；耗时与峰值内存分两次测量，避免 tracemalloc 的开销计入耗时
+
+    Returns:
+        {"seconds", "peak_mb", "result"}
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+
+        peak_mb = None
+        if trace_memory:
+            tracemalloc.start()
+            try:
+                func()
+                peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            finally:
+                tracemalloc.stop()
+    return {"seconds": seconds, "peak_mb": peak_mb, "result": result}
+
+
+def stage_reader_load(chapter_dir: str):
+    """阅读页加载章节目录（需要 PyQt5，使用 offscreen 平台）"""
+    try:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        from pyqt_ui.reader_ui import ReaderUI
+    except ImportError as e:
+        raise SkipStage(f"缺少依赖: {e}")
+    global _qt_app
+    _qt_app = QApplication.instance() or QApplication([])
+    reader = ReaderUI()
+    reader.file_check_timer.stop()
+
+    def load():
+        reader.clear_directories()
+        reader.add_directory_to_tree(chapter_dir)
+        return reader.file_list.topLevelItem(0).childCount()
+    return load
+
+
+def stage_query(chapter_dir: str, workdir: str, batch_size: int, concurrent: int):
+    """Query 规划与执行，执行阶段连接不等待的本地模拟服务"""
+    try:
+        from utils import unified_chat
+        from app.query import Query
+        from benchmarks.mock_server import MockOpenAIServer, MockProfile
+    except ImportError as e:
+        raise SkipStage(f"缺少依赖: {e}")
+
+    prompt_path = os.path.join(workdir, "prompt.txt")
+    with open(prompt_path, "w", encoding="utf-8") as f:
+        f.write("压缩下面的内容：\n{input_content}")
+
+    def make_query(output_path: str) -> "Query":
+        return Query(input_path=chapter_dir, output_path=output_path, provider_id="mock", model_id="mock-model",
+                     concurrent=concurrent, batch_size=batch_size, prompt_path=prompt_path, name_prefix="基准")
+
+    def plan():
+        return len(make_query(os.path.join(workdir, "query_plan")).plan_batches())
+
+    def execute():
+        async def run():
+            server = MockOpenAIServer(MockProfile(time_scale=0, seed=0), port=0)
+            await server.start()
+            unified_chat.PROVIDER_CONFIG["mock"] = {
+                "type": "openai", "base_url": server.base_url, "api_key": "mock", "models": ["mock-model"]}
+            try:
+                with tempfile.TemporaryDirectory(dir=workdir) as output_path:
+                    query = make_query(output_path)
+                    await query.process_query()
+                    return len(query._get_existing_results())
+            finally:
+                await server.stop()
+        return asyncio.run(run())
+
+    return plan, execute
+
+
+def run_suite(args) -> Dict[str, Any]:
+    processor = TextProcessor()
+    text = generate_novel(args.chapters, args.chapter_chars, seed=args.seed)
+    results: Dict[str, Any] = {
+        "meta": {
+            "chapters": args.chapters,
+            "chapter_chars": args.chapter_chars,
+            "total_chars": len(text),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "stages": {},
+    }
+    stages = results["stages"]
+
+    def record(name: str, func_factory: Callable[[], Callable[[], Any]]):
+        try:
+            func = func_factory()
+            outcome = measure(func, trace_memory=not args.no_memory)
+        except SkipStage as e:
+            stages[name] = {"skipped": str(e)}
+            print(f"{name:<28} 跳过（{e}）")
+            return None
+        stages[name] = {"seconds": round(outcome["seconds"], 4),
+                        "peak_mb": round(outcome["peak_mb"], 2) if outcome["peak_mb"] is not None else None}
+        print(f"{name:<28} {outcome['seconds']:9.3f}s"
+              + (f"  峰值内存 {outcome['peak_mb']:8.1f} MB" if outcome["peak_mb"] is not None else ""))
+        return outcome["result"]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        chapters = None
+        for encoding in args.encodings:
+            novel_path = os.path.join(workdir, f"novel_{encoding}.txt")
+            write_novel(novel_path, text, encoding)
+            loaded = record(f"read_text_file[{encoding}]", lambda: (lambda: read_text_file(novel_path)))
+            chapters = record(f"split_chapters[{encoding}]", lambda: (lambda: processor.split_chapters(loaded)))
+            stream_dir = os.path.join(workdir, f"stream_{encoding}")
+            record(f"split_stream_write[{encoding}]", lambda: (lambda: len(save_chapters(
+                processor.iter_chapters(iter_text_chunks(novel_path)), stream_dir))))
+
+        chapter_dir = os.path.join(workdir, "chapters")
+        record("write_chapters", lambda: (lambda: save_chapters(chapters, chapter_dir)))
+        merged_path = os.path.join(workdir, "merged.txt")
+        record("merge_files_by_number", lambda: (lambda: merge_files_by_number(chapter_dir, merged_path)))
+        pack_path = os.path.join(workdir, "chapters.nepack")
+        record("write_pack", lambda: (lambda: pack_chapters(chapters, pack_path)))
+        record("merge_pack", lambda: (lambda: merge_files_by_number(pack_path, merged_path)))
+        record("reader_load_directory", lambda: stage_reader_load(chapter_dir))
+
+        query_stages = {}
+
+        def query_factory(index: int):
+            def factory():
+                if not query_stages:
+                    query_stages["funcs"] = stage_query(chapter_dir, workdir, args.batch_size, args.concurrent)
+                return query_stages["funcs"][index]
+            return factory
+        record("query_plan", query_factory(0))
+        record("query_execute_mock", query_factory(1))
+
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta: float) -> int:
+    """与基线比较，返回回退的阶段数；数据规模不同时只提示不比较"""
+    keys = ("chapters", "chapter_chars")
+    if any(baseline.get("meta", {}).get(k) != results["meta"].get(k) for k in keys):
+        print("基线的数据规模与本次不同，跳过比较")
+        return 0
+
+    regressions = 0
+    print(f"\n与基线比较（容差 {tolerance:.0%}）:")
+    for name, current in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or "seconds" not in base or "seconds" not in current:
+            continue
+        ratio = current["seconds"] / base["seconds"] if base["seconds"] > 0 else 1.0
+        regressed = ratio > 1 + tolerance and current["seconds"] - base["seconds"] > min_delta
+        mem = ""
+        if current.get("peak_mb") is not None and base.get("peak_mb"):
+            mem_ratio = current["peak_mb"] / base["peak_mb"]
+            mem = f"  内存 {mem_ratio:5.2f}x"
+            if mem_ratio > 1 + tolerance and current["peak_mb"] - base["peak_mb"] > 1:
+                regressed = True
+        regressions += regressed
+        print(f"{name:<28} {base['seconds']:9.3f}s -> {current['seconds']:9.3f}s  {ratio:5.2f}x{mem}"
+              + ("  ← 回退" if regressed else ""))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="端到端基准测试")
+    parser.add_argument("--chapters", type=int, default=1600)
+    parser.add_argument("--chapter_chars", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--encodings", type=lambda v: v.split(","), default=["utf-8", "gbk"])
+    parser.add_argument("--batch_size", type=int, default=10)
+    parser.add_argument("--concurrent", type=int, default=50)
+    parser.add_argument("--no_memory", action="store_true", help="不测量峰值内存（更快）")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="结果JSON路径")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线JSON路径")
+    parser.add_argument("--update_baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对变慢比例")
+    parser.add_argument("--min_delta", type=float, default=0.05, help="忽略小于该秒数的差异")
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {args.output}")
+
+    regressions = 0
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"基线已更新: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta)
+    else:
+        print(f"没有找到基线 {args.baseline}，可用 --update_baseline 生成")
+
+    sys.exit(1 if regressions else 0)
+
+
+"""
+示例用法:
+# 生成基线
+python -m benchmarks.run_benchmarks --update_baseline
+
+# 修改代码后重新运行，与基线比较，有回退时退出码为1
+python -m benchmarks.run_benchmarks
+
+# 小规模快速检查
+python -m benchmarks.run_benchmarks --chapters 200 --no_memory
+"""
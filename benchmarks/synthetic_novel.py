@@ -0,0 +1,126 @@
+"""
+合成小说生成器
+生成接近真实网文txt的测试数据：章节标题写法不统一、存在重复章节号（重新上传）、
+段落缩进与空行混杂，可输出 UTF-8 / GBK 编码
+"""
+
+import os
+import random
+import argparse
+from typing import Optional
+
+# 常用汉字（均可用GBK编码），按词组拼接成句，避免纯随机字符
+_WORDS = [
+    "孟浩", "师兄", "宗门", "山门", "长老", "灵石", "丹药", "修为", "筑基", "凝气",
+    "铜镜", "法宝", "阵法", "天地", "灵气", "剑光", "洞府", "弟子", "掌门", "秘境",
+    "缓缓", "忽然", "心中", "目光", "身影", "一道", "片刻", "之后", "顿时", "此刻",
+    "说道", "笑了", "沉默", "抬头", "望去", "冷哼", "点头", "皱眉", "转身", "离去",
+    "这个", "那些", "我们", "他们", "不过", "然而", "于是", "只是", "仿佛", "已经",
+]
+_PUNCT = ["，", "，", "，", "。", "。", "！", "？", "……"]
+_CN_DIGITS = "零一二三四五六七八九"
+
+
+def to_chinese_number(n: int) -> str:
+    """阿拉伯数字转中文数字（支持到 9999）"""
+    if n == 0:
+        return "零"
+    units = [(1000, "千"), (100, "百"), (10, "十")]
+    result = ""
+    zero = False
+    for value, unit in units:
+        digit = n // value
+        n %= value
+        if digit:
+            if zero:
+                result += "零"
+                zero = False
+            if not (value == 10 and digit == 1 and not result):
+                result += _CN_DIGITS[digit]
+            result += unit
+        elif result:
+            zero = True
+    if n:
+        if zero:
+            result += "零"
+        result += _CN_DIGITS[n]
+    return result
+
+
+def _paragraph(rng: random.Random, chars: int) -> str:
+    parts = []
+    length = 0
+    while length < chars:
+        sentence = "".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 8))) + rng.choice(_PUNCT)
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def _heading(rng: random.Random, number: int, title: str) -> str:
+    """随机选择一种常见的章节标题写法"""
+    style = rng.random()
+    if style < 0.55:
+        return f"第{number}章 {title}"
+    if style < 0.75:
+        return f"第{to_chinese_number(number)}章：{title}"
+    if style < 0.85:
+        return f"　　第{number}章　{title}"
+    if style < 0.95:
+        return f"正文 第{number}章 {title}"
+    return f"第{number}章{title}"
+
+
+def generate_novel(chapters: int = 1600, chapter_chars: int = 3000,
+                   duplicate_rate: float = 0.01, seed: Optional[int] = 42) -> str:
+    """
+    生成合成小说全文
+
+    Args:
+        chapters: 章节数
+        chapter_chars: 每章大约字数
+        duplicate_rate: 重复上传章节（相同章节号再次出现）的比例
+        seed: 随机种子，固定后输出可复现
+
+    Returns:
+        小说全文
+    """
+    rng = random.Random(seed)
+    parts = ["书名：合成测试小说\n作者：基准测试\n\n内容简介：\n" + _paragraph(rng, 200) + "\n\n"]
+    for number in range(1, chapters + 1):
+        title = "".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3)))
+        body = []
+        remaining = chapter_chars
+        while remaining > 0:
+            size = min(remaining, rng.randint(80, 400))
+            indent = "　　" if rng.random() < 0.8 else ""
+            body.append(indent + _paragraph(rng, size))
+            remaining -= size
+        separator = "\n\n" if rng.random() < 0.3 else "\n"
+        chapter_text = _heading(rng, number, title) + "\n" + separator.join(body) + "\n\n"
+        parts.append(chapter_text)
+        if rng.random() < duplicate_rate:
+            # 重新上传的章节：同一章节号，正文略有差异
+            parts.append(_heading(rng, number, title + "（修正版）") + "\n" + _paragraph(rng, chapter_chars // 2) + "\n\n")
+    return "".join(parts)
+
+
+def write_novel(path: str, text: str, encoding: str = "utf-8"):
+    """按指定编码写出小说文件"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding=encoding, newline="\r\n" if encoding.lower() == "gbk" else None) as f:
+        f.write(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成合成小说txt")
+    parser.add_argument("-o", "--output", required=True, help="输出文件路径")
+    parser.add_argument("--chapters", type=int, default=1600)
+    parser.add_argument("--chapter_chars", type=int, default=3000)
+    parser.add_argument("--encoding", default="utf-8", help="utf-8 或 gbk")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    text = generate_novel(args.chapters, args.chapter_chars, seed=args.seed)
+    write_novel(args.output, text, args.encoding)
+    print(f"已生成 {len(text)} 字 -> {args.output} ({args.encoding})")
@@ -96,6 +96,9 @@ class ConfigUI(QWidget):
                     display_value = ""
                 elif isinstance(value, bool):
                     display_value = str(value)
+                elif isinstance(value, (dict, list)):
+                    # 档案等嵌套配置以JSON文本编辑
+                    display_value = json.dumps(value, ensure_ascii=False)
                 else:
                     display_value = str(value)
                 
@@ -131,7 +134,7 @@ class ConfigUI(QWidget):
 
         # Type
         type_combo = QComboBox()
-        type_combo.addItems(["openai", "gemini", "anthropic"])
+        type_combo.addItems(["openai", "gemini", "anthropic", "replay"])
         type_combo.setCurrentText(config.get("type", "openai"))
         type_combo.currentTextChanged.connect(self.schedule_save)
         layout.addRow("type:", type_combo)
@@ -185,6 +188,8 @@ class ConfigUI(QWidget):
 
         tab.setLayout(layout)
         tab.setProperty("provider_name", provider_name)
+        # 界面未展示的字段（如 thinking_style）原样保留，保存时写回
+        tab.setProperty("extra", {k: v for k, v in config.items() if k not in ("type", "base_url", "api_key", "models")})
         tab.setProperty("widgets", {
             "type": type_combo,
             "base_url": base_url_edit,
@@ -251,7 +256,8 @@ class ConfigUI(QWidget):
                 "type": widgets["type"].currentText(),
                 "base_url": widgets["base_url"].text(),
                 "api_key": widgets["api_key"].text(),
-                "models": models
+                "models": models,
+                **(tab.property("extra") or {})
             }
         new_config_data["PROVIDER_CONFIG"] = provider_config
 
@@ -263,6 +269,12 @@ class ConfigUI(QWidget):
             # 如果原始值为None，且输入为空，则保持None
             if original_value is None and text_value == "":
                 new_config_data[key] = None
+            # 如果原始值是字典/列表，则按JSON解析，解析失败保持原始值
+            elif isinstance(original_value, (dict, list)):
+                try:
+                    new_config_data[key] = json.loads(text_value)
+                except ValueError:
+                    new_config_data[key] = original_value
             # 如果原始值是布尔类型，则转换为布尔值
             elif isinstance(original_value, bool):
                 new_config_data[key] = text_value.lower() in ('true', '1', 'yes', 'on')
@@ -4,6 +4,7 @@ from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit
 from PyQt5.QtCore import Qt
 
 from app.merge_files import merge_files_by_number
+from utils.chapter_store import is_chapter_store
 from utils.i18n import t
 
 class MergeFilesUI(QWidget):
@@ -85,7 +86,7 @@ class MergeFilesUI(QWidget):
         output_name = self.output_file_edit.text().strip()
         show_name = self.show_name_checkbox.isChecked()
 
-        if not input_dir or not os.path.isdir(input_dir):
+        if not input_dir or not (os.path.isdir(input_dir) or is_chapter_store(input_dir)):
             self.log_edit.append(t('merge.invalid_input_dir'))
             return
 
@@ -1,9 +1,10 @@
 import sys
 import os
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QTextEdit, QMenu
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QCheckBox, QFileDialog, QTextEdit, QMenu
 from PyQt5.QtCore import Qt
 
-from app.novel_pre_processor import TextProcessor, read_text_file # 假设这些是需要导入的
+from app.novel_pre_processor import (split_novel_file, split_novel_incremental, analyze_structure,
+                                     format_structure_report)
 from utils.i18n import t
 
 class NovelPreProcessorUI(QWidget):
@@ -36,10 +37,31 @@ class NovelPreProcessorUI(QWidget):
         output_layout.addWidget(self.output_path_button)
         layout.addLayout(output_layout)
 
-        # Run button
+        # Pack options
+        pack_layout = QHBoxLayout()
+        self.pack_checkbox = QCheckBox(t('pre.pack_output'))
+        self.compress_checkbox = QCheckBox(t('pre.compress'))
+        self.compress_checkbox.setEnabled(False)
+        self.pack_checkbox.toggled.connect(self.compress_checkbox.setEnabled)
+        pack_layout.addWidget(self.pack_checkbox)
+        pack_layout.addWidget(self.compress_checkbox)
+        self.incremental_checkbox = QCheckBox(t('pre.incremental'))
+        self.incremental_checkbox.setToolTip(t('pre.incremental_tip'))
+        self.incremental_checkbox.toggled.connect(lambda on: self.pack_checkbox.setEnabled(not on))
+        pack_layout.addWidget(self.incremental_checkbox)
+        pack_layout.addStretch()
+        layout.addLayout(pack_layout)
+
+        # Run buttons
+        button_layout = QHBoxLayout()
+        self.dry_run_button = QPushButton(t('pre.dry_run'))
+        self.dry_run_button.setToolTip(t('pre.dry_run_tip'))
+        self.dry_run_button.clicked.connect(self.run_dry_run)
         self.run_button = QPushButton(t('pre.start'))
         self.run_button.clicked.connect(self.run_pre_processor)
-        layout.addWidget(self.run_button)
+        button_layout.addWidget(self.dry_run_button)
+        button_layout.addWidget(self.run_button)
+        layout.addLayout(button_layout)
 
         # Log display
         self.log_edit = QTextEdit()
@@ -67,6 +89,16 @@ class NovelPreProcessorUI(QWidget):
         if dir_path:
             self.output_path_edit.setText(dir_path)
 
+    def run_dry_run(self):
+        input_path = self.input_path_edit.text()
+        if not input_path or not os.path.exists(input_path):
+            self.log_edit.append(t('pre.invalid_input_file'))
+            return
+        try:
+            self.log_edit.append(format_structure_report(analyze_structure(input_path)))
+        except Exception as e:
+            self.log_edit.append(t('pre.error', err=str(e)))
+
     def run_pre_processor(self):
         input_path = self.input_path_edit.text()
         output_path = self.output_path_edit.text()
@@ -83,23 +115,12 @@ class NovelPreProcessorUI(QWidget):
             # Redirect stdout to log_edit
             sys.stdout = self
             
-            processor = TextProcessor()
-            test_text = read_text_file(input_path)
-            chapters = processor.split_chapters(test_text)
-            
-            os.makedirs(output_path, exist_ok=True)
-            
-            for chapter in chapters:
-                chapter_title = f"第{chapter.number}章_{chapter.title.replace(' ', '').replace('　', '')}"
-                filename = f"{chapter_title}_{chapter.number}.txt"
-                filename = "".join(c for c in filename if c not in r'\/:*?"<>|')
-                
-                output_file = os.path.join(output_path, filename)
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(f"{chapter_title}\n\n{chapter.content}")
-                print(f"保存章节: {filename}")
-            
-            print(f"完成！共保存 {len(chapters)} 个章节文件到 {output_path}")
+            if self.incremental_checkbox.isChecked():
+                split_novel_incremental(input_path, output_path)
+            else:
+                count = split_novel_file(input_path, output_path, pack=self.pack_checkbox.isChecked(),
+                                         compress=self.compress_checkbox.isChecked())
+                print(f"完成！共保存 {count} 个章节文件到 {output_path}")
             self.log_edit.append(t('pre.success', path=output_path))
         except Exception as e:
             self.log_edit.append(t('pre.error', err=str(e)))
@@ -119,4 +140,10 @@ class NovelPreProcessorUI(QWidget):
         self.output_path_label.setText(t('common.output_dir_path'))
         self.input_path_button.setText(t('common.select_file'))
         self.output_path_button.setText(t('common.select_dir'))
-        self.run_button.setText(t('pre.start'))
\ No newline at end of file
+        self.run_button.setText(t('pre.start'))
+        self.dry_run_button.setText(t('pre.dry_run'))
+        self.dry_run_button.setToolTip(t('pre.dry_run_tip'))
+        self.pack_checkbox.setText(t('pre.pack_output'))
+        self.compress_checkbox.setText(t('pre.compress'))
+        self.incremental_checkbox.setText(t('pre.incremental'))
+        self.incremental_checkbox.setToolTip(t('pre.incremental_tip'))
\ No newline at end of file
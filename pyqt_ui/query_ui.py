@@ -3,13 +3,15 @@ import os
 import asyncio
 import json
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QTextEdit, QSpinBox, QComboBox, QMenu
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QTextEdit, QSpinBox, QComboBox, QMenu,
+    QCheckBox
 )
 from PyQt5.QtCore import QThread, pyqtSignal, Qt
 from utils.paths import get_config_path
 from utils.i18n import t
 
 from app.query import Query
+from utils.chapter_store import is_chapter_store
 
 class QueryWorker(QThread):
     finished = pyqtSignal()
@@ -64,6 +66,17 @@ class QueryUI(QWidget):
             default_provider = self.config_data.get("DEFAULT_PROVIDER")
             if default_provider in providers:
                 self.provider_combo.setCurrentText(default_provider)
+        # 生成参数档案：空白项表示按模型映射/全局默认
+        self.profile_combo.clear()
+        self.profile_combo.addItem("")
+        if self.config_data:
+            self.profile_combo.addItems(self.config_data.get("GENERATION_PROFILES", {}).keys())
+        # 文本规范化与近似重复处理的默认值
+        self.normalize_checkbox.setChecked(((self.config_data or {}).get("NORMALIZATION") or {}).get("enabled", False))
+        self.cascade_checkbox.setChecked(bool(((self.config_data or {}).get("CASCADE") or {}).get("enabled", False)))
+        self.per_chapter_checkbox.setChecked(bool(((self.config_data or {}).get("PER_CHAPTER") or {}).get("enabled", False)))
+        mode = ((self.config_data or {}).get("NEAR_DUPLICATES") or {}).get("query_mode", "off")
+        self.dedupe_combo.setCurrentIndex(max(0, self.dedupe_combo.findData(mode)))
         # The currentIndexChanged signal will automatically call update_model_combo
 
     def init_ui(self):
@@ -108,6 +121,14 @@ class QueryUI(QWidget):
         model_layout.addWidget(self.model_combo)
         layout.addLayout(model_layout)
 
+        # Generation profile
+        profile_layout = QHBoxLayout()
+        self.profile_label = QLabel(t('query.profile'))
+        self.profile_combo = QComboBox()
+        profile_layout.addWidget(self.profile_label)
+        profile_layout.addWidget(self.profile_combo)
+        layout.addLayout(profile_layout)
+
         # Concurrent
         concurrent_layout = QHBoxLayout()
         self.concurrent_label = QLabel(t('query.concurrent'))
@@ -139,6 +160,19 @@ class QueryUI(QWidget):
         prompt_path_layout.addWidget(self.prompt_path_button)
         layout.addLayout(prompt_path_layout)
 
+        # Optional JSON Schema for structured output
+        schema_layout = QHBoxLayout()
+        self.schema_label = QLabel(t('query.schema'))
+        self.schema_label.setToolTip(t('query.schema_tip'))
+        self.schema_edit = QLineEdit()
+        self.schema_edit.setPlaceholderText(t('query.schema_placeholder'))
+        self.schema_button = QPushButton(t('common.select_file'))
+        self.schema_button.clicked.connect(lambda: self.select_file(self.schema_edit, t('query.schema_filter')))
+        schema_layout.addWidget(self.schema_label)
+        schema_layout.addWidget(self.schema_edit)
+        schema_layout.addWidget(self.schema_button)
+        layout.addLayout(schema_layout)
+
         # Name Prefix
         name_prefix_layout = QHBoxLayout()
         self.name_prefix_label = QLabel(t('query.output_prefix'))
@@ -167,6 +201,66 @@ class QueryUI(QWidget):
         end_pos_layout.addWidget(self.end_pos_spin)
         layout.addLayout(end_pos_layout)
 
+        # Summary-tier inputs
+        tiers_layout = QHBoxLayout()
+        self.tiers_label = QLabel(t('query.tiers'))
+        self.tiers_edit = QLineEdit()
+        self.tiers_edit.setPlaceholderText(t('query.tiers_placeholder'))
+        self.tiers_edit.setToolTip(t('query.tiers_tip'))
+        self.tiers_button = QPushButton(t('common.select_dir'))
+        self.tiers_button.clicked.connect(self.add_tier_directory)
+        tiers_layout.addWidget(self.tiers_label)
+        tiers_layout.addWidget(self.tiers_edit)
+        tiers_layout.addWidget(self.tiers_button)
+        layout.addLayout(tiers_layout)
+
+        # Full-text match filter
+        match_layout = QHBoxLayout()
+        self.match_label = QLabel(t('query.match'))
+        self.match_edit = QLineEdit()
+        self.match_edit.setPlaceholderText(t('query.match_placeholder'))
+        self.match_edit.setToolTip(t('query.match_tip'))
+        match_layout.addWidget(self.match_label)
+        match_layout.addWidget(self.match_edit)
+        layout.addLayout(match_layout)
+
+        # Text normalization
+        self.normalize_checkbox = QCheckBox(t('query.normalize'))
+        self.normalize_checkbox.setToolTip(t('query.normalize_tip'))
+        layout.addWidget(self.normalize_checkbox)
+
+        # Early termination: stop after N positive results (0 = run every batch)
+        stop_after_layout = QHBoxLayout()
+        self.stop_after_label = QLabel(t('query.stop_after'))
+        self.stop_after_label.setToolTip(t('query.stop_after_tip'))
+        self.stop_after_spin = QSpinBox()
+        self.stop_after_spin.setRange(0, 9999)
+        self.stop_after_spin.setValue(0)
+        stop_after_layout.addWidget(self.stop_after_label)
+        stop_after_layout.addWidget(self.stop_after_spin)
+        layout.addLayout(stop_after_layout)
+
+        # Cascade: cheap classifier model first
+        self.cascade_checkbox = QCheckBox(t('query.cascade'))
+        self.cascade_checkbox.setToolTip(t('query.cascade_tip'))
+        layout.addWidget(self.cascade_checkbox)
+
+        # Per-chapter results (reusable across batch sizes)
+        self.per_chapter_checkbox = QCheckBox(t('query.per_chapter'))
+        self.per_chapter_checkbox.setToolTip(t('query.per_chapter_tip'))
+        layout.addWidget(self.per_chapter_checkbox)
+
+        # Near-duplicate chapters
+        dedupe_layout = QHBoxLayout()
+        self.dedupe_label = QLabel(t('query.dedupe'))
+        self.dedupe_label.setToolTip(t('query.dedupe_tip'))
+        self.dedupe_combo = QComboBox()
+        for mode in ("off", "skip", "stub"):
+            self.dedupe_combo.addItem(t(f'query.dedupe_{mode}'), mode)
+        dedupe_layout.addWidget(self.dedupe_label)
+        dedupe_layout.addWidget(self.dedupe_combo)
+        layout.addLayout(dedupe_layout)
+
         # Run button
         run_button_layout = QHBoxLayout()
         self.run_button = QPushButton(t('query.start'))
@@ -187,6 +281,14 @@ class QueryUI(QWidget):
 
         self.setLayout(layout)
 
+    def add_tier_directory(self):
+        """Append a summary output directory to the tier list (semicolon separated)"""
+        directory = QFileDialog.getExistingDirectory(self, t('query.tiers'))
+        if directory:
+            current = [d for d in self.tiers_edit.text().split(";") if d.strip()]
+            if directory not in current:
+                self.tiers_edit.setText(";".join(current + [directory]))
+
     def show_log_context_menu(self, pos):
         context_menu = QMenu(self)
         clear_action = context_menu.addAction(t('common.clear_log'))
@@ -240,6 +342,7 @@ class QueryUI(QWidget):
         output_path = self.output_path_edit.text()
         provider_id = self.provider_combo.currentText()
         model_id = self.model_combo.currentText()
+        profile = self.profile_combo.currentText() or None
         concurrent = self.concurrent_spin.value()
         batch_size = self.batch_size_spin.value()
         prompt_path = self.prompt_path_edit.text()
@@ -250,7 +353,7 @@ class QueryUI(QWidget):
         if start_pos == 0: start_pos = None
         if end_pos == 0: end_pos = None
 
-        if not input_path or not os.path.isdir(input_path):
+        if not input_path or not (os.path.isdir(input_path) or is_chapter_store(input_path)):
             self.log_edit.append(t('query.invalid_input_dir'))
             return
         if not output_path:
@@ -259,6 +362,10 @@ class QueryUI(QWidget):
         if not prompt_path or not os.path.exists(prompt_path):
             self.log_edit.append(t('query.invalid_prompt'))
             return
+        schema_path = self.schema_edit.text().strip()
+        if schema_path and not os.path.exists(schema_path):
+            self.log_edit.append(t('query.invalid_schema'))
+            return
 
         self.log_edit.clear()
         self.log_edit.append(t('query.started'))
@@ -274,7 +381,16 @@ class QueryUI(QWidget):
                 prompt_path=prompt_path,
                 name_prefix=name_prefix,
                 start_pos=start_pos,
-                end_pos=end_pos
+                end_pos=end_pos,
+                profile=profile,
+                normalize=self.normalize_checkbox.isChecked(),
+                dedupe=self.dedupe_combo.currentData(),
+                match=self.match_edit.text(),
+                cascade=self.cascade_checkbox.isChecked(),
+                per_chapter=self.per_chapter_checkbox.isChecked(),
+                schema=schema_path or None,
+                stop_after=self.stop_after_spin.value() or None,
+                tiers=[d.strip() for d in self.tiers_edit.text().split(";") if d.strip()]
             )
 
             self.worker = QueryWorker(query_processor)
@@ -310,12 +426,36 @@ class QueryUI(QWidget):
         self.output_path_label.setText(t('common.output_dir'))
         self.provider_label.setText(t('query.provider'))
         self.model_label.setText(t('query.model_id'))
+        self.profile_label.setText(t('query.profile'))
         self.concurrent_label.setText(t('query.concurrent'))
         self.batch_size_label.setText(t('query.batch_size'))
         self.prompt_path_label.setText(t('query.prompt_file'))
+        self.schema_label.setText(t('query.schema'))
+        self.schema_label.setToolTip(t('query.schema_tip'))
+        self.schema_edit.setPlaceholderText(t('query.schema_placeholder'))
+        self.schema_button.setText(t('common.select_file'))
         self.name_prefix_label.setText(t('query.output_prefix'))
         self.start_pos_label.setText(t('query.start_pos'))
         self.end_pos_label.setText(t('query.end_pos'))
+        self.tiers_label.setText(t('query.tiers'))
+        self.tiers_edit.setPlaceholderText(t('query.tiers_placeholder'))
+        self.tiers_edit.setToolTip(t('query.tiers_tip'))
+        self.tiers_button.setText(t('common.select_dir'))
+        self.match_label.setText(t('query.match'))
+        self.match_edit.setPlaceholderText(t('query.match_placeholder'))
+        self.match_edit.setToolTip(t('query.match_tip'))
+        self.normalize_checkbox.setText(t('query.normalize'))
+        self.normalize_checkbox.setToolTip(t('query.normalize_tip'))
+        self.stop_after_label.setText(t('query.stop_after'))
+        self.stop_after_label.setToolTip(t('query.stop_after_tip'))
+        self.cascade_checkbox.setText(t('query.cascade'))
+        self.cascade_checkbox.setToolTip(t('query.cascade_tip'))
+        self.per_chapter_checkbox.setText(t('query.per_chapter'))
+        self.per_chapter_checkbox.setToolTip(t('query.per_chapter_tip'))
+        self.dedupe_label.setText(t('query.dedupe'))
+        self.dedupe_label.setToolTip(t('query.dedupe_tip'))
+        for i in range(self.dedupe_combo.count()):
+            self.dedupe_combo.setItemText(i, t(f'query.dedupe_{self.dedupe_combo.itemData(i)}'))
         self.input_path_button.setText(t('common.select_dir'))
         self.output_path_button.setText(t('common.select_dir'))
         self.prompt_path_button.setText(t('common.select_file'))
@@ -1,12 +1,15 @@
 import sys
 import os
 import re
+import time
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout,
                              QHBoxLayout, QPushButton, QTreeWidget, QTreeWidgetItem, QTextEdit,
-                             QLabel, QFileDialog, QSplitter, QFrame, QMenu)
+                             QLabel, QFileDialog, QSplitter, QFrame, QMenu, QLineEdit)
 from PyQt5.QtCore import Qt, QTimer, QEvent
 from PyQt5.QtGui import QFont, QColor
-from utils.readtxt import read_text_file
+from utils.text_cache import read_text_cached, get_text_cache
+from utils.chapter_store import DirectoryChapterSource, PackedChapterStore, is_chapter_store, split_member_path
+from utils.search_index import ChapterSearchIndex
 from utils.i18n import t
 
 
@@ -17,6 +20,8 @@ class ReaderUI(QWidget):
         self.current_directory = ""
         self.directories = []
         self.directory_items = {}
+        self.pack_stores = {} # Map pack file path to PackedChapterStore
+        self.search_indexes = {} # Map directory/pack path to ChapterSearchIndex
         self.last_modified_time = None
         self._cached_raw_content = "" # Cache for raw text content
         self.is_dirty = False
@@ -110,6 +115,10 @@ class ReaderUI(QWidget):
         self.select_dir_btn.clicked.connect(self.select_directory)
         dir_button_layout.addWidget(self.select_dir_btn)
 
+        self.open_pack_btn = QPushButton(t('reader.open_pack'))
+        self.open_pack_btn.clicked.connect(self.select_pack)
+        dir_button_layout.addWidget(self.open_pack_btn)
+
         self.clear_dir_btn = QPushButton(t('reader.clear'))
         self.clear_dir_btn.clicked.connect(self.clear_directories)
         self.clear_dir_btn.setToolTip(t('reader.clear_tooltip'))
@@ -138,6 +147,24 @@ class ReaderUI(QWidget):
         self.file_list.customContextMenuRequested.connect(self.show_context_menu)
         left_layout.addWidget(self.file_list)
 
+        # Full-text search over the opened directories and packs
+        search_layout = QHBoxLayout()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText(t('reader.search_placeholder'))
+        self.search_edit.setToolTip(t('reader.search_tip'))
+        self.search_edit.returnPressed.connect(self.run_search)
+        search_layout.addWidget(self.search_edit)
+        self.search_btn = QPushButton(t('reader.search'))
+        self.search_btn.clicked.connect(self.run_search)
+        search_layout.addWidget(self.search_btn)
+        left_layout.addLayout(search_layout)
+
+        self.search_results = QTreeWidget()
+        self.search_results.setHeaderHidden(True)
+        self.search_results.itemClicked.connect(self.on_search_result_clicked)
+        self.search_results.hide()
+        left_layout.addWidget(self.search_results)
+
         return left_frame
 
     def create_right_panel(self):
@@ -233,7 +260,7 @@ class ReaderUI(QWidget):
             self.leave_edit_mode()
 
     def enter_edit_mode(self):
-        if not self.current_file:
+        if not self.current_file or split_member_path(self.current_file):
             return
         try:
             self.text_display.textChanged.disconnect()
@@ -282,6 +309,7 @@ class ReaderUI(QWidget):
             self._cached_raw_content = current_text
             with open(self.current_file, 'w', encoding='utf-8') as file:
                 file.write(self._cached_raw_content)
+            get_text_cache().invalidate(self.current_file)
 
             self.last_modified_time = os.path.getmtime(self.current_file)
             self.is_dirty = False
@@ -303,11 +331,24 @@ class ReaderUI(QWidget):
             self.update_directory_display()
             self.add_directory_to_tree(directory)
 
+    def select_pack(self):
+        pack_path, _ = QFileDialog.getOpenFileName(self, t('reader.open_pack'), self.current_directory or "", t('reader.pack_filter'))
+        if pack_path and pack_path not in self.directories:
+            self.directories.append(pack_path)
+            if not self.current_directory:
+                self.current_directory = os.path.dirname(pack_path)
+            self.update_directory_display()
+            self.add_directory_to_tree(pack_path)
+
     def clear_directories(self):
         self.directories.clear()
         self.current_directory = ""
         self.file_list.clear()
         self.directory_items.clear()
+        self.pack_stores.clear()
+        self.search_indexes.clear()
+        self.search_results.clear()
+        self.search_results.hide()
         self.dir_label.setText(t('reader.no_dir'))
         self.status_label.setText(t('reader.cleared_all'))
 
@@ -342,6 +383,10 @@ class ReaderUI(QWidget):
         if directory in self.directory_items:
             return # Already exists
 
+        if is_chapter_store(directory):
+            self.add_pack_to_tree(directory)
+            return
+
         try:
             folder_name = os.path.basename(directory)
             folder_item = QTreeWidgetItem(self.file_list, [f"📁 {folder_name}"])
@@ -352,14 +397,9 @@ class ReaderUI(QWidget):
             folder_item.setFont(0, font)
             self.directory_items[directory] = folder_item
 
-            txt_files = [f for f in os.listdir(directory) if f.endswith('.txt')]
-            
-            def natural_sort_key(filename):
-                return [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', filename)]
-            
-            txt_files.sort(key=natural_sort_key)
-            
-            for filename in txt_files:
+            # Same chapter order as Query and merge (index.json, rebuilt if missing or stale)
+            for entry in DirectoryChapterSource(directory).entries:
+                filename = entry.filename
                 full_path = os.path.join(directory, filename)
                 file_item = QTreeWidgetItem(folder_item, [f"  📄 {filename}"])
                 file_item.setData(0, Qt.UserRole, full_path)
@@ -370,6 +410,88 @@ class ReaderUI(QWidget):
             self.status_label.setText(t('reader.read_dir_failed', path=directory, err=str(e)))
 
 
+    def add_pack_to_tree(self, pack_path):
+        """Chapter pack: list chapters from its index, children use <pack>::<filename> paths"""
+        try:
+            store = PackedChapterStore(pack_path)
+            self.pack_stores[pack_path] = store
+            pack_item = QTreeWidgetItem(self.file_list, [f"📦 {os.path.basename(pack_path)}"])
+            pack_item.setData(0, Qt.UserRole, pack_path)
+            pack_item.setExpanded(True)
+            font = pack_item.font(0)
+            font.setBold(True)
+            pack_item.setFont(0, font)
+            self.directory_items[pack_path] = pack_item
+
+            for entry in store.entries:
+                file_item = QTreeWidgetItem(pack_item, [f"  📄 {entry.filename}"])
+                file_item.setData(0, Qt.UserRole, store.member_path(entry))
+
+            self.status_label.setText(t('reader.added_dir', path=pack_path))
+
+        except Exception as e:
+            self.status_label.setText(t('reader.read_dir_failed', path=pack_path, err=str(e)))
+
+    def run_search(self):
+        """Search every opened directory/pack; the index is built or incrementally updated on demand"""
+        query = self.search_edit.text().strip()
+        self.search_results.clear()
+        if not query or not self.directories:
+            self.search_results.hide()
+            return
+        started = time.perf_counter()
+        total = 0
+        try:
+            for directory in self.directories:
+                index = self.search_indexes.get(directory)
+                if index is None:
+                    index = self.search_indexes[directory] = ChapterSearchIndex.open(directory)
+                else:
+                    index.refresh(directory)
+                hits = index.search(query, limit=200)
+                total += len(hits)
+                for hit in hits:
+                    # Same path as the file tree item (<pack>::<filename> for packs)
+                    path = index.source.member_path(index.source.entries[hit.position - 1])
+                    hit_item = QTreeWidgetItem(self.search_results,
+                                               [t('reader.search_hit', name=hit.filename, count=hit.count)])
+                    hit_item.setData(0, Qt.UserRole, path)
+                    hit_item.setToolTip(0, "\n".join(hit.snippets))
+                    for snippet in hit.snippets:
+                        snippet_item = QTreeWidgetItem(hit_item, [snippet])
+                        snippet_item.setData(0, Qt.UserRole, path)
+                        snippet_item.setToolTip(0, snippet)
+            self.search_results.show()
+            self.status_label.setText(t('reader.search_result', query=query, count=total,
+                                        ms=int((time.perf_counter() - started) * 1000)))
+        except Exception as e:
+            self.status_label.setText(t('reader.search_failed', err=str(e)))
+
+    def on_search_result_clicked(self, item, column):
+        """Select the matching chapter in the file tree (which loads it)"""
+        path = item.data(0, Qt.UserRole)
+        for i in range(self.file_list.topLevelItemCount()):
+            folder_item = self.file_list.topLevelItem(i)
+            for j in range(folder_item.childCount()):
+                if folder_item.child(j).data(0, Qt.UserRole) == path:
+                    self.file_list.setCurrentItem(folder_item.child(j))
+                    self.file_list.scrollToItem(folder_item.child(j))
+                    return
+
+    def read_path(self, filepath):
+        """Read a chapter file, or a chapter inside a pack via its <pack>::<filename> path"""
+        member = split_member_path(filepath)
+        if member is None:
+            return read_text_cached(filepath)
+        pack_path, filename = member
+        store = self.pack_stores.get(pack_path)
+        if store is None:
+            store = self.pack_stores[pack_path] = PackedChapterStore(pack_path)
+        entry = store.find_member(filename)
+        if entry is None:
+            raise FileNotFoundError(filename)
+        return store.read(entry)
+
     def on_tree_item_clicked(self, item, column):
         if item.childCount() > 0:  # It's a folder
             item.setExpanded(not item.isExpanded())
@@ -395,20 +517,21 @@ class ReaderUI(QWidget):
             self.leave_edit_mode()
 
         try:
-            content = read_text_file(filepath)
+            content = self.read_path(filepath)
             self._cached_raw_content = content
+            member = split_member_path(filepath)
 
             self.text_display.setReadOnly(True)
             self._render_preview(self._cached_raw_content)
             self.file_title.setText(f"📖 {os.path.basename(filepath)}")
             self.current_file = filepath
-            self.last_modified_time = os.path.getmtime(filepath)
+            self.last_modified_time = os.path.getmtime(member[0] if member else filepath)
             self.is_dirty = False
-            self.edit_save_btn.setEnabled(True)
+            self.edit_save_btn.setEnabled(member is None)
 
             word_count = len(content.replace('\n', '').replace(' ', ''))
             self.word_count_label.setText(t('reader.word_count', count=f"{word_count:,}"))
-            self.status_label.setText(t('reader.preview_mode'))
+            self.status_label.setText(t('reader.pack_read_only') if member else t('reader.preview_mode'))
 
         except Exception as e:
             self.text_display.setPlainText(f"读取文件失败: {str(e)}")
@@ -475,13 +598,20 @@ class ReaderUI(QWidget):
         self.status_label.setText(t('reader.font_size_status', size=new_size))
 
     def check_file_changes(self):
-        if not self.current_file or not os.path.exists(self.current_file) or not self.text_display.isReadOnly():
+        if not self.current_file or not self.text_display.isReadOnly():
+            return
+        member = split_member_path(self.current_file)
+        watched_path = member[0] if member else self.current_file
+        if not os.path.exists(watched_path):
             return
 
         try:
-            current_modified_time = os.path.getmtime(self.current_file)
+            current_modified_time = os.path.getmtime(watched_path)
             if self.last_modified_time and current_modified_time > self.last_modified_time:
-                new_content = read_text_file(self.current_file)
+                if member:
+                    # Pack was rewritten: reload its index
+                    self.pack_stores.pop(member[0], None)
+                new_content = self.read_path(self.current_file)
                 if new_content != self._cached_raw_content:
                     self.reload_current_file(new_content)
                 self.last_modified_time = current_modified_time
@@ -493,7 +623,7 @@ class ReaderUI(QWidget):
 
         try:
             if new_content is None:
-                new_content = read_text_file(self.current_file)
+                new_content = self.read_path(self.current_file)
 
             self._cached_raw_content = new_content
 
@@ -508,7 +638,8 @@ class ReaderUI(QWidget):
             else: # In preview mode
                 self._render_preview(new_content)
 
-            self.last_modified_time = os.path.getmtime(self.current_file)
+            member = split_member_path(self.current_file)
+            self.last_modified_time = os.path.getmtime(member[0] if member else self.current_file)
             self.status_label.setText(t('reader.file_reloaded'))
             word_count = len(new_content.replace('\n', '').replace(' ', ''))
             self.word_count_label.setText(t('reader.word_count', count=f"{word_count:,}"))
@@ -545,6 +676,8 @@ class ReaderUI(QWidget):
                 if index != -1:
                     self.file_list.takeTopLevelItem(index)
                 del self.directory_items[directory_to_close]
+            self.pack_stores.pop(directory_to_close, None)
+            self.search_indexes.pop(directory_to_close, None)
 
             self.update_directory_display()
             self.status_label.setText(t('reader.folder_closed', name=os.path.basename(directory_to_close)))
@@ -553,8 +686,12 @@ class ReaderUI(QWidget):
         """Update UI text when language changes"""
         self.title_label.setText(t('reader.browser_title'))
         self.select_dir_btn.setText(t('reader.select_folder'))
+        self.open_pack_btn.setText(t('reader.open_pack'))
         self.clear_dir_btn.setText(t('reader.clear'))
         self.clear_dir_btn.setToolTip(t('reader.clear_tooltip'))
+        self.search_edit.setPlaceholderText(t('reader.search_placeholder'))
+        self.search_edit.setToolTip(t('reader.search_tip'))
+        self.search_btn.setText(t('reader.search'))
         self.edit_save_btn.setText(t('reader.edit') if self.text_display.isReadOnly() else t('reader.save'))
         self.font_size_label.setText(t('reader.font_size'))
 
@@ -0,0 +1,44 @@
+from utils.heading_grammar import EXTRA_BASE
+from utils.text_processor import TextProcessor
+from app.novel_pre_processor import chapter_filename
+
+
+def _split_both(text):
+    """整本拆分与分块流式拆分识别出的章节应一致（split_chapters 按章节号排序）"""
+    whole = [(c.number, c.title, c.content) for c in TextProcessor().split_chapters(text)]
+    chunks = [text[i:i + 7] for i in range(0, len(text), 7)]
+    streamed = sorted((c.number, c.title, c.content) for c in TextProcessor().iter_chapters(chunks))
+    assert [(n, t, c.strip()) for n, t, c in whole] == [(n, t, c.strip()) for n, t, c in streamed]
+    return whole
+
+
+def test_mid_book_extra_does_not_take_chapter_number():
+    text = ("第一章 开端\n甲\n"
+            "第二章 相遇\n乙\n"
+            "番外一 旧事\n丙\n"
+            "第三章 离别\n丁\n")
+    chapters = _split_both(text)
+    regular = [(n, t) for n, t, _ in chapters if n <= EXTRA_BASE]
+    extras = [(n, t) for n, t, _ in chapters if n > EXTRA_BASE]
+    assert [n for n, _ in regular] == [1, 2, 3]
+    assert "离别" in dict(regular)[3]
+    assert [n for n, _ in extras] == [EXTRA_BASE + 1]
+    assert "丁" in [c for n, _, c in chapters if n == 3][0]
+
+
+def test_extra_filename_keeps_number_suffix():
+    processor = TextProcessor()
+    extra = [c for c in processor.split_chapters("第一章 开端\n甲\n番外一 旧事\n丙\n") if c.number > EXTRA_BASE][0]
+    name = chapter_filename(extra)
+    assert name.startswith("番外1_")
+    assert name.endswith(f"_{EXTRA_BASE + 1}.txt")
+
+
+def test_inline_prose_does_not_switch_hui_novel_mode():
+    text = ("第一回 起始\n甲\n"
+            "第二回 风波\n书中第三章写道，此事另有缘由。\n"
+            "第三回 转机\n丙\n"
+            "第四回 团圆\n丁\n")
+    chapters = _split_both(text)
+    assert [n for n, _, _ in chapters] == [1, 2, 3, 4]
+    assert "书中第三章写道" in chapters[1][2]
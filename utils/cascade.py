@@ -0,0 +1,97 @@
+"""
+级联调用
+世界地图提炼、相似剧情寻找这类任务中，大多数批次对结果没有贡献。级联模式先让便宜、快速的模型
+对每个批次回答一个简短的相关性问题，只有判为相关的批次才交给主模型；
+判为无关的批次按 audit_rate 抽查一部分，仍交给主模型，用于估计漏检率。
+可在 config.json 的 CASCADE 中调整
+"""
+
+import re
+import json
+import random
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Optional
+
+from .paths import get_config_path
+
+# 初筛模型的提问：{task} 为任务说明，{input_content} 为批次内容
+DEFAULT_QUESTION = (
+    "下面是小说的若干章节。另有一个分析任务（见\"任务\"），请只判断这些章节中是否包含与该任务相关、"
+    "值得交给该任务处理的内容。\n"
+    "任务：\n{task}\n"
+    "----------------------------------------\n"
+    "{input_content}\n"
+    "----------------------------------------\n"
+    "只输出一个0到1之间的数字，表示包含相关内容的可能性，不要输出其他内容。"
+)
+
+_NUMBER = re.compile(r'(?<![\d.])(0(?:\.\d+)?|1(?:\.0+)?|\.\d+)(?![\d.])')
+_YES = re.compile(r'是|相关|存在|yes|true', re.IGNORECASE)
+_NO = re.compile(r'否|不相关|无关|不存在|no|false', re.IGNORECASE)
+
+
+@dataclass
+class CascadeConfig:
+    """级联设置
+
+    enabled: Query 是否默认启用级联
+    provider / model / profile: 初筛模型与生成参数档案
+    task: 任务说明，为空时使用主 prompt（{input_content} 替换为"（章节内容）"）
+    question: 初筛提问模板，为空时使用 DEFAULT_QUESTION
+    threshold: 相关性不低于该值的批次交给主模型
+    audit_rate: 判为无关的批次中抽查（仍交给主模型）的比例
+    negative_pattern: 主模型的回答匹配该正则（search）时视为没有结果，用于统计抽查中的漏检
+    """
+    enabled: bool = False
+    provider: str = ""
+    model: str = ""
+    profile: str = ""
+    task: str = ""
+    question: str = ""
+    threshold: float = 0.5
+    audit_rate: float = 0.05
+    negative_pattern: str = r"^\W*不存在"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CascadeConfig":
+        """从配置字典构建设置，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def load_cascade_config() -> CascadeConfig:
+    """读取 config.json 中的 CASCADE，缺失或无法读取时使用默认设置"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("CASCADE") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return CascadeConfig.from_dict(data)
+
+
+def build_question(config: CascadeConfig, prompt_template: str) -> str:
+    """初筛提问模板（仍含 {input_content} 占位符）"""
+    task = config.task.strip() or prompt_template.replace("{input_content}", "（章节内容）").strip()
+    return (config.question or DEFAULT_QUESTION).replace("{task}", task)
+
+
+def parse_relevance(answer: str) -> Optional[float]:
+    """
+    从初筛模型的回答中取出相关性（0到1）
+
+    优先取回答中的第一个0到1之间的数字，其次按"是/否"判断；都没有时返回None
+    """
+    answer = answer.strip()
+    m = _NUMBER.search(answer)
+    if m:
+        return float(m.group(1))
+    if _NO.search(answer):
+        return 0.0
+    if _YES.search(answer):
+        return 1.0
+    return None
+
+
+def should_audit(key: str, rate: float) -> bool:
+    """按 key 确定性地抽样（断点续跑时同一批次的抽查结果不变）"""
+    return rate > 0 and random.Random(key).random() < rate
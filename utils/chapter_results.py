@@ -0,0 +1,186 @@
+"""
+逐章结果
+批次结果按"前缀_bs批次大小_批次N.txt"保存，换了批次大小之前的结果就都用不上了。
+逐章模式在 prompt 末尾要求模型按章节分段作答（每段以分隔行开头），把回答拆成逐章的结果记录，
+检查批次中每章都有结果，缺失的章节再单独发送；之后任何批次大小的运行都会复用已有的逐章结果。
+可在 config.json 的 PER_CHAPTER 中调整
+"""
+
+import os
+import re
+import json
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional
+
+from .chapter_store import ChapterEntry
+from .paths import get_config_path
+
+# 追加在 prompt 末尾的分段要求
+DEFAULT_INSTRUCTION = (
+    "\n\n----------------------------------------\n"
+    "输出格式要求：按输入中章节出现的顺序，对每一章分别作答。每章的回答以单独一行\n"
+    "【章节：标记】\n"
+    "开头，标记为该章在输入中的文件名（\"=== 文件名 ===\"中的文件名）或\"第N章\"；"
+    "某章没有相关内容时也要保留分隔行，并在其下写明\"不存在\"。"
+)
+
+_DELIMITER = re.compile(r"^[ \t#*>]*【\s*章节\s*[:：]\s*(.+?)\s*】[ \t*]*$", re.MULTILINE)
+_NUMBER = re.compile(r"第\s*(\d+)\s*章")
+_INDEX = "index.json"
+_VERSION = 1
+
+
+@dataclass
+class PerChapterConfig:
+    """逐章结果设置
+
+    enabled: Query 是否默认使用逐章模式
+    instruction: 追加在 prompt 末尾的分段要求，为空时使用 DEFAULT_INSTRUCTION
+    requeue: 批次回答中缺失的章节是否单独重新发送（否则留到下次运行）
+    """
+    enabled: bool = False
+    instruction: str = ""
+    requeue: bool = True
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PerChapterConfig":
+        """从配置字典构建设置，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def load_per_chapter_config() -> PerChapterConfig:
+    """读取 config.json 中的 PER_CHAPTER，缺失或无法读取时使用默认设置"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("PER_CHAPTER") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return PerChapterConfig.from_dict(data)
+
+
+def build_prompt_template(config: PerChapterConfig, prompt_template: str) -> str:
+    """在 prompt 模板末尾加上分段要求"""
+    return prompt_template + (config.instruction or DEFAULT_INSTRUCTION)
+
+
+def _match_label(label: str, entries: List[ChapterEntry]) -> Optional[ChapterEntry]:
+    """分隔行中的标记对应的章节：先按文件名（可省略 .txt），再按唯一的"第N章" """
+    name = label.strip().strip("=").strip()
+    for entry in entries:
+        if name in (entry.filename, os.path.splitext(entry.filename)[0]):
+            return entry
+    m = _NUMBER.search(name)
+    if m:
+        matched = [e for e in entries if e.number == int(m.group(1))]
+        if len(matched) == 1:
+            return matched[0]
+    return None
+
+
+def split_sections(text: str, entries: List[ChapterEntry]) -> Dict[str, str]:
+    """
+    把按章节分段的回答拆成逐章结果
+
+    Args:
+        text: 模型的回答
+        entries: 该批次的章节（按顺序）
+
+    Returns:
+        {文件名: 该章的回答}；只有一章时，没有分隔行的回答整段归于该章。
+        无法对应到章节的分段忽略，同一章出现多段时拼接
+    """
+    marks = list(_DELIMITER.finditer(text))
+    if not marks:
+        return {entries[0].filename: text.strip()} if len(entries) == 1 and text.strip() else {}
+    sections: Dict[str, str] = {}
+    for i, mark in enumerate(marks):
+        entry = _match_label(mark.group(1), entries)
+        if entry is None:
+            continue
+        end = marks[i + 1].start() if i + 1 < len(marks) else len(text)
+        body = text[mark.end():end].strip()
+        if body:
+            sections[entry.filename] = f"{sections[entry.filename]}\n\n{body}" if entry.filename in sections else body
+    return sections
+
+
+class ChapterResultStore:
+    """
+    逐章结果：输出目录下的 <前缀>_逐章/ 中每章一个txt，index.json 记录每章结果对应的原文 sha1
+
+    原文改动过（sha1 不同）的章节视为没有结果。
+    status 为 "filtered" 表示级联初筛判为无关，没有结果文件；只在级联模式下算已完成（与批次模式的 _初筛.json 一致）
+    """
+
+    def __init__(self, output_path: str, name_prefix: str):
+        self.path = os.path.join(output_path, f"{name_prefix}_逐章")
+        self.name_prefix = name_prefix
+        self.records: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(os.path.join(self.path, _INDEX), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == _VERSION:
+                self.records = data.get("chapters") or {}
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def result_path(self, filename: str) -> str:
+        return os.path.join(self.path, filename if filename.endswith(".txt") else f"{filename}.txt")
+
+    def has(self, entry: ChapterEntry, cascade: bool = False) -> bool:
+        """
+        该章是否已有与当前原文对应的结果
+
+        Args:
+            entry: 章节
+            cascade: 本次是否为级联模式；是时被初筛判为无关的章节也算已完成，否则需要交给主模型
+        """
+        record = self.records.get(entry.filename)
+        if not record or record.get("sha1") != entry.sha1:
+            return False
+        if record.get("status") == "filtered":
+            return cascade
+        return os.path.exists(self.result_path(entry.filename))
+
+    def read(self, entry: ChapterEntry) -> Optional[str]:
+        """该章的结果，没有（或被初筛跳过）时返回None"""
+        if not self.has(entry):
+            return None
+        with open(self.result_path(entry.filename), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put(self, entry: ChapterEntry, result: str):
+        """保存一章的结果"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.result_path(entry.filename), "w", encoding="utf-8") as f:
+            f.write(result)
+        self.records[entry.filename] = {"number": entry.number, "sha1": entry.sha1, "status": "done"}
+
+    def mark_filtered(self, entry: ChapterEntry):
+        """记录该章被初筛判为无关"""
+        self.records[entry.filename] = {"number": entry.number, "sha1": entry.sha1, "status": "filtered"}
+
+    def save(self):
+        """写出 index.json（每个批次完成后调用，中断后已完成的章节不会丢失）"""
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, _INDEX)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": _VERSION, "chapters": self.records}, f, ensure_ascii=False, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def assemble(self, entries: List[ChapterEntry]) -> Optional[str]:
+        """
+        按章节顺序把已有结果合并为 <前缀>_逐章汇总.txt，返回文件路径；没有任何结果时返回None
+        """
+        pieces = []
+        for entry in entries:
+            result = self.read(entry)
+            if result is not None:
+                pieces.append(f"【章节：{os.path.splitext(entry.filename)[0]}】\n{result.strip()}\n")
+        if not pieces:
+            return None
+        path = os.path.join(os.path.dirname(self.path), f"{self.name_prefix}_逐章汇总.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(pieces))
+        return path
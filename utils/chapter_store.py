@@ -0,0 +1,407 @@
+"""
+章节存储
+统一"章节目录"（每章一个txt）与"章节打包文件"（.nepack，单个数据文件 + 二进制索引）两种形式，
+Query、合并与阅读页通过 open_chapter_source 读取，不必关心输入是哪一种
+"""
+
+import os
+import re
+import json
+import zlib
+import bisect
+import struct
+import hashlib
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .text_cache import read_text_cached
+from .text_processor import estimate_tokens
+
+PACK_SUFFIX = ".nepack"
+# 章节目录中的索引文件（预处理时写出；缺失或过期时读取方只在内存中重建，不写入输入目录）
+INDEX_FILENAME = "index.json"
+_INDEX_VERSION = 1
+# 阅读页中打包文件内章节的虚拟路径：<打包文件路径>::<章节文件名>
+MEMBER_SEP = "::"
+
+_MAGIC = b"NEPACK\x00\x01"
+# 章节号、数据偏移、存储长度、原始字节数、字数、估算token数、标志位、sha1、文件名长度、标题长度
+_ENTRY = struct.Struct("<iQIIIIB20sHH")
+_FOOTER = struct.Struct("<Q8s")
+_FLAG_ZLIB = 1
+
+
+@dataclass
+class ChapterEntry:
+    """章节索引项：目录形式以 filename 定位，打包文件以 offset/length 定位"""
+    number: int
+    filename: str
+    title: str = ""
+    offset: int = 0
+    length: int = 0         # 打包文件中的存储长度（压缩后）
+    size: int = 0           # 字节数：目录形式为磁盘文件大小，打包文件为原始 UTF-8 字节数
+    chars: int = 0
+    tokens: int = 0         # 估算token数
+    sha1: str = ""          # 文本（UTF-8，换行统一为 \n）的 sha1
+    compressed: bool = False
+    mtime_ns: int = 0       # 目录形式的文件修改时间，用于判断索引是否过期
+    volume: str = ""        # 所属的卷名（只记录在目录索引中）
+    duplicate_of: int = 0   # 与之内容近似重复的、更早出现的章节号（只记录在目录索引中）
+
+
+def is_chapter_store(path: str) -> bool:
+    """是否为章节打包文件（按文件头判断，不依赖扩展名）"""
+    if not path or not os.path.isfile(path):
+        return False
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(_MAGIC)) == _MAGIC
+    except OSError:
+        return False
+
+
+def split_member_path(path: str) -> Optional[Tuple[str, str]]:
+    """拆分阅读页的虚拟路径，不是打包文件内的章节时返回None"""
+    if MEMBER_SEP not in path:
+        return None
+    container, member = path.rsplit(MEMBER_SEP, 1)
+    return container, member
+
+
+def _number_from_filename(filename: str) -> Optional[int]:
+    match = re.search(r'_(\d+)\.txt$', filename)
+    return int(match.group(1)) if match else None
+
+
+def chapter_sort_key(filename: str) -> tuple:
+    """
+    章节文件的统一排序：文件名末尾有 _数字 的按该数字排在前面，
+    其余（如查询结果 批次N）按自然顺序（数字部分按数值）排在后面
+    """
+    number = _number_from_filename(filename)
+    if number is not None:
+        return (0, number, [])
+    return (1, 0, [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', filename)])
+
+
+def _title_from_filename(filename: str) -> str:
+    """从 第X章_标题_X.txt 中取出标题，其他文件名取去掉扩展名的部分"""
+    stem = filename[:-4] if filename.endswith(".txt") else filename
+    match = re.match(r'^第\d+章_(.*)_\d+$', stem)
+    return match.group(1) if match else stem
+
+
+def text_entry(number: int, filename: str, title: str, text: str, volume: str = "") -> ChapterEntry:
+    """按文本内容生成索引项（字数、估算token数与sha1）"""
+    return ChapterEntry(number=number, filename=filename, title=title, chars=len(text),
+                        tokens=estimate_tokens(text), sha1=hashlib.sha1(text.encode("utf-8")).hexdigest(),
+                        volume=volume)
+
+
+def write_directory_index(directory: str, entries: List[ChapterEntry]):
+    """写出章节目录的索引文件（先写临时文件再替换）"""
+    chapters = [{"number": e.number, "title": e.title, "filename": e.filename, "bytes": e.size,
+                 "chars": e.chars, "tokens": e.tokens, "sha1": e.sha1, "mtime_ns": e.mtime_ns,
+                 **({"volume": e.volume} if e.volume else {}),
+                 **({"duplicate_of": e.duplicate_of} if e.duplicate_of else {})}
+                for e in entries]
+    path = os.path.join(directory, INDEX_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": _INDEX_VERSION, "chapters": chapters}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_directory_index(directory: str) -> Optional[List[ChapterEntry]]:
+    """读取章节目录的索引文件，不存在或格式不对时返回None"""
+    path = os.path.join(directory, INDEX_FILENAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != _INDEX_VERSION:
+            return None
+        return [ChapterEntry(number=c["number"], filename=c["filename"], title=c.get("title", ""),
+                             size=c["bytes"], chars=c.get("chars", 0), tokens=c.get("tokens", 0),
+                             sha1=c.get("sha1", ""), mtime_ns=c.get("mtime_ns", 0), volume=c.get("volume", ""),
+                             duplicate_of=c.get("duplicate_of", 0))
+                for c in data["chapters"]]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+# 本进程内重建过的目录索引（绝对路径 -> 索引项），读取方不写 index.json，同一目录再次打开时复用
+_REBUILT: Dict[str, List[ChapterEntry]] = {}
+
+
+class DirectoryChapterSource:
+    """
+    章节目录：每章一个txt文件
+
+    章节顺序、编号与统计信息来自目录中的 index.json；索引缺失或与目录中的文件
+    （文件名、大小、修改时间）不一致时，只重新读取变化的文件，在内存中重建索引。
+    打开目录只读取，不会写入（输入目录可能不是拆分工具生成的）；
+    需要保存重建的索引时运行 python -m utils.chapter_store --reindex <目录>
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = self._load_entries()
+
+    def _load_entries(self) -> List[ChapterEntry]:
+        files = {}
+        with os.scandir(self.path) as it:
+            for item in it:
+                if item.name.endswith(".txt") and item.is_file():
+                    stat = item.stat()
+                    files[item.name] = (stat.st_size, stat.st_mtime_ns)
+
+        indexed = load_directory_index(self.path) or []
+        if len(indexed) == len(files) and all(
+                files.get(e.filename) == (e.size, e.mtime_ns) for e in indexed):
+            return indexed
+        key = os.path.abspath(self.path)
+        known = {e.filename: e for e in indexed}
+        known.update({e.filename: e for e in _REBUILT.get(key, [])
+                      if files.get(e.filename) == (e.size, e.mtime_ns)})
+
+        entries = []
+        for filename in sorted(files, key=chapter_sort_key):
+            size, mtime_ns = files[filename]
+            entry = known.get(filename)
+            if entry is None or (entry.size, entry.mtime_ns) != (size, mtime_ns):
+                number = _number_from_filename(filename)
+                title = entry.title if entry is not None else _title_from_filename(filename)
+                text = read_text_cached(os.path.join(self.path, filename))
+                entry = text_entry(number or 0, filename, title, text, entry.volume if entry is not None else "")
+                entry.size, entry.mtime_ns = size, mtime_ns
+            entries.append(entry)
+        if files and _REBUILT.get(key) != entries:
+            print(f"章节索引缺失或已过期，已在内存中重建: {self.path}（{len(entries)} 个文件）")
+        _REBUILT[key] = entries
+        return entries
+
+    def read(self, entry: ChapterEntry) -> str:
+        return read_text_cached(os.path.join(self.path, entry.filename))
+
+    def read_many(self, entries: List[ChapterEntry]) -> List[str]:
+        return [self.read(entry) for entry in entries]
+
+    def iter_read(self, entries: List[ChapterEntry]) -> Iterator[str]:
+        for entry in entries:
+            yield self.read(entry)
+
+    def member_path(self, entry: ChapterEntry) -> str:
+        return os.path.join(self.path, entry.filename)
+
+
+class PackedChapterStore:
+    """
+    章节打包文件
+
+    格式：文件头 | 各章数据（UTF-8，可逐章 zlib 压缩） | 二进制索引 | 索引偏移 + 文件头。
+    索引按章节号排序，按位置或章节号取范围都是切片/二分查找，连续的章节一次读出。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: List[ChapterEntry] = []
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"不是章节打包文件: {path}")
+            f.seek(-_FOOTER.size, os.SEEK_END)
+            index_offset, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"章节打包文件不完整（缺少索引）: {path}")
+            f.seek(index_offset)
+            data = f.read()[:-_FOOTER.size]
+        (count,) = struct.unpack_from("<I", data, 0)
+        pos = 4
+        for _ in range(count):
+            number, offset, length, size, chars, tokens, flags, sha1, name_len, title_len = _ENTRY.unpack_from(data, pos)
+            pos += _ENTRY.size
+            filename = data[pos:pos + name_len].decode("utf-8")
+            pos += name_len
+            title = data[pos:pos + title_len].decode("utf-8")
+            pos += title_len
+            self.entries.append(ChapterEntry(number, filename, title, offset, length, size, chars, tokens,
+                                             sha1.hex(), bool(flags & _FLAG_ZLIB)))
+        self._numbers = [e.number for e in self.entries]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def find(self, number: int) -> Optional[ChapterEntry]:
+        """按章节号查找"""
+        i = bisect.bisect_left(self._numbers, number)
+        if i < len(self._numbers) and self._numbers[i] == number:
+            return self.entries[i]
+        return None
+
+    def range_by_number(self, start: Optional[int] = None, end: Optional[int] = None) -> List[ChapterEntry]:
+        """章节号在 [start, end] 内的章节（左闭右闭）"""
+        lo = 0 if start is None else bisect.bisect_left(self._numbers, start)
+        hi = len(self._numbers) if end is None else bisect.bisect_right(self._numbers, end)
+        return self.entries[lo:hi]
+
+    def member_path(self, entry: ChapterEntry) -> str:
+        return f"{self.path}{MEMBER_SEP}{entry.filename}"
+
+    def find_member(self, filename: str) -> Optional[ChapterEntry]:
+        """按章节文件名查找（阅读页的虚拟路径）"""
+        number = _number_from_filename(filename)
+        if number is not None:
+            entry = self.find(number)
+            if entry is not None and entry.filename == filename:
+                return entry
+        return next((e for e in self.entries if e.filename == filename), None)
+
+    @staticmethod
+    def _decode(entry: ChapterEntry, raw: bytes) -> str:
+        if entry.compressed:
+            raw = zlib.decompress(raw)
+        return raw.decode("utf-8")
+
+    def read(self, entry: ChapterEntry) -> str:
+        with open(self.path, "rb") as f:
+            f.seek(entry.offset)
+            return self._decode(entry, f.read(entry.length))
+
+    def read_many(self, entries: List[ChapterEntry]) -> List[str]:
+        """读取多个章节，数据上相邻的章节合并为一次读取"""
+        return list(self.iter_read(entries))
+
+    def iter_read(self, entries: List[ChapterEntry]) -> Iterator[str]:
+        with open(self.path, "rb") as f:
+            i = 0
+            while i < len(entries):
+                # 找出数据上连续的一段
+                j = i + 1
+                while j < len(entries) and entries[j].offset == entries[j - 1].offset + entries[j - 1].length:
+                    j += 1
+                start = entries[i].offset
+                f.seek(start)
+                block = f.read(entries[j - 1].offset + entries[j - 1].length - start)
+                for entry in entries[i:j]:
+                    yield self._decode(entry, block[entry.offset - start:entry.offset - start + entry.length])
+                i = j
+
+
+class ChapterStoreWriter:
+    """
+    顺序写入章节打包文件
+
+    同一章节号可以多次写入（流式拆分会按出现顺序产出重复章节），
+    关闭时把同号内容以换行拼接成一条新记录；有章节被这样替换时，把仍被引用的记录按章节号顺序
+    复制到新文件，不留下不再被索引引用的旧记录，再写出按章节号排序的索引。
+    先写入临时文件，关闭时替换目标文件，写到一半中断不会留下损坏的打包文件。
+    """
+
+    def __init__(self, path: str, compress: bool = False):
+        self.path = path
+        self.compress = compress
+        self._tmp_path = path + ".tmp"
+        self._f: BinaryIO = open(self._tmp_path, "w+b")
+        self._f.write(_MAGIC)
+        self._entries: Dict[int, ChapterEntry] = {}
+        self._extra: Dict[int, List[ChapterEntry]] = {}
+        self.entries: List[ChapterEntry] = []    # 关闭后为按章节号排序的索引项
+
+    def __contains__(self, number: int) -> bool:
+        return number in self._entries
+
+    def __enter__(self) -> "ChapterStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            os.remove(self._tmp_path)
+
+    def _write_record(self, number: int, filename: str, title: str, text: str) -> ChapterEntry:
+        raw = text.encode("utf-8")
+        data = zlib.compress(raw, 6) if self.compress else raw
+        self._f.seek(0, os.SEEK_END)
+        offset = self._f.tell()
+        self._f.write(data)
+        return ChapterEntry(number, filename, title, offset, len(data), len(raw), len(text), estimate_tokens(text),
+                            hashlib.sha1(raw).hexdigest(), self.compress)
+
+    def add(self, number: int, filename: str, title: str, text: str):
+        """写入一章；章节号已存在时作为续写内容，关闭时以换行拼接到该章末尾"""
+        entry = self._write_record(number, filename, title, text)
+        if number in self._entries:
+            self._extra.setdefault(number, []).append(entry)
+        else:
+            self._entries[number] = entry
+
+    def _read_back(self, entry: ChapterEntry) -> str:
+        self._f.seek(entry.offset)
+        return PackedChapterStore._decode(entry, self._f.read(entry.length))
+
+    def _compact(self, entries: List[ChapterEntry]):
+        """只保留索引引用的记录：按顺序复制到新的临时文件，更新各项的偏移"""
+        compact_path = self._tmp_path + ".compact"
+        with open(compact_path, "w+b") as out:
+            out.write(_MAGIC)
+            for entry in entries:
+                self._f.seek(entry.offset)
+                data = self._f.read(entry.length)
+                entry.offset = out.tell()
+                out.write(data)
+        self._f.close()
+        os.replace(compact_path, self._tmp_path)
+        self._f = open(self._tmp_path, "r+b")
+
+    def close(self) -> List[ChapterEntry]:
+        """合并重复章节、写出索引并替换目标文件，返回按章节号排序的索引项"""
+        for number, extras in self._extra.items():
+            first = self._entries[number]
+            text = "\n".join([self._read_back(first)] + [self._read_back(e) for e in extras])
+            self._entries[number] = self._write_record(number, first.filename, first.title, text)
+
+        entries = sorted(self._entries.values(), key=lambda e: e.number)
+        if self._extra:
+            self._compact(entries)
+        self._f.seek(0, os.SEEK_END)
+        index_offset = self._f.tell()
+        parts = [struct.pack("<I", len(entries))]
+        for e in entries:
+            name = e.filename.encode("utf-8")
+            title = e.title.encode("utf-8")
+            parts.append(_ENTRY.pack(e.number, e.offset, e.length, e.size, e.chars, e.tokens,
+                                     _FLAG_ZLIB if e.compressed else 0, bytes.fromhex(e.sha1),
+                                     len(name), len(title)))
+            parts.append(name)
+            parts.append(title)
+        parts.append(_FOOTER.pack(index_offset, _MAGIC))
+        self._f.write(b"".join(parts))
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+        self.entries = entries
+        return entries
+
+
+def open_chapter_source(path: str):
+    """打开章节输入：打包文件返回 PackedChapterStore，否则按章节目录处理"""
+    if is_chapter_store(path):
+        return PackedChapterStore(path)
+    return DirectoryChapterSource(path)
+
+
+def reindex_directory(path: str) -> List[ChapterEntry]:
+    """重建章节目录的索引并写出 index.json（显式的重建命令，读取方不会写入）"""
+    entries = DirectoryChapterSource(path).entries
+    write_directory_index(path, entries)
+    return entries
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="章节目录索引工具")
+    parser.add_argument("--reindex", required=True, help="重建并保存该章节目录的 index.json")
+    args = parser.parse_args()
+    entries = reindex_directory(args.reindex)
+    print(f"已写入章节索引: {os.path.join(args.reindex, INDEX_FILENAME)}（{len(entries)} 个文件）")
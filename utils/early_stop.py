@@ -0,0 +1,118 @@
+"""
+提前结束
+寻找"前N处"某种剧情这类检索式任务，找到足够的结果后剩余批次就没有必要再跑。
+停止条件：命中的结果数达到N，结果命中的判断可以附加正则或JSON谓词；
+批次可按顺序或按检索预筛的得分从高到低执行。可在 config.json 的 EARLY_STOP 中调整
+"""
+
+import re
+import json
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Optional
+
+from .paths import get_config_path
+
+ORDERS = ("sequential", "ranked")
+
+_JSON_BLOCK = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+
+@dataclass
+class EarlyStopConfig:
+    """提前结束设置
+
+    order: 批次执行顺序，sequential 按批次号，ranked 按检索预筛得分从高到低（未预筛时按批次号）
+    negative_pattern: 结果匹配该正则（search）时视为没有命中
+    """
+    order: str = "sequential"
+    negative_pattern: str = r"^\W*不存在"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EarlyStopConfig":
+        """从配置字典构建设置，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def load_early_stop_config() -> EarlyStopConfig:
+    """读取 config.json 中的 EARLY_STOP，缺失或无法读取时使用默认设置"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("EARLY_STOP") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return EarlyStopConfig.from_dict(data)
+
+
+def extract_json(text: str) -> Any:
+    """取出结果中的JSON：整段、```json 代码块，或第一个 { 到最后一个 } 之间的内容；都不是时返回None"""
+    candidates = [text.strip()] + [m.strip() for m in _JSON_BLOCK.findall(text)]
+    start, end = text.find("{"), text.rfind("}")
+    if 0 <= start < end:
+        candidates.append(text[start:end + 1])
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return None
+
+
+def json_matches(value: Any, predicate: Any) -> bool:
+    """
+    JSON谓词：predicate 为对象时，value 须包含其全部键且值满足（递归）；其他类型按相等比较。
+    value 为数组时任一元素满足即可
+    """
+    if isinstance(value, list) and not isinstance(predicate, list):
+        return any(json_matches(item, predicate) for item in value)
+    if isinstance(predicate, dict):
+        return isinstance(value, dict) and all(k in value and json_matches(value[k], v) for k, v in predicate.items())
+    return value == predicate
+
+
+class StopCondition:
+    """
+    停止条件：结果不匹配 negative_pattern，并且（给出时）匹配 pattern、满足 JSON 谓词，即为一次命中；
+    命中次数达到 after 时停止
+    """
+
+    def __init__(self, after: Optional[int] = None, pattern: Optional[str] = None,
+                 json_predicate: Optional[str] = None, negative_pattern: str = r"^\W*不存在"):
+        try:
+            self.pattern = re.compile(pattern) if pattern else None
+            self.negative = re.compile(negative_pattern) if negative_pattern else None
+        except re.error as e:
+            raise ValueError(f"停止条件中的正则表达式有误: {str(e)}")
+        try:
+            self.predicate = json.loads(json_predicate) if json_predicate else None
+        except ValueError as e:
+            raise ValueError(f"停止条件中的JSON谓词有误: {str(e)}")
+        self.after = max(1, after or 1)
+        self.hits = 0
+
+    def is_hit(self, result: str) -> bool:
+        """结果是否算一次命中"""
+        text = result.strip()
+        if self.negative is not None and self.negative.search(text):
+            return False
+        if self.pattern is not None and not self.pattern.search(text):
+            return False
+        if self.predicate is not None:
+            value = extract_json(text)
+            if value is None or not json_matches(value, self.predicate):
+                return False
+        return True
+
+    def record(self, result: str) -> bool:
+        """记录一个结果，返回是否已满足停止条件"""
+        if self.is_hit(result):
+            self.hits += 1
+        return self.hits >= self.after
+
+    def describe(self) -> str:
+        parts = [f"命中 {self.after} 个结果"]
+        if self.pattern is not None:
+            parts.append(f"结果匹配 /{self.pattern.pattern}/")
+        if self.predicate is not None:
+            parts.append(f"结果满足 {json.dumps(self.predicate, ensure_ascii=False)}")
+        return "，".join(parts)
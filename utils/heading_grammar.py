@@ -0,0 +1,397 @@
+"""
+章节标题文法
+把"第X章/回/节""第X卷/卷X""序章/楔子/番外""Chapter N"等标题格式编译为一个匹配器，
+TextProcessor 用它单遍扫描全文，并按 卷 -> 章 的层级确定章节边界与章节号；
+可在 config.json 的 HEADING_GRAMMAR 中调整
+"""
+
+import json
+import re
+import heapq
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .paths import get_config_path
+
+NUMERALS = '零一二三四五六七八九十百千万'
+_NUMBER = f'[{NUMERALS}\\d]+'
+_ROMAN = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500, 'M': 1000}
+# 行首格式的标题中，编号/关键字之后必须是分隔符或行尾（排除"第二回合""第一节课"这类正文）
+_SEPARATORS = ' \t　：:、.．-—'
+_LINE_INDENT = ' \t　'
+# 标题中"第X章"之后、正文标题之前的分隔符
+_TITLE_PREFIX = re.compile(r'^[：:\s]*')
+# 行内"第X章"之前允许的修饰符（如"【第一章】""=== 第一章 ==="），只有这些时仍算行首标题
+_DECORATIONS = _LINE_INDENT + '【[［〔(（<《=＝*＊#＃-—~～·'
+# 番外类标题的章节号从 EXTRA_BASE + 1 开始，与正文章节号互不冲突（排在正文之后）
+EXTRA_BASE = 100000
+
+# 标题种类
+CHAPTER = "chapter"
+SECTION = "section"
+VOLUME = "volume"
+PROLOGUE = "prologue"
+EXTRA = "extra"
+
+
+def chinese_to_arabic(chinese_num: str) -> int:
+    """将中文数字（可夹杂阿拉伯数字）转换为整数"""
+    if not chinese_num:
+        return 0
+    if chinese_num.isdigit():
+        return int(chinese_num)
+
+    num_map = {
+        '零': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5,
+        '六': 6, '七': 7, '八': 8, '九': 9, '十': 10,
+        '百': 100, '千': 1000, '万': 10000
+    }
+
+    result = 0
+    temp = 0
+
+    for char in chinese_num:
+        if char in num_map:
+            num = num_map[char]
+            if num >= 10:
+                if num == 10 and temp == 0:
+                    temp = 1
+                temp *= num
+                if num >= 100:
+                    result += temp
+                    temp = 0
+            else:
+                temp += num
+        elif char.isdigit():
+            temp = temp * 10 + int(char)
+
+    return result + temp
+
+
+def roman_to_arabic(roman: str) -> int:
+    """罗马数字转整数（Chapter IV）"""
+    total = 0
+    for i, char in enumerate(roman):
+        value = _ROMAN[char]
+        if i + 1 < len(roman) and _ROMAN[roman[i + 1]] > value:
+            total -= value
+        else:
+            total += value
+    return total
+
+
+@dataclass
+class HeadingGrammar:
+    """章节标题文法
+
+    inline_units: 行内任意位置出现"第X<单位>"即为章节标题（原有的"第X章"规则）
+    chapter_units: 只在行首出现时才算章节标题的单位，如"第X回"；出现过 inline_units 的章节标题后不再识别
+    section_units: 小节单位，如"第X节"；还没有出现任何章节标题时当作章节，之后留在章节正文中
+    volume_units: 卷单位，"第X卷"与"卷X"开头的行是卷标题
+    prologues: 序章类标题，编为第0章（已有章节之后出现时按番外编号）
+    extras: 番外类标题，按出现顺序编为 EXTRA_BASE+1、EXTRA_BASE+2…（文件名为"番外N_…"），不占用正文章节号
+    english: 是否识别 "Chapter N"（阿拉伯或罗马数字）
+    max_line_chars: 行首格式标题行的最长字数，更长的行视为正文
+    renumber_volumes: 新卷从第1章（或第0章）重新编号时，接着前面的最大章节号顺延编号；
+                      卷标题之后是其他已出现过的章节号（如重新上传的旧章节）时照常合并，不顺延
+    """
+    inline_units: List[str] = field(default_factory=lambda: ["章"])
+    chapter_units: List[str] = field(default_factory=lambda: ["回"])
+    section_units: List[str] = field(default_factory=lambda: ["节"])
+    volume_units: List[str] = field(default_factory=lambda: ["卷"])
+    prologues: List[str] = field(default_factory=lambda: ["序章", "楔子", "引子", "序言"])
+    extras: List[str] = field(default_factory=lambda: ["番外", "尾声", "后记"])
+    english: bool = True
+    max_line_chars: int = 50
+    renumber_volumes: bool = True
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HeadingGrammar":
+        """从配置字典构建文法，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def load_heading_grammar() -> HeadingGrammar:
+    """读取 config.json 中的 HEADING_GRAMMAR，缺失或无法读取时使用默认文法"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("HEADING_GRAMMAR") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return HeadingGrammar.from_dict(data)
+
+
+class RawHeading(NamedTuple):
+    """一行标题的匹配结果（尚未按层级确定章节号）"""
+    kind: str
+    unit: str
+    line_start: int
+    line_end: int           # 不含换行符
+    number: Optional[int]   # 原文中的编号，序章/番外为None
+    title: str
+    volume: str = ""        # 行内同时出现卷名与"第X章"时的卷名
+    # 标题在行首（前面只有缩进、修饰符或卷名）且行不超过 max_line_chars；行内规则的标题不满足时可能是正文
+    leading: bool = True
+
+
+class Heading(NamedTuple):
+    """确定了章节号的标题行；kind 为 VOLUME 时只是章节边界，不产生章节"""
+    line_start: int
+    line_end: int
+    number: int
+    title: str
+    kind: str
+    volume: str
+
+
+def _strip_title(rest: str) -> str:
+    return rest.lstrip(_SEPARATORS).strip()
+
+
+class HeadingMatcher:
+    """
+    文法编译出的匹配器
+
+    "第X<单位>"类标题以"第"字开头，行首关键字类（卷X、序章、番外、Chapter N）以换行符开头，
+    分别编译为以字面量开头的正则，让正则引擎按字面量快速定位；两路结果按位置归并，
+    全文仍只扫描一遍。合成一个多分支正则会失去字面量前缀优化，在长文本上慢数倍。
+    """
+
+    def __init__(self, grammar: HeadingGrammar):
+        self.grammar = grammar
+        self._inline = set(grammar.inline_units)
+        self._kinds: Dict[str, str] = {}
+        for units, kind in ((grammar.volume_units, VOLUME), (grammar.section_units, SECTION),
+                            (grammar.chapter_units, CHAPTER), (grammar.inline_units, CHAPTER)):
+            for unit in units:
+                self._kinds[unit] = kind
+
+        units = sorted(self._kinds, key=len, reverse=True)
+        self._numbered = re.compile(f'第({_NUMBER})({"|".join(map(re.escape, units))})') if units else None
+
+        keywords = sorted(grammar.prologues + grammar.extras, key=len, reverse=True)
+        self._keyword_kinds = {k: PROLOGUE for k in grammar.prologues}
+        self._keyword_kinds.update({k: EXTRA for k in grammar.extras})
+        branches = []
+        if grammar.volume_units:
+            volumes = "|".join(map(re.escape, grammar.volume_units))
+            branches.append(f'(?P<volume>{volumes})之?(?P<vnum>{_NUMBER})')
+        if keywords:
+            branches.append(f'(?P<keyword>{"|".join(map(re.escape, keywords))})')
+        if grammar.english:
+            branches.append(r'(?P<english>(?i:chapter))[ \t]*(?P<enum>\d+|[IVXLCDM]+)\b')
+        if branches:
+            body = f'[{_LINE_INDENT}]*(?:{"|".join(branches)})'
+            self._line = re.compile('\n' + body)
+            self._first_line = re.compile(body)
+        else:
+            self._line = self._first_line = None
+
+    def _matches(self, text: str) -> Iterator[Tuple[int, int, "re.Match"]]:
+        """(起始位置, 0=第X单位/1=行首关键字, 匹配)，按位置排序"""
+        streams = []
+        if self._numbered is not None:
+            streams.append((m.start(), 0, m) for m in self._numbered.finditer(text))
+        if self._line is not None:
+            def line_matches():
+                first = self._first_line.match(text)
+                if first:
+                    yield 0, 1, first
+                for m in self._line.finditer(text):
+                    yield m.start() + 1, 1, m
+            streams.append(line_matches())
+        if len(streams) == 1:
+            return streams[0]
+        return heapq.merge(*streams, key=lambda item: item[0])
+
+    def _line_heading(self, text: str, line_start: int, line_end: int, end: int, allow_suffix: str = "") -> bool:
+        """行首格式的标题：行足够短，编号/关键字之后是分隔符或行尾"""
+        if line_end - line_start > self.grammar.max_line_chars:
+            return False
+        return end >= line_end or text[end] in _SEPARATORS or text[end] in allow_suffix
+
+    def scan(self, text: str) -> List[RawHeading]:
+        """
+        单次扫描全文，找出所有标题行
+
+        行内"第X章"的规则与原来一致：章节号取行内第一处，标题取行内最后一处之后的内容；
+        行首的卷名后面跟着"第X章"时，整行是章节标题，前半部分作为卷名。
+
+        Args:
+            text: 已统一为 \\n 换行的文本
+        """
+        headings: List[RawHeading] = []
+        line_end = -1
+        for start, source, m in self._matches(text):
+            end = m.end()
+            if source == 0:
+                unit = m.group(2)
+                inline = unit in self._inline
+                if start < line_end:
+                    # 同一行内的后续"第X<单位>"，只有行内规则的单位会改变这一行
+                    if inline:
+                        prev = headings[-1]
+                        title = _TITLE_PREFIX.sub('', text[end:line_end], count=1).strip()
+                        if prev.unit in self._inline:
+                            headings[-1] = prev._replace(title=title)
+                        else:
+                            # 行首的卷名或"第X回"之后的"第X章"：整行是行首标题
+                            volume = text[prev.line_start:start].strip() if prev.kind == VOLUME else ""
+                            headings[-1] = RawHeading(CHAPTER, unit, prev.line_start, line_end,
+                                                      chinese_to_arabic(m.group(1)), title, volume)
+                    continue
+                line_start = text.rfind('\n', 0, start) + 1
+                current_end = text.find('\n', end)
+                if current_end == -1:
+                    current_end = len(text)
+                kind = self._kinds[unit]
+                number = chinese_to_arabic(m.group(1))
+                leading = True
+                if inline:
+                    title = _TITLE_PREFIX.sub('', text[end:current_end], count=1).strip()
+                    leading = (not text[line_start:start].strip(_DECORATIONS)
+                               and current_end - line_start <= self.grammar.max_line_chars)
+                elif text[line_start:start].strip(_LINE_INDENT) or \
+                        not self._line_heading(text, line_start, current_end, end):
+                    continue
+                elif kind == VOLUME:
+                    title = text[line_start:current_end].strip()
+                else:
+                    title = _strip_title(text[end:current_end])
+            else:
+                line_start = start
+                current_end = text.find('\n', end)
+                if current_end == -1:
+                    current_end = len(text)
+                groups = m.groupdict()
+                if groups.get('volume'):
+                    kind, unit, number = VOLUME, groups['volume'], chinese_to_arabic(groups['vnum'])
+                    title = text[line_start:current_end].strip()
+                    if not self._line_heading(text, line_start, current_end, end):
+                        continue
+                elif groups.get('keyword'):
+                    unit = groups['keyword']
+                    kind, number, title = self._keyword_kinds[unit], None, text[line_start:current_end].strip()
+                    # 番外一、番外篇 之类也是标题
+                    if not self._line_heading(text, line_start, current_end, end, NUMERALS + '0123456789篇章'):
+                        continue
+                else:
+                    roman = groups['enum']
+                    number = int(roman) if roman.isdigit() else roman_to_arabic(roman)
+                    kind, unit, title = CHAPTER, "chapter", _strip_title(text[end:current_end])
+                    if not self._line_heading(text, line_start, current_end, end):
+                        continue
+            line_end = current_end
+            headings.append(RawHeading(kind, unit, line_start, line_end, number, title,
+                                       leading=leading if source == 0 else True))
+        return headings
+
+
+class StructureState:
+    """
+    按层级确定章节号的状态，在流式拆分的各块之间保持
+
+    inline_seen: 已出现行首的行内规则（"第X章"）章节标题，此后不再识别行首的"第X回"/"Chapter N"；
+                 正文中的"书中第三章写道…"这类不在行首的匹配不会切换
+    line_chapter_seen: 已出现行首的"第X回"/"Chapter N"章节标题，此后不在行首的"第X章"视为正文
+    chapter_seen: 已出现任何章节标题，此后"第X节"留在正文中
+    max_number: 已分配的最大章节号
+    offset: 当前卷的章节号偏移（新卷从第1章重新编号时顺延）
+    leading_chars: 第一个章节标题之前、不归入任何章节的字数（书名、简介、开头的卷标题等）
+    attached: 卷标题出现在章节之间时，卷标题行及其后到下一章之间的文字归入上一章，[(卷名, 字数)]
+    pending_volume: 刚进入新卷、还没有遇到该卷的第一章
+    volume: 当前卷名
+    extras: 已编号的番外数（番外编为 EXTRA_BASE + 序号）
+    """
+    _FIELDS = ("inline_seen", "line_chapter_seen", "chapter_seen", "max_number", "offset", "pending_volume",
+               "volume", "extras")
+
+    def __init__(self, grammar: HeadingGrammar):
+        self.grammar = grammar
+        self.inline_seen = False
+        self.line_chapter_seen = False
+        self.chapter_seen = False
+        self.max_number = -1
+        self.offset = 0
+        self.pending_volume = False
+        self.volume = ""
+        self.extras = 0
+        # 最后一个章节标题之前的状态，增量拆分从该标题续读时恢复
+        self.before_last: Optional[Dict[str, Any]] = None
+        # 各类标题的数量与重新编号的卷，供结构报告使用
+        self.counts: Dict[str, int] = {}
+        self.renumbered: List[Tuple[str, int]] = []
+        self.leading_chars = 0
+        self.attached: List[Tuple[str, int]] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._FIELDS}
+
+    @classmethod
+    def from_dict(cls, grammar: HeadingGrammar, data: Optional[Dict[str, Any]]) -> "StructureState":
+        state = cls(grammar)
+        for name in cls._FIELDS:
+            if data and name in data:
+                setattr(state, name, data[name])
+        return state
+
+    def _count(self, kind: str):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def resolve(self, raw: RawHeading) -> Optional[Heading]:
+        """确定标题的章节号；按层级应留在正文中的标题返回None"""
+        kind = raw.kind
+        if kind == VOLUME:
+            self.volume = raw.title
+            self.pending_volume = True
+            self._count(VOLUME)
+            return Heading(raw.line_start, raw.line_end, 0, raw.title, VOLUME, raw.title)
+
+        inline = raw.unit in self.grammar.inline_units
+        if kind == CHAPTER and not inline and self.inline_seen:
+            self._count("ignored")
+            return None
+        if kind == CHAPTER and inline and not raw.leading and self.line_chapter_seen:
+            # 按"第X回"/"Chapter N"分章的书中，不在行首的"第X章"是正文
+            self._count("ignored")
+            return None
+        if kind == SECTION and self.chapter_seen:
+            self._count("ignored")
+            return None
+
+        self.before_last = self.to_dict()
+        if raw.volume:
+            # "第一卷 风起 第一章 初遇"：同一行里的卷名
+            if raw.volume != self.volume:
+                self.volume = raw.volume
+                self.pending_volume = True
+                self._count(VOLUME)
+        if kind == PROLOGUE and self.max_number < 0:
+            number = 0
+        elif kind in (PROLOGUE, EXTRA):
+            # 番外单独编号，之后出现的正文章节不会与之同号
+            self.extras += 1
+            self._count(kind)
+            return Heading(raw.line_start, raw.line_end, EXTRA_BASE + self.extras, raw.title, kind, self.volume)
+        else:
+            number = raw.number + self.offset
+            if self.pending_volume and self.grammar.renumber_volumes and raw.number <= 1 \
+                    and 0 <= number <= self.max_number:
+                # 新卷从头编号：接着前面的最大章节号
+                self.offset = self.max_number + 1 - raw.number
+                number = raw.number + self.offset
+                self.renumbered.append((self.volume, self.offset))
+            self.pending_volume = False
+            if kind == CHAPTER:
+                self.chapter_seen = True
+                if inline and raw.leading:
+                    self.inline_seen = True
+                elif not inline:
+                    self.line_chapter_seen = True
+        self.max_number = max(self.max_number, number)
+        self._count(kind)
+        return Heading(raw.line_start, raw.line_end, number, raw.title, kind, self.volume)
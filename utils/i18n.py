@@ -39,12 +39,36 @@ _translations: Dict[str, Dict[str, str]] = {
         # Query
         'query.provider': '提供商:',
         'query.model_id': '模型ID:',
+        'query.profile': '生成参数档案 (可选):',
         'query.concurrent': '并发数量:',
         'query.batch_size': '批次大小:',
         'query.prompt_file': 'Prompt文件:',
+        'query.schema': 'JSON Schema:',
+        'query.schema_tip': '要求模型输出符合该 schema 的JSON：回答到达时校验，不合格的只把回答交给修复模型修正（STRUCTURED_OUTPUT），结果写入 <前缀>_bs<批次大小>_结果.jsonl',
+        'query.schema_placeholder': '可选：结构化输出的 JSON Schema 文件',
+        'query.schema_filter': 'JSON 文件 (*.json)',
         'query.output_prefix': '输出文件名前缀:',
         'query.start_pos': '起始位置 (可选):',
         'query.end_pos': '终止位置 (可选):',
+        'query.normalize': '规范化文本（节省token）',
+        'query.normalize_tip': '送入模型前去掉各章反复出现的水印/广告行、HTML实体与多余空白，并压缩章节标题；结束时报告节省的token',
+        'query.stop_after': '命中N个结果后停止 (0=不限):',
+        'query.stop_after_tip': '结果不是"不存在"（EARLY_STOP.negative_pattern）即算命中；达到数量后取消其余排队与请求中的批次，下次运行会继续',
+        'query.cascade': '级联初筛（先用便宜模型判断批次是否相关）',
+        'query.cascade_tip': '初筛模型、相关性阈值与抽查比例在 config.json 的 CASCADE 中设置；判为无关的批次不交给主模型，初筛结果记录在 *_初筛.json',
+        'query.per_chapter': '逐章保存结果（换批次大小后仍可复用）',
+        'query.per_chapter_tip': '要求模型按章节分段作答，结果按章保存在 <前缀>_逐章/ 并汇总为 <前缀>_逐章汇总.txt；回答中缺失的章节会单独重新发送，已有结果的章节不再发送',
+        'query.tiers': '摘要输入:',
+        'query.tiers_placeholder': '可选：已有摘要结果的目录，多个用;分隔',
+        'query.tiers_tip': '这些目录中的结果（如逐章压缩）覆盖了所需的全部章节、且原文没有改动时，用其中最便宜的一组代替原文作为输入',
+        'query.match': '检索过滤:',
+        'query.match_placeholder': '留空处理全部章节；如 紫霄神雷 "青云门"',
+        'query.match_tip': '只处理全文检索命中的章节（空白分隔的多个词须同时出现，引号括起的内容作为一个短语）；批次划分会变化，建议换用新的文件前缀',
+        'query.dedupe': '近似重复章节:',
+        'query.dedupe_tip': '检测本次范围内内容近似相同的章节（如重复上传、修正版），避免重复发送给模型',
+        'query.dedupe_off': '照常发送',
+        'query.dedupe_skip': '跳过（批次划分会变化）',
+        'query.dedupe_stub': '以说明代替正文',
         'query.start': '开始查询',
         'query.stopping': '正在中止任务...',
         'query.stopped': '任务已中止。',
@@ -54,6 +78,7 @@ _translations: Dict[str, Dict[str, str]] = {
         'query.invalid_input_dir': '错误: 请选择一个有效的输入目录。',
         'query.invalid_output_dir': '错误: 请选择一个有效的输出目录。',
         'query.invalid_prompt': '错误: 请选择一个有效的Prompt文件。',
+        'query.invalid_schema': '错误: JSON Schema 文件不存在。',
         'query.started': '开始查询...',
 
         # Merge
@@ -71,10 +96,19 @@ _translations: Dict[str, Dict[str, str]] = {
         'pre.error': '预处理过程中发生错误: {err}',
         'pre.invalid_input_file': '错误: 请选择一个有效的输入文件。',
         'pre.invalid_output_dir': '错误: 请选择一个有效的输出目录。',
+        'pre.pack_output': '打包为单个文件 (.nepack)',
+        'pre.compress': '压缩',
+        'pre.incremental': '增量更新',
+        'pre.dry_run': '预览结构',
+        'pre.dry_run_tip': '只识别章节结构并输出报告（卷、章节数、重复/缺少的章节号、过大的章节），不写文件',
+        'pre.incremental_tip': '只解析源文件上次拆分后新增的部分，更新最后一章并写入新章节（不支持打包输出）',
 
         # Reader
         'reader.browser_title': '📚 文件浏览器',
         'reader.select_folder': '选择文件夹',
+        'reader.open_pack': '打开打包文件',
+        'reader.pack_filter': '章节打包文件 (*.nepack)',
+        'reader.pack_read_only': '打包文件中的章节为只读',
         'reader.clear': '清空',
         'reader.clear_tooltip': '清空所有文件夹',
         'reader.no_dir': '未选择目录',
@@ -83,6 +117,12 @@ _translations: Dict[str, Dict[str, str]] = {
         'reader.more_dirs': '... 还有 {rest} 个',
         'reader.choose_file': '📖 请选择文件',
         'reader.ready': '就绪',
+        'reader.search_placeholder': '全文检索：人物、法宝、地名…',
+        'reader.search': '检索',
+        'reader.search_tip': '在已打开的目录与打包文件中检索，空白分隔的多个词须同时出现，引号括起的内容作为一个短语；首次检索会建立索引',
+        'reader.search_result': '检索「{query}」: {count} 章命中，用时 {ms} ms',
+        'reader.search_failed': '检索失败: {err}',
+        'reader.search_hit': '{name}（{count} 处）',
         'reader.word_count': '字数: {count}',
         'reader.edit': '编辑',
         'reader.save': '保存',
@@ -157,12 +197,36 @@ _translations: Dict[str, Dict[str, str]] = {
         # Query
         'query.provider': 'Provider:',
         'query.model_id': 'Model ID:',
+        'query.profile': 'Generation Profile (optional):',
         'query.concurrent': 'Concurrency:',
         'query.batch_size': 'Batch Size:',
         'query.prompt_file': 'Prompt File:',
+        'query.schema': 'JSON Schema:',
+        'query.schema_tip': 'Asks the model for JSON matching this schema. Each answer is validated on arrival, and invalid ones are sent alone to a repair model (STRUCTURED_OUTPUT). Results go to <prefix>_bs<batch size>_结果.jsonl',
+        'query.schema_placeholder': 'Optional: JSON Schema file for structured output',
+        'query.schema_filter': 'JSON Files (*.json)',
         'query.output_prefix': 'Output Filename Prefix:',
         'query.start_pos': 'Start Position (optional):',
         'query.end_pos': 'End Position (optional):',
+        'query.normalize': 'Normalize text (save tokens)',
+        'query.normalize_tip': 'Before sending, strip watermark/ad lines repeated across chapters, HTML entities and extra whitespace, and compact chapter headers; reports tokens saved at the end',
+        'query.stop_after': 'Stop after N hits (0 = no limit):',
+        'query.stop_after_tip': 'A result counts as a hit unless it matches EARLY_STOP.negative_pattern ("不存在"); once reached, queued and in-flight batches are cancelled and resume on the next run',
+        'query.cascade': 'Cascade (screen batches with a cheap model first)',
+        'query.cascade_tip': 'Screening model, relevance threshold and audit rate are set in CASCADE in config.json; batches judged irrelevant skip the main model, screening results are saved as *_初筛.json',
+        'query.per_chapter': 'Save results per chapter (reusable across batch sizes)',
+        'query.per_chapter_tip': 'Asks the model to answer chapter by chapter; results are saved per chapter in <prefix>_逐章/ and combined into <prefix>_逐章汇总.txt. Chapters missing from an answer are re-sent individually, and chapters that already have results are not sent again',
+        'query.tiers': 'Summary inputs:',
+        'query.tiers_placeholder': 'Optional: directories of existing summary results, separated by ;',
+        'query.tiers_tip': 'When results in these directories (e.g. per-chapter compressions) cover every needed chapter and the source has not changed, the cheapest set is used instead of the raw chapters',
+        'query.match': 'Search filter:',
+        'query.match_placeholder': 'Empty = all chapters; e.g. Purple Thunder "Qingyun"',
+        'query.match_tip': 'Only process chapters matching a full-text search (space-separated terms must all appear, quoted text is one phrase); changes batch layout, so use a new output prefix',
+        'query.dedupe': 'Near-duplicate chapters:',
+        'query.dedupe_tip': 'Detect chapters in the selected range with nearly identical content (re-uploads, revised copies) so they are not sent to the model twice',
+        'query.dedupe_off': 'Send as usual',
+        'query.dedupe_skip': 'Skip (changes batch layout)',
+        'query.dedupe_stub': 'Replace with a note',
         'query.start': 'Start Query',
         'query.stopping': 'Stopping task...',
         'query.stopped': 'Task was stopped.',
@@ -172,6 +236,7 @@ _translations: Dict[str, Dict[str, str]] = {
         'query.invalid_input_dir': 'Error: Please select a valid input directory.',
         'query.invalid_output_dir': 'Error: Please select a valid output directory.',
         'query.invalid_prompt': 'Error: Please select a valid prompt file.',
+        'query.invalid_schema': 'Error: The JSON Schema file does not exist.',
         'query.started': 'Starting query...',
 
         # Merge
@@ -189,10 +254,19 @@ _translations: Dict[str, Dict[str, str]] = {
         'pre.error': 'Error during preprocessing: {err}',
         'pre.invalid_input_file': 'Error: Please select a valid input file.',
         'pre.invalid_output_dir': 'Error: Please select a valid output directory.',
+        'pre.pack_output': 'Pack into a single file (.nepack)',
+        'pre.compress': 'Compress',
+        'pre.incremental': 'Incremental update',
+        'pre.dry_run': 'Preview structure',
+        'pre.dry_run_tip': 'Detect the chapter structure and print a report (volumes, chapter count, duplicate/missing numbers, oversized chapters) without writing files',
+        'pre.incremental_tip': 'Only parse text appended since the last split, update the last chapter and write new ones (pack output not supported)',
 
         # Reader
         'reader.browser_title': '📚 File Browser',
         'reader.select_folder': 'Select Folder',
+        'reader.open_pack': 'Open Pack',
+        'reader.pack_filter': 'Chapter Packs (*.nepack)',
+        'reader.pack_read_only': 'Chapters in a pack are read-only',
         'reader.clear': 'Clear',
         'reader.clear_tooltip': 'Clear all folders',
         'reader.no_dir': 'No directory selected',
@@ -201,6 +275,12 @@ _translations: Dict[str, Dict[str, str]] = {
         'reader.more_dirs': '... and {rest} more',
         'reader.choose_file': '📖 Please select a file',
         'reader.ready': 'Ready',
+        'reader.search_placeholder': 'Full-text search: characters, artifacts, places…',
+        'reader.search': 'Search',
+        'reader.search_tip': 'Search the opened folders and packs; space-separated terms must all appear, quoted text is one phrase. The first search builds the index',
+        'reader.search_result': 'Search "{query}": {count} chapters matched in {ms} ms',
+        'reader.search_failed': 'Search failed: {err}',
+        'reader.search_hit': '{name} ({count} hits)',
         'reader.word_count': 'Words: {count}',
         'reader.edit': 'Edit',
         'reader.save': 'Save',
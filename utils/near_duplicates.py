@@ -0,0 +1,194 @@
+"""
+近似重复章节检测
+聚合txt中常有同一章换了章节号或标题重复上传（如"修正版"），章节号不同不会被合并，
+每份都会被重新送进模型。这里用 MinHash + LSH 在全部章节中找出内容近似相同的章节，
+可在 config.json 的 NEAR_DUPLICATES 中调整
+"""
+
+import re
+import json
+import bisect
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .paths import get_config_path
+
+# 分句用的空白与标点：以分句为特征，排版与标点的全/半角差异不影响相似度
+_CLAUSE_SPLIT = re.compile(r'[\s\u3000\xa0，。！？、；：“”‘’（）《》…—,.!?;:"\'()\[\]【】~～·-]+')
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+# Query 处理重复章节的方式：off 照常发送，skip 不发送，stub 以一行说明代替正文（批次划分不变）
+DEDUPE_MODES = ("off", "skip", "stub")
+
+
+@dataclass
+class NearDuplicateConfig:
+    """近似重复检测设置
+
+    enabled: 拆分后是否检测并在 index.json 中标记重复章节（duplicate_of）
+    threshold: 判定为重复的相似度（分句集合的 Jaccard）
+    min_chars: 正文短于该字数的章节不参与检测
+    query_mode: Query 默认的处理方式，见 DEDUPE_MODES
+    """
+    enabled: bool = True
+    threshold: float = DEFAULT_THRESHOLD
+    min_chars: int = 200
+    query_mode: str = "off"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NearDuplicateConfig":
+        """从配置字典构建设置，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def load_near_duplicate_config() -> NearDuplicateConfig:
+    """读取 config.json 中的 NEAR_DUPLICATES，缺失或无法读取时使用默认设置"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("NEAR_DUPLICATES") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return NearDuplicateConfig.from_dict(data)
+
+
+def clause_hashes(text: str) -> set:
+    """
+    文本的分句哈希集合（按空白与标点切分）
+
+    以分句而不是逐字 k-gram 为特征：切分与哈希都在C层完成，每章只有几百个特征，
+    万章规模也只需数秒；修改个别字词只影响所在的分句。
+    使用内置 hash，结果只在同一进程内可比较，不要持久化。
+    """
+    return set(map(hash, filter(None, _CLAUSE_SPLIT.split(text))))
+
+
+def minhash_signature(hashes: set, num_perm: int = DEFAULT_NUM_PERM) -> Tuple[int, ...]:
+    """
+    单次哈希的 MinHash 签名（one permutation hashing）
+
+    按哈希值低位分到 num_perm 个桶，每个桶取最小值，等价于 num_perm 个独立排列的 MinHash，
+    但每章只需一次排序与一次字典构建（都在C层完成），而不是 num_perm 次遍历。
+    空桶借用下一个非空桶的值（densification）。
+
+    Args:
+        hashes: clause_hashes 的结果
+        num_perm: 签名长度，须为2的幂
+    """
+    if not hashes:
+        return ()
+    mask = num_perm - 1
+    ordered = sorted(hashes, reverse=True)
+    # 按从大到小写入字典，同一个桶最后写入的就是最小值
+    bins = dict(zip([h & mask for h in ordered], ordered))
+    signature = [bins.get(i) for i in range(num_perm)]
+    if len(bins) < num_perm:
+        filled = sorted(bins)
+        for i in range(num_perm):
+            if signature[i] is None:
+                signature[i] = bins[filled[bisect.bisect(filled, i) % len(filled)]]
+    return tuple(signature)
+
+
+def signature_similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """两个签名估计的 Jaccard 相似度"""
+    if not a or not b:
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+@dataclass
+class DuplicateGroup:
+    """一组近似重复的章节：keep 为最先出现的一章，其余为重复"""
+    keep: object
+    duplicates: List[Tuple[object, float]] = field(default_factory=list)   # [(键, 与 keep 的相似度)]
+
+
+def find_near_duplicates(items: Iterable[Tuple[object, str]], threshold: float = DEFAULT_THRESHOLD,
+                         num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                         min_chars: int = 200,
+                         reader: Optional[Callable[[object], str]] = None) -> List[DuplicateGroup]:
+    """
+    在一组章节中找出近似重复的章节
+
+    先用 LSH（签名分成 bands 段，任一段完全相同即为候选）找候选对，
+    再按分句集合的精确 Jaccard 相似度确认，只保留不低于 threshold 的对，按连通分量分组。
+
+    Args:
+        items: 按顺序的 (键, 正文)，键通常为章节号或索引项；只遍历一次
+        threshold: 判定为重复的 Jaccard 相似度
+        num_perm: 签名长度（2的幂）
+        bands: LSH 分段数，须整除 num_perm
+        min_chars: 正文短于该字数的章节不参与检测（如只有一句话的请假条）
+        reader: 按键重新读取正文的函数；提供时不在内存中保留全部正文，确认候选对时再读取
+
+    Returns:
+        重复分组，按 keep 出现的顺序排列
+    """
+    rows = num_perm // bands
+    keys: List[object] = []
+    texts: List[str] = []
+    signatures: List[Tuple[int, ...]] = []
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    candidates = set()
+    for key, text in items:
+        if len(text) < min_chars:
+            continue
+        signature = minhash_signature(clause_hashes(text), num_perm)
+        if not signature:
+            continue
+        i = len(keys)
+        keys.append(key)
+        if reader is None:
+            texts.append(text)
+        signatures.append(signature)
+        for band in range(bands):
+            bucket = buckets.setdefault((band, signature[band * rows:(band + 1) * rows]), [])
+            for j in bucket:
+                candidates.add((j, i))
+            bucket.append(i)
+
+    # 确认候选对：签名估计明显偏低的直接排除，其余按精确 Jaccard 判断
+    parent = list(range(len(keys)))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    similarity: Dict[Tuple[int, int], float] = {}
+    features: Dict[int, set] = {}
+
+    def features_of(i: int) -> set:
+        if i not in features:
+            features[i] = clause_hashes(texts[i] if reader is None else reader(keys[i]))
+        return features[i]
+
+    for j, i in sorted(candidates):
+        if signature_similarity(signatures[j], signatures[i]) < threshold - 0.2:
+            continue
+        a, b = features_of(j), features_of(i)
+        jaccard = len(a & b) / len(a | b)
+        if jaccard >= threshold:
+            similarity[(j, i)] = jaccard
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                # 以较早出现的章节为根
+                parent[max(ri, rj)] = min(ri, rj)
+
+    groups: Dict[int, DuplicateGroup] = {}
+    for i in range(len(keys)):
+        root = find(i)
+        if root == i:
+            continue
+        group = groups.setdefault(root, DuplicateGroup(keys[root]))
+        score = similarity.get((root, i))
+        if score is None:
+            # 与 keep 间接相连（经由其他重复章节），相似度按精确值补算
+            a, b = features_of(root), features_of(i)
+            score = len(a & b) / len(a | b)
+        group.duplicates.append((keys[i], score))
+    return [groups[root] for root in sorted(groups)]
@@ -4,25 +4,38 @@
 """
 
 import os
-from typing import Optional
+import re
+import codecs
+import logging
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
 
+logger = logging.getLogger(__name__)
 
-def read_text_file(file_path: str, base_dir: Optional[str] = None) -> str:
-    """
-    读取文本文件，自动处理编码问题和路径解析
-    
-    Args:
-        file_path: 文件路径（可以是相对路径或绝对路径）
-        base_dir: 基础目录，如果提供则相对路径会基于此目录解析
-        
-    Returns:
-        文件内容字符串
-        
-    Raises:
-        FileNotFoundError: 文件不存在
-        Exception: 其他读取错误
-    """
-    # 处理路径
+# 流式读取时每次读入的字节数
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# 编码检测时读取的样本字节数
+SAMPLE_SIZE = 64 * 1024
+
+# 按 BOM 识别编码，UTF-32 的 BOM 以 UTF-16 LE 的 BOM 开头，需先判断
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# 判断无BOM的中文UTF-16时视为"常见"的字符：ASCII、中日韩汉字与标点、全角字符
+_COMMON_CHARS = re.compile(r'[\t\n\r\x20-\x7e\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef\u2010-\u2027]')
+
+# (绝对路径, 大小, 修改时间) -> 编码
+_ENCODING_CACHE: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_ENCODING_CACHE_SIZE = 4096
+
+
+def _resolve_path(file_path: str, base_dir: Optional[str] = None) -> str:
+    """解析文件路径并检查文件是否存在"""
     if base_dir is not None and not os.path.isabs(file_path):
         # 如果提供了基础目录且文件路径是相对路径，则基于基础目录解析
         resolved_path = os.path.join(base_dir, file_path)
@@ -32,30 +45,241 @@ def read_text_file(file_path: str, base_dir: Optional[str] = None) -> str:
     else:
         # 绝对路径直接使用
         resolved_path = file_path
-    
+
     # 标准化路径
     resolved_path = os.path.normpath(resolved_path)
-    
+
     # 检查文件是否存在
     if not os.path.exists(resolved_path):
         raise FileNotFoundError(f"文件不存在: {resolved_path}")
-    
-    encodings_to_try = ["utf-8", "gbk", "gb2312"]
-    
-    for encoding in encodings_to_try:
+    return resolved_path
+
+
+def read_text_file(file_path: str, base_dir: Optional[str] = None) -> str:
+    """
+    读取文本文件，自动处理编码问题和路径解析
+
+    先检测编码（BOM、样本字节特征，按文件缓存），再整体解码一次；
+    换行符与文本模式读取一致，统一为 \\n
+
+    Args:
+        file_path: 文件路径（可以是相对路径或绝对路径）
+        base_dir: 基础目录，如果提供则相对路径会基于此目录解析
+        
+    Returns:
+        文件内容字符串
+        
+    Raises:
+        FileNotFoundError: 文件不存在
+        Exception: 其他读取错误
+    """
+    resolved_path = _resolve_path(file_path, base_dir)
+
+    try:
+        with open(resolved_path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        raise Exception(f"无法读取文件 {resolved_path}: {str(e)}")
+
+    encoding = detect_encoding(resolved_path, sample=data[:SAMPLE_SIZE])
+    try:
+        content = data.decode(encoding)
+    except UnicodeDecodeError:
+        # 样本之外出现了不符合该编码的字节，依次尝试其余候选编码
+        content = None
+        for candidate in ("utf-8", "gb18030"):
+            if candidate == encoding:
+                continue
+            try:
+                content = data.decode(candidate)
+                encoding = candidate
+                break
+            except UnicodeDecodeError:
+                continue
+        _cache_encoding(resolved_path, encoding)
+        if content is None:
+            content = data.decode(encoding, errors="ignore")
+            print(f"文件包含无法解码的字节，已忽略 ({encoding}): {resolved_path}")
+
+    logger.debug("成功读取文件 (%s): %s", encoding, resolved_path)
+    return _normalize_newlines(content)
+
+
+def _normalize_newlines(text: str) -> str:
+    """与文本模式读取一致：\\r\\n 与单独的 \\r 都转为 \\n"""
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+        if '\r' in text:
+            text = text.replace('\r', '\n')
+    return text
+
+
+def _file_key(path: str) -> Tuple[str, int, int]:
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _cache_encoding(path: str, encoding: str):
+    try:
+        key = _file_key(path)
+    except OSError:
+        return
+    _ENCODING_CACHE[key] = encoding
+    _ENCODING_CACHE.move_to_end(key)
+    while len(_ENCODING_CACHE) > _ENCODING_CACHE_SIZE:
+        _ENCODING_CACHE.popitem(last=False)
+
+
+def _utf16_by_nul(sample: bytes) -> Optional[str]:
+    """没有BOM的UTF-16：ASCII字符（换行、数字、标点）会在固定奇偶位置产生大量 0x00"""
+    if len(sample) < 4:
+        return None
+    even_nul = sample[0::2].count(0)
+    odd_nul = sample[1::2].count(0)
+    half = len(sample) // 2
+    if odd_nul > half * 0.05 and even_nul < odd_nul * 0.1:
+        return "utf-16-le"
+    if even_nul > half * 0.05 and odd_nul < even_nul * 0.1:
+        return "utf-16-be"
+    return None
+
+
+def _utf16_by_text(sample: bytes) -> Optional[str]:
+    """没有BOM、以中文为主的UTF-16：0x00很少，改为看按UTF-16解码后是否几乎都是常见字符"""
+    sample = sample[:len(sample) // 2 * 2]
+    for encoding in ("utf-16-le", "utf-16-be"):
         try:
-            with open(resolved_path, "r", encoding=encoding) as f:
-                content = f.read()
-            print(f"成功读取文件 ({encoding}): {resolved_path}")
-            return content
+            text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
         except UnicodeDecodeError:
             continue
-            
-    # 如果所有编码都失败，尝试使用错误处理
+        if not text:
+            continue
+        common = len(_COMMON_CHARS.findall(text))
+        if common >= len(text) * 0.95:
+            return encoding
+    return None
+
+
+def _decodes(sample: bytes, encoding: str) -> bool:
+    """样本能否按该编码解码（样本末尾被截断的多字节字符不算错误）"""
     try:
-        with open(resolved_path, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-        print(f"成功读取文件 (UTF-8 with errors ignored): {resolved_path}")
-        return content
-    except Exception as e:
-        raise Exception(f"无法使用所有指定编码读取文件 {resolved_path}: {str(e)}")
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def sniff_encoding(sample: bytes, extra: Tuple[bytes, ...] = ()) -> str:
+    """
+    根据字节样本判断编码：BOM → UTF-16特征 → UTF-8 → 中文UTF-16 → GBK → GB18030
+
+    Args:
+        sample: 文件开头的样本
+        extra: 文件中部、末尾的样本（可选），只用于排除"开头恰好全是ASCII"的非UTF-8文件
+
+    Returns:
+        Python编码名；带BOM的编码解码时会去掉BOM
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    utf16 = _utf16_by_nul(sample)
+    if utf16:
+        return utf16
+    if _decodes(sample, "utf-8"):
+        # 中部、末尾样本可能从多字节字符中间开始，跳过开头的UTF-8后续字节
+        for part in extra:
+            skip = 0
+            while skip < min(3, len(part)) and 0x80 <= part[skip] <= 0xBF:
+                skip += 1
+            if not _decodes(part[skip:], "utf-8"):
+                break
+        else:
+            return "utf-8"
+    else:
+        # 开头能按UTF-8解码（如全是ASCII）时不按UTF-16判断：两个ASCII字节按UTF-16解码恰好落在汉字区
+        utf16 = _utf16_by_text(sample)
+        if utf16:
+            return utf16
+    # GBK 解码比 GB18030 快，样本只含GBK字符时优先用GBK，读取时遇到四字节字符再退回GB18030
+    if _decodes(sample, "gbk"):
+        return "gbk"
+    if _decodes(sample, "gb18030"):
+        return "gb18030"
+    return "utf-8"
+
+
+# 检测结果只基于样本：样本只含GBK字符时判为GBK，但样本之外仍可能出现GB18030的四字节字符（如CJK扩展A/B），
+# 无法整体重试的流式读取改用其超集解码，避免这些字符被替换掉
+_SUPERSETS = {"gbk": "gb18030"}
+
+
+def stream_encoding(encoding: str) -> str:
+    """流式（按块或按字节偏移）解码时使用的编码：GBK 换成 GB18030，其余不变"""
+    return _SUPERSETS.get(encoding, encoding)
+
+
+def detect_encoding(file_path: str, sample: Optional[bytes] = None) -> str:
+    """
+    检测文件编码，结果按 (路径, 大小, 修改时间) 缓存
+
+    Args:
+        file_path: 文件路径
+        sample: 已读取的文件开头样本（可选，避免重复读取）
+
+    Returns:
+        Python编码名
+    """
+    try:
+        key = _file_key(file_path)
+    except OSError:
+        key = None
+    if key is not None and key in _ENCODING_CACHE:
+        _ENCODING_CACHE.move_to_end(key)
+        return _ENCODING_CACHE[key]
+
+    with open(file_path, "rb") as f:
+        if sample is None:
+            sample = f.read(SAMPLE_SIZE)
+        extra = []
+        size = key[1] if key is not None else 0
+        if size > SAMPLE_SIZE * 2:
+            for offset in (size // 2, size - SAMPLE_SIZE):
+                f.seek(offset)
+                extra.append(f.read(SAMPLE_SIZE))
+    encoding = sniff_encoding(sample, tuple(extra))
+
+    if key is not None:
+        _cache_encoding(file_path, encoding)
+    return encoding
+
+
+def iter_text_chunks(file_path: str, encoding: Optional[str] = None,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE, base_dir: Optional[str] = None) -> Iterator[str]:
+    """
+    按块增量解码读取文本文件，内存占用与文件大小无关
+
+    Args:
+        file_path: 文件路径（可以是相对路径或绝对路径）
+        encoding: 文件编码，为None时自动检测（检测为GBK时按GB18030解码）
+        chunk_size: 每次读入的字节数
+        base_dir: 基础目录，如果提供则相对路径会基于此目录解析
+
+    Yields:
+        解码后的文本块（块边界不会切断多字节字符；换行符保持原样）
+    """
+    resolved_path = _resolve_path(file_path, base_dir)
+    with open(resolved_path, "rb") as f:
+        first = f.read(chunk_size)
+        if encoding is None:
+            encoding = stream_encoding(detect_encoding(resolved_path, sample=first[:SAMPLE_SIZE]))
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        chunk = first
+        while chunk:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+            chunk = f.read(chunk_size)
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
@@ -0,0 +1,194 @@
+"""
+检索预筛
+"相似剧情寻找"一类的 Query 逐批扫描整本书，绝大多数批次的回答都是"不存在"。
+这里先用全文索引按 BM25 为章节（或连续几章的窗口）与剧情描述的相关度打分，
+只把得分最高的若干区域及其前后相邻章节交给模型；并可与一次全量运行的结果对比，报告召回率与精确率。
+可在 config.json 的 RETRIEVAL 中调整
+"""
+
+import os
+import re
+import json
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Tuple
+
+from .paths import get_config_path
+
+
+@dataclass
+class RetrievalConfig:
+    """检索预筛设置
+
+    top_k: 选取得分最高的章节（或窗口）数
+    neighbors: 每个选中区域前后各扩展的章节数（剧情常跨章）
+    window: 按连续几章的得分之和打分，1 表示逐章
+    keyword_weight: 额外关键词的权重（剧情描述中的词为1）
+    min_score_ratio: 得分低于最高分该比例的章节/窗口不选（0 表示只按 top_k）
+    k1, b: BM25 参数
+    negative_pattern: 与全量运行对比时，回答匹配该正则（search）的批次视为没有命中
+    """
+    top_k: int = 20
+    neighbors: int = 1
+    window: int = 1
+    keyword_weight: float = 2.0
+    min_score_ratio: float = 0.0
+    k1: float = 1.2
+    b: float = 0.75
+    negative_pattern: str = r"^\W*不存在"
+    keywords: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RetrievalConfig":
+        """从配置字典构建设置，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def load_retrieval_config() -> RetrievalConfig:
+    """读取 config.json 中的 RETRIEVAL，缺失或无法读取时使用默认设置"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("RETRIEVAL") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return RetrievalConfig.from_dict(data)
+
+
+def select_regions(ranked: List[Tuple[int, float]], total: int, top_k: int, neighbors: int = 0,
+                   window: int = 1, min_score_ratio: float = 0.0) -> List[Tuple[int, int]]:
+    """
+    按得分选取区域
+
+    Args:
+        ranked: ChapterSearchIndex.rank 的结果 [(章节位置, 得分)]
+        total: 章节总数（位置从1到 total）
+        top_k: 选取的章节或窗口数
+        neighbors: 每个区域前后各扩展的章节数
+        window: 窗口大小（连续几章得分之和），1 表示逐章；选出的窗口互不重叠
+        min_score_ratio: 得分低于最高分该比例的不选
+
+    Returns:
+        合并后的区域 [(起始位置, 终止位置)]，左闭右闭，按位置排列
+    """
+    if not ranked or top_k <= 0:
+        return []
+    window = max(1, min(window, total))
+    if window == 1:
+        floor = ranked[0][1] * min_score_ratio
+        starts = [position for position, score in ranked[:top_k] if score > 0 and score >= floor]
+    else:
+        scores = [0.0] * (total + 2)
+        for position, score in ranked:
+            scores[position] = score
+        sums, current = [], sum(scores[1:window + 1])
+        for start in range(1, total - window + 2):
+            if start > 1:
+                current += scores[start + window - 1] - scores[start - 1]
+            sums.append((current, start))
+        sums.sort(key=lambda item: item[0], reverse=True)
+        floor = sums[0][0] * min_score_ratio
+        starts, taken = [], set()
+        for score, start in sums:
+            if len(starts) >= top_k or score <= 0 or score < floor:
+                break
+            if taken.isdisjoint(range(start, start + window)):
+                starts.append(start)
+                taken.update(range(start, start + window))
+
+    spans = sorted((max(1, s - neighbors), min(total, s + window - 1 + neighbors)) for s in starts)
+    regions: List[Tuple[int, int]] = []
+    for start, end in spans:
+        if regions and start <= regions[-1][1] + 1:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], end))
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def positive_batches(result_dir: str, name_prefix: str, batch_size: int, negative_pattern: str) -> Dict[int, bool]:
+    """
+    读取一次全量运行的批次结果，判断每个批次是否命中
+
+    Returns:
+        {批次号: 是否命中}
+    """
+    pattern = re.compile(rf"^{re.escape(name_prefix)}_bs{batch_size}_批次(\d+)\.txt$")
+    negative = re.compile(negative_pattern)
+    batches = {}
+    for filename in os.listdir(result_dir):
+        m = pattern.match(filename)
+        if not m:
+            continue
+        with open(os.path.join(result_dir, filename), "r", encoding="utf-8") as f:
+            batches[int(m.group(1))] = not negative.search(f.read().strip())
+    return batches
+
+
+def evaluate_regions(regions: List[Tuple[int, int]], batches: Dict[int, bool], batch_size: int) -> Dict[str, Any]:
+    """
+    与全量运行对比：全量运行第 n 批覆盖位置 (n-1)*batch_size+1 到 n*batch_size
+
+    召回率 = 命中的全量批次中，至少有一章被选中的比例；
+    精确率 = 选中的章节中，落在命中批次里的比例
+
+    Returns:
+        报告字典（可用 format_evaluation 转为文字）
+    """
+    selected = {p for start, end in regions for p in range(start, end + 1)}
+    hits = sorted(n for n, positive in batches.items() if positive)
+    covered = [n for n in hits if any((n - 1) * batch_size < p <= n * batch_size for p in selected)]
+    in_hits = [p for p in selected if batches.get((p - 1) // batch_size + 1)]
+    return {
+        "full_batches": len(batches),
+        "positive_batches": hits,
+        "missed_batches": [n for n in hits if n not in covered],
+        "selected_chapters": len(selected),
+        "selected_batches": -(-len(selected) // batch_size),
+        "recall": len(covered) / len(hits) if hits else None,
+        "precision": len(in_hits) / len(selected) if selected else None,
+    }
+
+
+def format_evaluation(report: Dict[str, Any]) -> str:
+    """把 evaluate_regions 的报告转为文字"""
+    def percent(value):
+        return "—" if value is None else f"{value:.0%}"
+    lines = [
+        f"全量运行: {report['full_batches']} 个批次，其中 {len(report['positive_batches'])} 个命中",
+        f"预筛: 选中 {report['selected_chapters']} 章，约 {report['selected_batches']} 个批次"
+        + (f"（全量的 {report['selected_batches'] / report['full_batches']:.0%}）" if report['full_batches'] else ""),
+        f"召回率: {percent(report['recall'])}，精确率: {percent(report['precision'])}",
+    ]
+    if report["missed_batches"]:
+        lines.append(f"漏掉的命中批次: {report['missed_batches']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    from .search_index import ChapterSearchIndex
+
+    parser = argparse.ArgumentParser(description="按 BM25 预筛与剧情描述相关的章节区域，可与全量运行的结果对比")
+    parser.add_argument("-i", "--input_path", required=True, help="章节目录或 .nepack 文件")
+    parser.add_argument("-q", "--query", required=True, help="剧情描述")
+    parser.add_argument("--keywords", nargs="*", default=None, help="额外的关键词（默认按 config.json）")
+    parser.add_argument("--top_k", type=int, default=None, help="选取的章节/窗口数（默认按 config.json）")
+    parser.add_argument("--neighbors", type=int, default=None, help="前后扩展的章节数（默认按 config.json）")
+    parser.add_argument("--window", type=int, default=None, help="窗口大小（默认按 config.json）")
+    parser.add_argument("--against", default=None, help="全量运行的输出目录，用于报告召回率与精确率")
+    parser.add_argument("--name_prefix", default="查询结果", help="全量运行的输出文件前缀")
+    parser.add_argument("--batch_size", type=int, default=10, help="全量运行的批次大小")
+    args = parser.parse_args()
+
+    config = load_retrieval_config()
+    index = ChapterSearchIndex.open(args.input_path)
+    ranked = index.rank(args.query, config.keywords if args.keywords is None else args.keywords,
+                        config.keyword_weight, config.k1, config.b)
+    regions = select_regions(ranked, len(index.source.entries),
+                             config.top_k if args.top_k is None else args.top_k,
+                             config.neighbors if args.neighbors is None else args.neighbors,
+                             config.window if args.window is None else args.window, config.min_score_ratio)
+    print(f"选中区域（位置）: {regions}")
+    if args.against:
+        batches = positive_batches(args.against, args.name_prefix, args.batch_size, config.negative_pattern)
+        print(format_evaluation(evaluate_regions(regions, batches, args.batch_size)))
@@ -0,0 +1,482 @@
+"""
+章节全文检索
+对章节目录或章节打包文件建立倒排索引：中文按相邻两字（bigram）切分，英文与数字按词切分，
+记录每个词在章节中的字符位置，支持短语查询并返回命中的章节与上下文片段，也可按 BM25 为章节打分。
+索引保存在章节目录下的 search_index/（打包文件为同名的 .search 目录），按段增量更新：
+新增或内容变化的章节写入新段，删除或过期的章节只从清单中移除，失效过多时整体重建
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import bisect
+import struct
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .chapter_store import ChapterEntry, is_chapter_store, open_chapter_source
+
+INDEX_DIRNAME = "search_index"
+_MANIFEST = "manifest.json"
+_VERSION = 2
+_MAGIC = b"NESIDX\x00\x01"
+# 词条数、词条区字节数、倒排区长度（uint32 个数）
+_HEADER = struct.Struct("<IQQ")
+# 段数超过该值，或失效章节超过一半时整体重建
+MAX_SEGMENTS = 8
+
+# 连续的汉字，或连续的英文字母与数字
+_RUN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[0-9A-Za-z]+')
+# 查询中用引号括起的短语
+_PHRASE = re.compile(r'"([^"]+)"|“([^”]+)”|「([^」]+)」|(\S+)')
+
+
+def tokenize(text: str) -> Iterator[Tuple[str, int]]:
+    """
+    切分文本，产出 (词, 在文本中的字符位置)
+
+    汉字串产出每个相邻两字，以及串的最后一个字（使每个汉字都是某个词的首字，单字查询按首字前缀匹配）；
+    英文与数字按整词产出（转为小写）
+    """
+    for m in _RUN.finditer(text):
+        run, start = m.group(), m.start()
+        if run[0] < '㐀':
+            yield run.lower(), start
+            continue
+        for i in range(len(run) - 1):
+            yield run[i:i + 2], start + i
+        yield run[-1], start + len(run) - 1
+
+
+def _phrase_tokens(phrase: str) -> List[Tuple[str, int, bool]]:
+    """查询短语的 [(词, 相对位置, 是否按前缀匹配)]：只用两字词，单独的一个汉字按前缀匹配"""
+    tokens = []
+    for m in _RUN.finditer(phrase):
+        run, start = m.group(), m.start()
+        if run[0] < '㐀':
+            tokens.append((run.lower(), start, False))
+        elif len(run) == 1:
+            tokens.append((run, start, True))
+        else:
+            tokens.extend((run[i:i + 2], start + i, False) for i in range(len(run) - 1))
+    return tokens
+
+
+def parse_query(query: str) -> List[str]:
+    """拆分查询：空白分隔的多个短语须同时出现（AND），引号内的内容作为一个短语（可含空格与标点）"""
+    return [next(g for g in m.groups() if g) for m in _PHRASE.finditer(query)]
+
+
+def index_dir_for(path: str) -> str:
+    """章节输入对应的索引目录：章节目录下的 search_index/，打包文件旁的 <文件名>.search/"""
+    if is_chapter_store(path):
+        return path + ".search"
+    return os.path.join(path, INDEX_DIRNAME)
+
+
+@dataclass
+class SearchHit:
+    """一个命中的章节"""
+    position: int           # 在章节输入中的位置（从1开始，与 Query 的起止位置一致）
+    number: int
+    filename: str
+    count: int              # 命中次数（各短语合计）
+    offsets: List[int] = field(default_factory=list)   # 命中的字符位置（升序）
+    snippets: List[str] = field(default_factory=list)
+
+
+class _Segment:
+    """
+    一个索引段（只读）
+
+    文件格式：文件头 | 词条区（按UTF-8字节序排列的词条拼接） | 词条偏移（uint32，n+1个） |
+    倒排偏移（uint32，n+1个） | 倒排区。每个词条的倒排为 k 个文档号（升序）后接 k 个字符位置，
+    同一文档内位置升序。整数均为小端序
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"不是检索索引段: {path}")
+        count, terms_len, postings_len = _HEADER.unpack_from(data, len(_MAGIC))
+        pos = len(_MAGIC) + _HEADER.size
+        self._terms = data[pos:pos + terms_len]
+        pos += terms_len
+        arrays = []
+        for length in (count + 1, count + 1, postings_len):
+            a = array("I")
+            a.frombytes(data[pos:pos + length * 4])
+            if sys.byteorder != "little":
+                a.byteswap()
+            arrays.append(a)
+            pos += length * 4
+        self._term_offsets, self._posting_offsets, self._postings = arrays
+        self.count = count
+
+    def _term(self, i: int) -> bytes:
+        return self._terms[self._term_offsets[i]:self._term_offsets[i + 1]]
+
+    def _bisect(self, key: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, term: str, prefix: bool = False) -> range:
+        """词条序号范围：精确匹配，或以 term 开头的全部词条"""
+        key = term.encode("utf-8")
+        lo = self._bisect(key)
+        if not prefix:
+            return range(lo, lo + 1) if lo < self.count and self._term(lo) == key else range(0)
+        hi = self._bisect(key + b"\xff")
+        return range(lo, hi)
+
+    def size(self, term_id: int) -> int:
+        return (self._posting_offsets[term_id + 1] - self._posting_offsets[term_id]) // 2
+
+    def postings(self, term_id: int) -> Tuple[memoryview, memoryview]:
+        """(文档号, 字符位置) 两个等长序列"""
+        start, end = self._posting_offsets[term_id], self._posting_offsets[term_id + 1]
+        k = (end - start) // 2
+        view = memoryview(self._postings)
+        return view[start:start + k], view[start + k:end]
+
+    @staticmethod
+    def write(path: str, texts: List[str]) -> List[int]:
+        """为一组章节正文（文档号为列表下标）写出索引段，返回各章的词数"""
+        postings: Dict[str, Tuple[array, array]] = {}
+        lengths = []
+        for doc, text in enumerate(texts):
+            length = 0
+            for term, offset in tokenize(text):
+                pair = postings.get(term)
+                if pair is None:
+                    pair = postings[term] = (array("I"), array("I"))
+                pair[0].append(doc)
+                pair[1].append(offset)
+                length += 1
+            lengths.append(length)
+
+        terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+        term_blob, term_offsets, posting_offsets = [], array("I", [0]), array("I", [0])
+        body = array("I")
+        total = 0
+        for term in terms:
+            encoded = term.encode("utf-8")
+            term_blob.append(encoded)
+            total += len(encoded)
+            term_offsets.append(total)
+            docs, offsets = postings[term]
+            body.extend(docs)
+            body.extend(offsets)
+            posting_offsets.append(len(body))
+        if sys.byteorder != "little":
+            for a in (term_offsets, posting_offsets, body):
+                a.byteswap()
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(_HEADER.pack(len(terms), total, len(body)))
+            f.write(b"".join(term_blob))
+            f.write(term_offsets.tobytes())
+            f.write(posting_offsets.tobytes())
+            f.write(body.tobytes())
+        os.replace(tmp_path, path)
+        return lengths
+
+
+class ChapterSearchIndex:
+    """
+    章节全文索引
+
+    用 ChapterSearchIndex.open(章节输入路径) 打开（缺失或过期时自动增量更新），再用 search 查询
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.source = None
+        self._segments: List[_Segment] = []
+        # 各段的文件名与建立时的章节数（含已失效的章节）
+        self._segment_files: List[dict] = []
+        self._docs: List[dict] = []
+        # (段序号, 段内文档号) -> 在 _docs 中的下标，只包含仍然有效的章节
+        self._live: Dict[Tuple[int, int], int] = {}
+        self._next_segment = 1
+        self._load_manifest()
+
+    @classmethod
+    def open(cls, path: str, update: bool = True, source=None) -> "ChapterSearchIndex":
+        """
+        打开章节目录或打包文件的索引
+
+        Args:
+            path: 章节目录或 .nepack 文件
+            update: 是否先按章节的 sha1 增量更新索引
+            source: 已打开的章节输入，为None时按 path 打开
+        """
+        index = cls(index_dir_for(path))
+        index.source = source or open_chapter_source(path)
+        if update:
+            index.update(index.source)
+        return index
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.index_dir, _MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != _VERSION:
+                return
+            segments = [_Segment(os.path.join(self.index_dir, s["file"])) for s in manifest["segments"]]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, struct.error):
+            return
+        self._segments, self._segment_files = segments, manifest["segments"]
+        self._docs = manifest["docs"]
+        self._next_segment = manifest.get("next_segment", len(segments) + 1)
+        self._live = {(d["segment"], d["doc"]): i for i, d in enumerate(self._docs)}
+
+    def _save_manifest(self):
+        manifest = {"version": _VERSION, "segments": self._segment_files,
+                    "next_segment": self._next_segment, "docs": self._docs}
+        path = os.path.join(self.index_dir, _MANIFEST)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def refresh(self, path: str) -> "ChapterSearchIndex":
+        """重新打开章节输入并增量更新（章节文件有变化时使用），返回自身"""
+        self.source = open_chapter_source(path)
+        self.update(self.source)
+        return self
+
+    def update(self, source) -> Tuple[int, int]:
+        """
+        按章节输入更新索引：sha1 未变的章节沿用已有的段，其余章节写入一个新段
+
+        Args:
+            source: open_chapter_source 返回的章节输入
+
+        Returns:
+            (新建索引的章节数, 移除的章节数)
+        """
+        entries: List[ChapterEntry] = source.entries
+        indexed = {d["filename"]: d for d in self._docs}
+        kept, added = [], []
+        for position, entry in enumerate(entries, 1):
+            doc = indexed.get(entry.filename)
+            if doc is not None and entry.sha1 and doc["sha1"] == entry.sha1:
+                kept.append(dict(doc, number=entry.number, position=position))
+            else:
+                added.append((position, entry))
+        removed = len(self._docs) - len(kept)
+        if not added and not removed and all(d["position"] == k["position"] for d, k in zip(self._docs, kept)):
+            return 0, 0
+
+        dead = sum(s["docs"] for s in self._segment_files) - len(kept)
+        if kept and (dead * 2 > len(entries) or len(self._segments) + bool(added) > MAX_SEGMENTS):
+            # 失效章节过多或段数过多：整体重建
+            added = list(enumerate(entries, 1))
+            kept = []
+        os.makedirs(self.index_dir, exist_ok=True)
+        segment_files = self._segment_files if kept else []
+        if added:
+            name = f"seg_{self._next_segment:05d}.idx"
+            self._next_segment += 1
+            lengths = _Segment.write(os.path.join(self.index_dir, name), source.read_many([e for _, e in added]))
+            segment_files = segment_files + [{"file": name, "docs": len(added)}]
+            seg = len(segment_files) - 1
+            kept.extend({"filename": e.filename, "number": e.number, "sha1": e.sha1, "position": position,
+                         "segment": seg, "doc": i, "length": lengths[i]} for i, (position, e) in enumerate(added))
+        kept.sort(key=lambda d: d["position"])
+
+        # 不再被任何有效章节引用的段：删除文件并重排段序号
+        used = sorted({d["segment"] for d in kept})
+        remap = {old: new for new, old in enumerate(used)}
+        for d in kept:
+            d["segment"] = remap[d["segment"]]
+        stale = [s["file"] for i, s in enumerate(segment_files) if i not in remap]
+        self._segment_files = [segment_files[i] for i in used]
+        self._docs = kept
+        self._save_manifest()
+        for name in stale:
+            try:
+                os.remove(os.path.join(self.index_dir, name))
+            except OSError:
+                pass
+        self._segments = [_Segment(os.path.join(self.index_dir, s["file"])) for s in self._segment_files]
+        self._live = {(d["segment"], d["doc"]): i for i, d in enumerate(self._docs)}
+        print(f"检索索引已更新: 新建 {len(added)} 章，移除 {removed} 章（共 {len(kept)} 章，{len(used)} 段）")
+        return len(added), removed
+
+    def _match_phrase(self, seg_no: int, segment: _Segment, phrase: str) -> Dict[int, Set[int]]:
+        """一个短语在一个段中的命中：段内文档号 -> 短语起始位置集合"""
+        tokens = []
+        for term, rel, prefix in _phrase_tokens(phrase):
+            ids = segment.lookup(term, prefix)
+            if not ids:
+                return {}
+            tokens.append((sum(segment.size(i) for i in ids), ids, rel))
+        if not tokens:
+            return {}
+        # 从最少见的词开始，之后的词只在候选文档内二分查找
+        tokens.sort(key=lambda token: token[0])
+        _, ids, rel = tokens[0]
+        candidates: Dict[int, Set[int]] = {}
+        for term_id in ids:
+            docs, offsets = segment.postings(term_id)
+            for doc, offset in zip(docs, offsets):
+                if (seg_no, doc) in self._live:
+                    candidates.setdefault(doc, set()).add(offset - rel)
+        for _, ids, rel in tokens[1:]:
+            postings = [segment.postings(term_id) for term_id in ids]
+            for doc in list(candidates):
+                starts = set()
+                for docs, offsets in postings:
+                    lo = bisect.bisect_left(docs, doc)
+                    hi = bisect.bisect_right(docs, doc, lo)
+                    starts.update(offset - rel for offset in offsets[lo:hi])
+                starts &= candidates[doc]
+                if starts:
+                    candidates[doc] = starts
+                else:
+                    del candidates[doc]
+            if not candidates:
+                break
+        return candidates
+
+    def rank(self, text: str, keywords: Optional[List[str]] = None, keyword_weight: float = 2.0,
+             k1: float = 1.2, b: float = 0.75) -> List[Tuple[int, float]]:
+        """
+        按 BM25 为章节打分（词袋，不要求短语连续出现）
+
+        Args:
+            text: 描述文本（如构思的剧情），切分为两字词与英文词
+            keywords: 额外的关键词，其中的词以 keyword_weight 加权
+            keyword_weight: 关键词的权重
+            k1, b: BM25 参数
+
+        Returns:
+            [(章节位置, 得分)]，只含得分大于0的章节，按得分从高到低排列
+        """
+        weights: Dict[str, float] = {}
+        for source_text, weight in [(text, 1.0)] + [(k, keyword_weight) for k in keywords or []]:
+            for term, _, prefix in _phrase_tokens(source_text):
+                if not prefix:
+                    weights[term] = max(weights.get(term, 0.0), weight)
+        total = len(self._docs)
+        if not weights or not total:
+            return []
+        avg_length = sum(d.get("length", 0) for d in self._docs) / total or 1.0
+
+        # 各词在有效章节中的词频：段内文档号序列用 Counter 在C层计数
+        frequencies: Dict[str, Dict[int, int]] = {}
+        for seg_no, segment in enumerate(self._segments):
+            for term in weights:
+                ids = segment.lookup(term)
+                if not ids:
+                    continue
+                counts = Counter(segment.postings(ids[0])[0])
+                tf = frequencies.setdefault(term, {})
+                for doc, count in counts.items():
+                    i = self._live.get((seg_no, doc))
+                    if i is not None:
+                        tf[i] = count
+
+        scores: Dict[int, float] = {}
+        for term, tf in frequencies.items():
+            idf = math.log((total - len(tf) + 0.5) / (len(tf) + 0.5) + 1.0)
+            weight = weights[term] * idf
+            for i, count in tf.items():
+                norm = k1 * (1 - b + b * self._docs[i].get("length", avg_length) / avg_length)
+                scores[i] = scores.get(i, 0.0) + weight * count * (k1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(self._docs[i]["position"], score) for i, score in ranked]
+
+    def search(self, query: str, limit: Optional[int] = None, max_snippets: int = 3,
+               snippet_chars: int = 20) -> List[SearchHit]:
+        """
+        查询包含全部短语的章节
+
+        Args:
+            query: 查询，空白分隔的多个短语须同时出现，引号括起的内容作为一个短语
+            limit: 最多返回的章节数
+            max_snippets: 每章最多返回的片段数，为0时不读取正文
+            snippet_chars: 片段在命中位置前后各保留的字数
+
+        Returns:
+            按章节顺序排列的命中列表
+        """
+        phrases = [p for p in parse_query(query) if _phrase_tokens(p)]
+        if not phrases:
+            return []
+        matched: Dict[int, Tuple[int, List[int]]] = {}
+        for seg_no, segment in enumerate(self._segments):
+            per_doc: Optional[Dict[int, List[int]]] = None
+            for phrase in phrases:
+                found = self._match_phrase(seg_no, segment, phrase)
+                if per_doc is None:
+                    per_doc = {doc: sorted(starts) for doc, starts in found.items()}
+                else:
+                    per_doc = {doc: per_doc[doc] + sorted(found[doc]) for doc in per_doc if doc in found}
+                if not per_doc:
+                    break
+            for doc, offsets in (per_doc or {}).items():
+                matched[self._live[(seg_no, doc)]] = (len(offsets), sorted(offsets))
+
+        hits = []
+        for i in sorted(matched):
+            if limit is not None and len(hits) >= limit:
+                break
+            doc = self._docs[i]
+            count, offsets = matched[i]
+            hits.append(SearchHit(doc["position"], doc["number"], doc["filename"], count, offsets))
+        if max_snippets and self.source is not None:
+            self._fill_snippets(hits, max(map(len, phrases)), max_snippets, snippet_chars)
+        return hits
+
+    def _fill_snippets(self, hits: List[SearchHit], phrase_chars: int, max_snippets: int, snippet_chars: int):
+        entries = self.source.entries
+        for hit in hits:
+            if hit.position > len(entries) or entries[hit.position - 1].filename != hit.filename:
+                continue
+            text = self.source.read(entries[hit.position - 1])
+            end = -1
+            for offset in hit.offsets:
+                if len(hit.snippets) >= max_snippets:
+                    break
+                if offset < end:
+                    continue
+                start, end = max(0, offset - snippet_chars), offset + phrase_chars + snippet_chars
+                snippet = re.sub(r'\s+', ' ', text[start:end]).strip()
+                hit.snippets.append(("…" if start else "") + snippet + ("…" if end < len(text) else ""))
+
+
+def search_chapters(path: str, query: str, **kwargs) -> List[SearchHit]:
+    """打开（并增量更新）章节输入的索引后查询，参数同 ChapterSearchIndex.search"""
+    return ChapterSearchIndex.open(path).search(query, **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="在章节目录或打包文件中全文检索")
+    parser.add_argument("-i", "--input_path", required=True, help="章节目录或 .nepack 文件")
+    parser.add_argument("-q", "--query", required=True, help='查询，空白分隔的多个词须同时出现，引号括起的内容作为一个短语')
+    parser.add_argument("--limit", type=int, default=None, help="最多列出的章节数")
+    args = parser.parse_args()
+
+    hits = search_chapters(args.input_path, args.query, limit=args.limit)
+    for hit in hits:
+        print(f"[{hit.position}] {hit.filename}（{hit.count} 处）")
+        for snippet in hit.snippets:
+            print(f"    {snippet}")
+    print(f"共 {len(hits)} 章命中；位置: {[hit.position for hit in hits]}")
@@ -0,0 +1,240 @@
+"""
+结构化输出
+世界地图提炼、相似剧情寻找这类任务的自由文本结果需要事后手工解析，格式有误的回答要等整个任务跑完才发现。
+给 Query 指定一个 JSON Schema 后：请求时按厂商支持的方式要求输出JSON，回答到达时立即校验，
+不合格的回答只把回答本身和错误说明交给（便宜的）修复模型修正，不再重发章节原文；
+合格的结果写入 JSONL 结果库，后续汇总直接读取，无需再解析文本。
+可在 config.json 的 STRUCTURED_OUTPUT 中调整
+"""
+
+import os
+import json
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Iterator, List, Tuple
+
+from .early_stop import extract_json
+from .paths import get_config_path
+
+# 追加在 prompt 末尾的输出要求，{schema} 为 JSON Schema
+DEFAULT_INSTRUCTION = (
+    "\n\n----------------------------------------\n"
+    "输出格式要求：只输出一个符合下面 JSON Schema 的JSON，不要输出解释或其他内容。\n"
+    "{schema}"
+)
+
+# 修复请求：{schema} 为 JSON Schema，{errors} 为校验错误，{output} 为原回答
+DEFAULT_REPAIR_PROMPT = (
+    "下面的回答应当是一个符合 JSON Schema 的JSON，但没有通过校验。"
+    "请在不改变其内容含义的前提下修正格式，只输出修正后的JSON。\n"
+    "JSON Schema：\n{schema}\n"
+    "校验错误：\n{errors}\n"
+    "原回答：\n{output}"
+)
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+@dataclass
+class StructuredOutputConfig:
+    """结构化输出设置
+
+    repair_provider / repair_model / repair_profile: 修复模型与生成参数档案，为空时使用主模型
+    max_repairs: 每个回答最多的修复次数（0 表示不修复）
+    instruction: 追加在 prompt 末尾的输出要求，为空时使用 DEFAULT_INSTRUCTION
+    repair_prompt: 修复请求模板，为空时使用 DEFAULT_REPAIR_PROMPT
+    """
+    repair_provider: str = ""
+    repair_model: str = ""
+    repair_profile: str = ""
+    max_repairs: int = 1
+    instruction: str = ""
+    repair_prompt: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StructuredOutputConfig":
+        """从配置字典构建设置，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def load_structured_output_config() -> StructuredOutputConfig:
+    """读取 config.json 中的 STRUCTURED_OUTPUT，缺失或无法读取时使用默认设置"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("STRUCTURED_OUTPUT") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return StructuredOutputConfig.from_dict(data)
+
+
+def load_schema(path: str) -> Dict[str, Any]:
+    """读取 JSON Schema 文件"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+    except OSError as e:
+        raise RuntimeError(f"读取 JSON Schema 文件 '{path}' 失败: {str(e)}")
+    except ValueError as e:
+        raise ValueError(f"JSON Schema 文件 '{path}' 不是合法的JSON: {str(e)}")
+    if not isinstance(schema, dict):
+        raise ValueError(f"JSON Schema 文件 '{path}' 的顶层应为对象")
+    return schema
+
+
+def _is_type(value: Any, name: str) -> bool:
+    expected = _TYPES.get(name)
+    if expected is None:
+        return True
+    if name in ("integer", "number") and isinstance(value, bool):
+        return False
+    return isinstance(value, expected)
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    按 JSON Schema 校验（常用子集：type、enum、const、properties、required、additionalProperties、
+    items、minItems/maxItems、minLength/maxLength、minimum/maximum、anyOf）
+
+    Returns:
+        错误说明列表，为空表示通过
+    """
+    errors: List[str] = []
+    types = schema.get("type")
+    if types is not None:
+        names = types if isinstance(types, list) else [types]
+        if not any(_is_type(value, name) for name in names):
+            return [f"{path}: 应为 {'/'.join(names)}，实际为 {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: 应为 {schema['enum']} 之一")
+    if "const" in schema and value != schema["const"]:
+        errors.append(f"{path}: 应为 {json.dumps(schema['const'], ensure_ascii=False)}")
+    if "anyOf" in schema and not any(not validate(value, option, path) for option in schema["anyOf"]):
+        errors.append(f"{path}: 不符合 anyOf 中的任何一项")
+
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: 缺少字段 {key}")
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(validate(item, properties[key], f"{path}.{key}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: 不允许的字段 {key}")
+            elif isinstance(schema.get("additionalProperties"), dict):
+                errors.extend(validate(item, schema["additionalProperties"], f"{path}.{key}"))
+    elif isinstance(value, list):
+        if "minItems" in schema and len(value) < schema["minItems"]:
+            errors.append(f"{path}: 至少应有 {schema['minItems']} 项")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: 至多应有 {schema['maxItems']} 项")
+        if isinstance(schema.get("items"), dict):
+            for i, item in enumerate(value):
+                errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    elif isinstance(value, str):
+        if "minLength" in schema and len(value) < schema["minLength"]:
+            errors.append(f"{path}: 长度至少为 {schema['minLength']}")
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            errors.append(f"{path}: 长度至多为 {schema['maxLength']}")
+    elif _is_type(value, "number"):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: 应不小于 {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: 应不大于 {schema['maximum']}")
+    return errors
+
+
+def parse_and_validate(text: str, schema: Dict[str, Any]) -> Tuple[Any, List[str]]:
+    """
+    取出回答中的JSON并校验
+
+    Returns:
+        (JSON值, 错误说明列表)；没有找到JSON时为 (None, [说明])
+    """
+    value = extract_json(text)
+    if value is None:
+        return None, ["$: 回答中没有合法的JSON"]
+    return value, validate(value, schema)
+
+
+def build_instruction(config: StructuredOutputConfig, schema: Dict[str, Any]) -> str:
+    """追加在 prompt 末尾的输出要求"""
+    return (config.instruction or DEFAULT_INSTRUCTION).replace(
+        "{schema}", json.dumps(schema, ensure_ascii=False, indent=1))
+
+
+def build_repair_prompt(config: StructuredOutputConfig, schema: Dict[str, Any], output: str, errors: List[str]) -> str:
+    """修复请求：只包含原回答与错误说明，不含章节原文"""
+    return ((config.repair_prompt or DEFAULT_REPAIR_PROMPT)
+            .replace("{schema}", json.dumps(schema, ensure_ascii=False, indent=1))
+            .replace("{errors}", "\n".join(errors[:20]))
+            .replace("{output}", output))
+
+
+def results_path(output_path: str, name_prefix: str, batch_size) -> str:
+    """结构化结果库路径"""
+    return os.path.join(output_path, f"{name_prefix}_bs{batch_size}_结果.jsonl")
+
+
+def append_result(path: str, record: Dict[str, Any]):
+    """追加一条结果并立即落盘"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def iter_results(path: str, valid_only: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    读取结果库：同一批次有多条记录时只取最后一条（重跑覆盖旧结果），按批次号排列
+
+    每条记录: {"batch", "chapters": [{"number", "filename"}], "valid", "repairs", "data", "errors"}
+    """
+    latest: Dict[int, Dict[str, Any]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                latest[int(record["batch"])] = record
+            except (ValueError, KeyError, TypeError):
+                continue
+    for batch in sorted(latest):
+        if latest[batch].get("valid") or not valid_only:
+            yield latest[batch]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="校验结构化结果库，或把其中的结果导出为一个JSON数组")
+    parser.add_argument("path", help="结果库（<前缀>_bs<批次大小>_结果.jsonl）")
+    parser.add_argument("--schema", default=None, help="重新按该 JSON Schema 校验")
+    parser.add_argument("--export", default=None, help="把合格结果的 data 导出为JSON数组文件")
+    args = parser.parse_args()
+
+    records = list(iter_results(args.path, valid_only=False))
+    valid = [r for r in records if r.get("valid")]
+    print(f"{len(records)} 个批次，合格 {len(valid)} 个，其中经修复 {sum(1 for r in valid if r.get('repairs'))} 个")
+    if args.schema:
+        schema = load_schema(args.schema)
+        for record in valid:
+            errors = validate(record.get("data"), schema)
+            if errors:
+                print(f"批次 {record['batch']}: {'；'.join(errors[:5])}")
+    for record in records:
+        if not record.get("valid"):
+            print(f"批次 {record['batch']} 不合格: {'；'.join((record.get('errors') or [])[:5])}")
+    if args.export:
+        with open(args.export, "w", encoding="utf-8") as f:
+            json.dump([r["data"] for r in valid], f, ensure_ascii=False, indent=1)
+        print(f"已导出: {args.export}")
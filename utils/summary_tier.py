@@ -0,0 +1,194 @@
+"""
+摘要层级输入
+每次 Query 运行都会在输出目录写出来源清单（<前缀>_bs<批次大小>_来源.json），记录每个批次结果
+覆盖了哪些原文章节（章节号、文件名、sha1）。这样一组已有的结果（如逐章压缩的摘要）就可以作为
+后续分析的输入层级：覆盖了所需的全部章节、且这些章节此后没有改动时，用摘要代替原文，输入token只有原文的一小部分
+"""
+
+import os
+import re
+import json
+import glob
+from typing import Dict, List, Optional, Tuple
+
+from .chapter_store import ChapterEntry, text_entry
+from .text_cache import read_text_cached
+
+_MANIFEST_SUFFIX = "_来源.json"
+_MANIFEST = re.compile(r"^(.*)_bs(\d+)_来源\.json$")
+_VERSION = 1
+
+
+def manifest_path(output_path: str, name_prefix: str, batch_size) -> str:
+    """一组结果的来源清单路径"""
+    return os.path.join(output_path, f"{name_prefix}_bs{batch_size}{_MANIFEST_SUFFIX}")
+
+
+def chapter_ref(entry: ChapterEntry) -> Dict[str, object]:
+    """来源清单中的一个原文章节"""
+    return {"number": entry.number, "filename": entry.filename, "sha1": entry.sha1}
+
+
+def read_manifest(output_path: str, name_prefix: str, batch_size) -> Dict[int, List[Dict[str, object]]]:
+    """读取来源清单中的批次记录（批次号 -> 覆盖的原文章节），没有清单或无法读取时返回空字典"""
+    try:
+        with open(manifest_path(output_path, name_prefix, batch_size), "r", encoding="utf-8") as f:
+            batches = json.load(f).get("batches") or {}
+        return {int(n): chapters for n, chapters in batches.items()}
+    except (OSError, ValueError, AttributeError, TypeError):
+        return {}
+
+
+def same_chapters(recorded: List[Dict[str, object]], planned: List[Dict[str, object]]) -> bool:
+    """清单中记录的章节与本次规划的章节是否为同一组（按文件名，不比较 sha1）"""
+    return [c.get("filename") for c in recorded] == [c.get("filename") for c in planned]
+
+
+def write_manifest(output_path: str, name_prefix: str, batch_size, source: str, prompt_path: str,
+                   batches: Dict[int, List[Dict[str, object]]], tier: str = "raw"):
+    """
+    写出来源清单：批次号 -> 该批次结果覆盖的原文章节
+
+    只更新给出的批次，已有清单中的其他批次保留不变。
+    只应写入实际生成了结果的批次，否则清单会指向内容不符的结果文件
+    """
+    path = manifest_path(output_path, name_prefix, batch_size)
+    previous = {str(n): chapters for n, chapters in read_manifest(output_path, name_prefix, batch_size).items()}
+    previous.update({str(n): chapters for n, chapters in batches.items()})
+    manifest = {"version": _VERSION, "source": os.path.abspath(source), "prompt": prompt_path, "tier": tier,
+                "batches": dict(sorted(previous.items(), key=lambda item: int(item[0])))}
+    os.makedirs(output_path, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+class SummaryTier:
+    """
+    一组已完成的结果作为输入：每个批次结果是一项，与章节输入的接口相同（entries/read）
+
+    entries 中的文件名为"第a-b章摘要.txt"形式的显示名，covers 记录每项覆盖的原文章节
+    """
+
+    def __init__(self, directory: str, name_prefix: str, batch_size: int, manifest: dict):
+        self.path = directory
+        self.name_prefix = name_prefix
+        self.batch_size = batch_size
+        self.source = manifest.get("source", "")
+        self.entries: List[ChapterEntry] = []
+        self.covers: Dict[str, List[Dict[str, object]]] = {}
+        self._files: Dict[str, str] = {}
+        for batch, chapters in sorted(manifest.get("batches", {}).items(), key=lambda item: int(item[0])):
+            output = os.path.join(directory, f"{name_prefix}_bs{batch_size}_批次{batch}.txt")
+            if not chapters or not os.path.exists(output):
+                continue
+            first, last = chapters[0]["number"], chapters[-1]["number"]
+            name = f"第{first}章摘要.txt" if first == last else f"第{first}-{last}章摘要.txt"
+            if name in self._files:
+                name = f"{name[:-4]}_{batch}.txt"
+            entry = text_entry(first, name, name[:-4], read_text_cached(output))
+            self.entries.append(entry)
+            self.covers[name] = chapters
+            self._files[name] = output
+
+    @property
+    def name(self) -> str:
+        return os.path.join(self.path, f"{self.name_prefix}_bs{self.batch_size}")
+
+    def read(self, entry: ChapterEntry) -> str:
+        return read_text_cached(self._files[entry.filename])
+
+    def read_many(self, entries: List[ChapterEntry]) -> List[str]:
+        return [self.read(entry) for entry in entries]
+
+    def iter_read(self, entries: List[ChapterEntry]):
+        for entry in entries:
+            yield self.read(entry)
+
+    def member_path(self, entry: ChapterEntry) -> str:
+        return self._files[entry.filename]
+
+    def plan_for(self, chapters: List[ChapterEntry]) -> Optional[List[ChapterEntry]]:
+        """
+        覆盖给定原文章节所需的各项；有章节没有被覆盖，或覆盖它的结果生成后原文又改动过（sha1 不同）时返回None
+        """
+        current = {c.filename: c.sha1 for c in chapters}
+        needed, covered = [], set()
+        for entry in self.entries:
+            refs = [c for c in self.covers[entry.filename] if c["filename"] in current]
+            fresh = [c for c in refs if c.get("sha1") and c["sha1"] == current[c["filename"]]]
+            if fresh and not covered.issuperset(c["filename"] for c in fresh):
+                needed.append(entry)
+                covered.update(c["filename"] for c in fresh)
+        if len(covered) < len(current):
+            return None
+        return needed
+
+
+def load_summary_tiers(directory: str) -> List[SummaryTier]:
+    """读取目录中所有带来源清单的结果组"""
+    tiers = []
+    for path in sorted(glob.glob(os.path.join(glob.escape(directory), f"*{_MANIFEST_SUFFIX}"))):
+        m = _MANIFEST.match(os.path.basename(path))
+        if not m:
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != _VERSION:
+                continue
+            tiers.append(SummaryTier(directory, m.group(1), int(m.group(2)), manifest))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, IndexError):
+            print(f"无法读取来源清单: {path}")
+    return tiers
+
+
+def choose_tier(chapters: List[ChapterEntry], directories: List[str]) -> Tuple[Optional[SummaryTier], List[ChapterEntry]]:
+    """
+    在原文与各摘要层级中选出输入token最少、且能覆盖全部所需章节的一个
+
+    Args:
+        chapters: 本次需要的原文章节
+        directories: 可用的结果目录（其中每组带来源清单的结果都是一个候选层级）
+
+    Returns:
+        (选中的层级, 该层级中需要的各项)；原文最便宜或没有可用的层级时为 (None, chapters)
+    """
+    best, best_entries = None, chapters
+    best_tokens = sum(c.tokens for c in chapters)
+    for directory in directories:
+        for tier in load_summary_tiers(directory):
+            entries = tier.plan_for(chapters)
+            if entries is None:
+                print(f"输入层级 {tier.name}: 没有覆盖全部所需章节或原文已改动，不可用")
+                continue
+            tokens = sum(e.tokens for e in entries)
+            print(f"输入层级 {tier.name}: {len(entries)} 项，约 {tokens:,} tokens")
+            if tokens < best_tokens:
+                best, best_entries, best_tokens = tier, entries, tokens
+    return best, best_entries
+
+
+if __name__ == "__main__":
+    import argparse
+    from .chapter_store import open_chapter_source
+
+    parser = argparse.ArgumentParser(description="为没有来源清单的已有结果补写清单（假定按批次顺序从第1个章节开始、未做过滤）")
+    parser.add_argument("--output_path", required=True, help="结果目录")
+    parser.add_argument("--name_prefix", required=True, help="结果文件前缀")
+    parser.add_argument("--batch_size", type=int, required=True, help="生成这些结果时的批次大小")
+    parser.add_argument("--input_path", required=True, help="生成这些结果时的章节输入（目录或 .nepack）")
+    parser.add_argument("--start_pos", type=int, default=1, help="生成时的起始位置（从1开始）")
+    args = parser.parse_args()
+
+    entries = open_chapter_source(args.input_path).entries[args.start_pos - 1:]
+    batches = {}
+    for path in glob.glob(os.path.join(glob.escape(args.output_path), f"{args.name_prefix}_bs{args.batch_size}_批次*.txt")):
+        m = re.search(r"_批次(\d+)\.txt$", path)
+        if m:
+            n = int(m.group(1))
+            chapters = entries[(n - 1) * args.batch_size:n * args.batch_size]
+            if chapters:
+                batches[n] = [chapter_ref(c) for c in chapters]
+    write_manifest(args.output_path, args.name_prefix, args.batch_size, args.input_path, "", batches)
+    print(f"已写入来源清单: {manifest_path(args.output_path, args.name_prefix, args.batch_size)}（{len(batches)} 个批次）")
@@ -0,0 +1,125 @@
+"""
+解码后文本的进程内缓存
+按 (路径, 大小, 修改时间) 校验，LRU 淘汰并限制总内存，阅读页、合并与 Query 共用，
+来回浏览章节或多次查询同一目录时不再重复读盘和解码
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .readtxt import read_text_file
+
+# 默认内存预算（字节），按 sys.getsizeof 计算
+DEFAULT_BUDGET = 128 * 1024 * 1024
+
+
+class TextCache:
+    """LRU 文本缓存，文件大小或修改时间变化即视为失效"""
+
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET):
+        self.max_bytes = max_bytes
+        # 绝对路径 -> (大小, 修改时间ns, 文本, 占用字节)
+        self._entries: "OrderedDict[str, Tuple[int, int, str, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def read(self, file_path: str, base_dir: Optional[str] = None) -> str:
+        """
+        读取文件文本，命中缓存时直接返回
+
+        Args:
+            file_path: 文件路径（可以是相对路径或绝对路径）
+            base_dir: 基础目录，如果提供则相对路径会基于此目录解析
+
+        Returns:
+            与 read_text_file 相同的文件内容
+        """
+        if base_dir is not None and not os.path.isabs(file_path):
+            file_path = os.path.join(base_dir, file_path)
+        path = os.path.abspath(file_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return read_text_file(path)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # 先取 stat 再读取：读取期间文件被修改时，下次 stat 不一致会重新读取
+        text = read_text_file(path)
+        self._store(path, stat.st_size, stat.st_mtime_ns, text)
+        return text
+
+    def _store(self, path: str, size: int, mtime_ns: int, text: str):
+        cost = sys.getsizeof(text)
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old[3]
+            if cost > self.max_bytes:
+                return
+            self._entries[path] = (size, mtime_ns, text, cost)
+            self._bytes += cost
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.evictions += 1
+
+    def invalidate(self, file_path: str):
+        """移除某个文件的缓存（如刚写入文件、修改时间精度不足以区分时）"""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def set_budget(self, max_bytes: int):
+        """调整内存预算，超出部分立即淘汰"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """命中、未命中、淘汰次数与当前占用"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = TextCache()
+
+
+def get_text_cache() -> TextCache:
+    """进程内共享的文本缓存"""
+    return _cache
+
+
+def read_text_cached(file_path: str, base_dir: Optional[str] = None) -> str:
+    """通过共享缓存读取文本文件，用法与 read_text_file 相同"""
+    return _cache.read(file_path, base_dir)
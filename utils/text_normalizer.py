@@ -0,0 +1,154 @@
+"""
+送入模型前的文本规范化
+去掉盗版/聚合txt中反复出现的站点水印与广告行、HTML实体残留、全角空白填充和多余空行，
+并压缩批次中每章的标题行，减少每个批次计费的输入token；可在 config.json 的 NORMALIZATION 中调整
+"""
+
+import re
+import html
+import json
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .paths import get_config_path
+
+# 各类空白：半角/全角空格、不换行空格（&nbsp;）、零宽字符与BOM
+_SPACES = re.compile(r'[ \t\u3000\xa0\u2002-\u200b\u2060\ufeff]+')
+_PADDING = ' \t\u3000\xa0\u200b\ufeff'
+_ENTITY = re.compile(r'&(?:[a-zA-Z]{2,8}|#\d{1,6}|#x[0-9a-fA-F]{1,6});')
+# 行内只剩标点、分隔符的装饰行（如 ------、＊＊＊）不参与水印学习
+_DECORATION = re.compile(r'^[\W_]+$')
+
+
+@dataclass
+class NormalizationConfig:
+    """文本规范化设置
+
+    enabled: 是否在 Query 组装批次时规范化（会删除学到的水印行、改变送入模型的文本，默认关闭）
+    unescape_html: 还原 &nbsp; &amp; 等HTML实体
+    strip_line_padding: 去掉每行首尾的空白（含全角空格缩进）
+    collapse_spaces: 行内连续空白合并为一个空格
+    max_blank_lines: 连续空行最多保留的行数
+    learn_boilerplate: 按行在各章中出现的频率学习水印/广告行并删除
+    boilerplate_min_ratio: 出现在至少该比例的章节中的行视为水印
+    boilerplate_min_chapters: 同时至少出现在这么多章节中
+    boilerplate_min_chars / boilerplate_max_chars: 参与学习的行长度范围，过短的行（如"嗯。"）不会被当成水印
+    boilerplate_sample: 学习时最多读取的章节数（均匀抽样）
+    patterns: 额外的水印正则，匹配（search）的行整行删除
+    compact_headers: 章节正文已经以"第X章"开头时不再加"=== 文件名 ==="标题
+    """
+    enabled: bool = False
+    unescape_html: bool = True
+    strip_line_padding: bool = True
+    collapse_spaces: bool = True
+    max_blank_lines: int = 0
+    learn_boilerplate: bool = True
+    boilerplate_min_ratio: float = 0.3
+    boilerplate_min_chapters: int = 3
+    boilerplate_min_chars: int = 6
+    boilerplate_max_chars: int = 80
+    boilerplate_sample: int = 300
+    patterns: List[str] = field(default_factory=list)
+    compact_headers: bool = True
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NormalizationConfig":
+        """从配置字典构建设置，未知字段忽略"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+def load_normalization_config() -> NormalizationConfig:
+    """读取 config.json 中的 NORMALIZATION，缺失或无法读取时使用默认设置"""
+    try:
+        with open(get_config_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f).get("NORMALIZATION") or {}
+    except (OSError, ValueError, AttributeError):
+        data = {}
+    return NormalizationConfig.from_dict(data)
+
+
+class TextNormalizer:
+    """按 NormalizationConfig 规范化章节文本，水印行由 learn 从一组章节中学习"""
+
+    def __init__(self, config: Optional[NormalizationConfig] = None):
+        self.config = config or NormalizationConfig()
+        try:
+            self._patterns = [re.compile(p) for p in self.config.patterns]
+        except re.error as e:
+            raise ValueError(f"NORMALIZATION.patterns 中的正则表达式有误: {str(e)}")
+        self.boilerplate: set = set()
+
+    def clean_line(self, line: str) -> str:
+        """规范化一行的空白（不含HTML实体还原）"""
+        if self.config.collapse_spaces:
+            line = _SPACES.sub(' ', line)
+        if self.config.strip_line_padding:
+            line = line.strip(_PADDING)
+        return line
+
+    def _unescape(self, text: str) -> str:
+        if self.config.unescape_html and '&' in text and _ENTITY.search(text):
+            text = html.unescape(text)
+        return text
+
+    def learn(self, texts: Iterable[str]) -> List[Tuple[str, int]]:
+        """
+        从一组章节中学习水印/广告行：规范化后完全相同、且出现在足够多章节中的行
+
+        Args:
+            texts: 章节文本（每章计数一次）
+
+        Returns:
+            [(水印行, 出现的章节数)]，按出现次数从多到少排序
+        """
+        config = self.config
+        counts: Dict[str, int] = {}
+        total = 0
+        for text in texts:
+            total += 1
+            seen = set()
+            for line in self._unescape(text).split('\n'):
+                line = self.clean_line(line)
+                if config.boilerplate_min_chars <= len(line) <= config.boilerplate_max_chars \
+                        and not _DECORATION.match(line):
+                    seen.add(line)
+            for line in seen:
+                counts[line] = counts.get(line, 0) + 1
+
+        threshold = max(config.boilerplate_min_chapters, config.boilerplate_min_ratio * total)
+        learned = sorted(((line, n) for line, n in counts.items() if n >= threshold),
+                         key=lambda item: item[1], reverse=True)
+        self.boilerplate = {line for line, _ in learned}
+        return learned
+
+    def normalize(self, text: str) -> str:
+        """规范化一章正文：还原HTML实体、清理空白、删除水印行、合并空行"""
+        lines = []
+        blank = 0
+        for line in self._unescape(text).split('\n'):
+            line = self.clean_line(line)
+            if line and (line in self.boilerplate or any(p.search(line) for p in self._patterns)):
+                continue
+            if not line.strip():
+                blank += 1
+                if blank > self.config.max_blank_lines:
+                    continue
+                line = ""
+            else:
+                blank = 0
+            lines.append(line)
+        return '\n'.join(lines).strip()
+
+    def render(self, filename: str, number: int, content: str) -> str:
+        """
+        批次中一章的文本：正文已经以自己的"第X章"标题开头时省略文件名标题
+
+        Args:
+            filename: 章节文件名
+            number: 章节号（不是章节文件时为0）
+            content: 已规范化的正文
+        """
+        if self.config.compact_headers and number and content.startswith(f"第{number}章"):
+            return f"\n{content}\n"
+        return f"\n=== {filename} ===\n{content}\n"
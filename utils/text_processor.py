@@ -6,27 +6,148 @@
 import re
 import os
 import sys
-from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
+import mmap
+from array import array
+from typing import Iterable, Iterator, List, Dict, Tuple, Optional, Union
 
 from .readtxt import read_text_file
+from .heading_grammar import (HeadingGrammar, HeadingMatcher, Heading, StructureState, VOLUME,
+                              chinese_to_arabic)
+
+
+_CJK_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中日韩字符约0.7 token/字，其余字符约4字符/token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return int(cjk * 0.7 + (len(text) - cjk) / 4) + 1
+
+
+class ChapterIndex:
+    """章节索引
+
+    以紧凑数组保存每个正文片段的章节号、偏移与字数，标题单独成表。
+    所有片段共享同一个缓冲区：解码后的全文 str，或按 encoding 解码的 bytes/mmap，
+    正文只在需要时按偏移切片生成，不为每章常驻一份拷贝。
+    """
+    __slots__ = ("buffer", "encoding", "numbers", "titles", "volumes", "starts", "ends", "lengths")
+
+    def __init__(self, buffer: Union[str, bytes, mmap.mmap], encoding: Optional[str] = None):
+        self.buffer = buffer
+        self.encoding = encoding    # buffer 为 bytes/mmap 时的编码，偏移按字节计
+        self.numbers = array('q')
+        self.titles: List[str] = []
+        self.volumes: List[str] = []    # 片段所属的卷名，没有卷时为空字符串
+        self.starts = array('q')
+        self.ends = array('q')
+        self.lengths = array('q')   # 片段字数（字符数）
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def append(self, number: int, title: str, start: int, end: int, length: Optional[int] = None,
+               volume: str = ""):
+        """追加一个正文片段，length 缺省时按 end - start 计算（仅适用于 str 缓冲区）"""
+        self.numbers.append(number)
+        self.titles.append(title)
+        self.volumes.append(volume)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lengths.append(end - start if length is None else length)
+
+    def segment_text(self, i: int) -> str:
+        """生成第 i 个片段的正文"""
+        part = self.buffer[self.starts[i]:self.ends[i]]
+        if not isinstance(part, str):
+            part = bytes(part).decode(self.encoding or "utf-8")
+        return part
+
+    def chapters(self) -> List["Chapter"]:
+        """按章节号合并片段（同号片段按出现顺序拼接，标题取第一次出现的），按章节号排序"""
+        segments: Dict[int, List[int]] = {}
+        order = []
+        for i, number in enumerate(self.numbers):
+            if number not in segments:
+                segments[number] = []
+                order.append(number)
+            segments[number].append(i)
+        chapters = [Chapter(number, self.titles[segments[number][0]], index=self, segments=segments[number],
+                            volume=self.volumes[segments[number][0]])
+                    for number in order]
+        chapters.sort(key=lambda x: x.number)
+        return chapters
 
 
-@dataclass
 class Chapter:
-    """章节数据结构"""
-    number: int         #章节编号（阿拉伯数字），如 1, 2, 3...
-    title: str          #章节标题（不含“第X章”前缀），如 “初遇”、“决战紫禁之巅”从正则匹配中提取，已去除前后空白
-    content: str        #章节正文内容（不包含标题行）
-    word_count: int
+    """章节视图
+
+    number: 章节编号（阿拉伯数字），如 1, 2, 3...
+    title: 章节标题（不含“第X章”前缀），如 “初遇”、“决战紫禁之巅”从正则匹配中提取，已去除前后空白
+    content: 章节正文内容（不包含标题行），由 ChapterIndex 中的片段按需生成；
+             同一章节号的多个片段以换行拼接
+    word_count: 正文字数（不含片段之间的换行）
+    volume: 所属的卷名（如“第一卷 风起”），没有卷标题时为空字符串
+    """
+    __slots__ = ("number", "title", "word_count", "volume", "_index", "_segments", "_content")
+
+    def __init__(self, number: int, title: str, content: Optional[str] = None, word_count: Optional[int] = None,
+                 index: Optional[ChapterIndex] = None, segments: Tuple[int, ...] = (), volume: str = ""):
+        self.number = number
+        self.title = title
+        self.volume = volume
+        self._index = index
+        self._segments = tuple(segments)
+        self._content = content
+        if word_count is None:
+            if content is not None:
+                word_count = len(content)
+            else:
+                word_count = sum(index.lengths[i] for i in self._segments)
+        self.word_count = word_count
+
+    @property
+    def content(self) -> str:
+        if self._content is not None:
+            return self._content
+        return '\n'.join(self._index.segment_text(i) for i in self._segments)
+
+    @content.setter
+    def content(self, value: str):
+        self._content = value
+        self._index = None
+        self._segments = ()
+
+    def iter_parts(self) -> Iterator[str]:
+        """依次产出正文片段（含片段间的换行），用于写文件时避免拼接整章"""
+        if self._content is not None:
+            yield self._content
+            return
+        for n, i in enumerate(self._segments):
+            if n:
+                yield '\n'
+            yield self._index.segment_text(i)
+
+    def write_to(self, f):
+        """把正文写入已打开的文本文件"""
+        for part in self.iter_parts():
+            f.write(part)
+
+    def __repr__(self) -> str:
+        return f"Chapter(number={self.number}, title={self.title!r}, word_count={self.word_count})"
 
 
 class TextProcessor:
     """文本预处理器"""
     
-    def __init__(self):
+    def __init__(self, grammar: Optional[HeadingGrammar] = None):
         # 章节标题的正则表达式模式（"第"字前面可以有其他内容）
         self.chapter_pattern = r'.*第[一二三四五六七八九十百千万零\d]+章[：:\s]*(.*)$'
+        # 标题文法（第X章/回/节、卷、序章/番外、Chapter N），编译为单遍扫描的匹配器
+        self.grammar = grammar or HeadingGrammar()
+        self.matcher = HeadingMatcher(self.grammar)
+        # 最近一次拆分的层级状态（卷、章节号偏移、各类标题数量）
+        self.structure = StructureState(self.grammar)
         
         # 数字转换映射
         self.chinese_numbers = {
@@ -69,40 +190,45 @@ class TextProcessor:
         Returns:
             阿拉伯数字
         """
-        if not chinese_num:
-            return 0
+        return chinese_to_arabic(chinese_num)
+    
+    def scan_structure(self, text: str, state: Optional[StructureState] = None) -> List[Heading]:
+        """
+        单次扫描全文，找出所有章节与卷标题行，并按层级确定章节号
 
-        # 如果已经是阿拉伯数字，直接返回
-        if chinese_num.isdigit():
-            return int(chinese_num)
+        Args:
+            text: 已统一为 \\n 换行的文本
+            state: 层级状态，流式拆分时在各块之间传递；为None时从头开始
 
-        # 中文数字映射表
-        num_map = {
-            '零': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5,
-            '六': 6, '七': 7, '八': 8, '九': 9, '十': 10,
-            '百': 100, '千': 1000, '万': 10000
-        }
+        Returns:
+            按位置排序的标题；kind 为 VOLUME 的是卷标题，只作为章节边界
+        """
+        if state is None:
+            state = StructureState(self.grammar)
+        headings = []
+        for raw in self.matcher.scan(text):
+            heading = state.resolve(raw)
+            if heading is not None:
+                headings.append(heading)
+        return headings
+
+    def scan_headings(self, text: str, state: Optional[StructureState] = None) -> List[Tuple[int, int, int, str]]:
+        """
+        单次扫描全文，找出所有章节标题行（不含卷标题）
+
+        "第X章"的规则与逐行匹配 chapter_pattern 一致：包含"第X章"的行即为标题行，
+        章节号取行内第一处"第X章"，标题取行内最后一处"第X章"之后的内容；
+        其余格式见 HeadingGrammar。
+
+        Args:
+            text: 已统一为 \\n 换行的文本
+
+        Returns:
+            [(标题行起始偏移, 标题行结束偏移（不含换行符）, 章节号, 标题)]
+        """
+        return [(h.line_start, h.line_end, h.number, h.title)
+                for h in self.scan_structure(text, state) if h.kind != VOLUME]
 
-        result = 0
-        temp = 0
-
-        for char in chinese_num:
-            if char in num_map:
-                num = num_map[char]
-                if num >= 10:
-                    if num == 10 and temp == 0:
-                        temp = 1
-                    temp *= num
-                    if num >= 100:
-                        result += temp
-                        temp = 0
-                else:
-                    temp += num
-            elif char.isdigit():
-                temp = temp * 10 + int(char)
-
-        return result + temp
-    
     def split_chapters(self, text: str) -> List[Chapter]:
         """
         将文本分割为章节
@@ -114,66 +240,123 @@ class TextProcessor:
             章节列表
         """
         # 标准化换行符
-        text = re.sub(r'\r\n', '\n', text)
-        
-        chapters = []
-        chapter_dict = {}  # 用于存储章节号到章节对象的映射
-        
-        # 查找所有章节标题行
-        lines = text.split('\n')
-        chapter_indices = []
-        
-        for i, line in enumerate(lines):
-            if re.match(self.chapter_pattern, line):
-                chapter_indices.append(i)
-        
-        if not chapter_indices:
+        text = text.replace('\r\n', '\n')
+
+        return self.build_index(text).chapters()
+
+    def build_index(self, text: str) -> ChapterIndex:
+        """
+        扫描标题并建立章节索引（正文不复制，只记录偏移）
+
+        Args:
+            text: 已统一为 \\n 换行的文本
+
+        Returns:
+            章节索引；没有找到章节标记时，整个文本作为第1章"全文"
+        """
+        index = ChapterIndex(text)
+        self.structure = StructureState(self.grammar)
+        headings = self.scan_structure(text, self.structure)
+
+        if not any(h.kind != VOLUME for h in headings):
             # 如果没有找到章节标记，将整个文本作为一章
-            return [Chapter(
-                number=1,
-                title="全文",
-                content=text,
-                word_count=len(text)
-            )]
-        
-        # 分割章节
-        for i, idx in enumerate(chapter_indices):
-            chapter_title_line = lines[idx]
-            next_idx = chapter_indices[i + 1] if i + 1 < len(chapter_indices) else len(lines)
-            
-            # 提取章节标题
-            title_match = re.match(self.chapter_pattern, chapter_title_line)
-            if title_match:
-                chapter_title = title_match.group(1).strip() if title_match.group(1) else ""
-                chapter_number = self.extract_chapter_number(chapter_title_line)
-                
-                # 获取章节内容（不包括标题行）
-                content_lines = lines[idx + 1:next_idx]
-                content = '\n'.join(content_lines)
-                
-                # 检查是否已存在同名章节
-                if chapter_number in chapter_dict:
-                    # 如果已存在，追加内容到现有章节
-                    existing_chapter = chapter_dict[chapter_number]
-                    existing_chapter.content += '\n' + content
-                    existing_chapter.word_count += len(content)
-                else:
-                    # 创建新章节对象
-                    chapter = Chapter(
-                        number=chapter_number,
-                        title=chapter_title,
-                        content=content,
-                        word_count=len(content)
-                    )
-                    
-                    chapters.append(chapter)
-                    chapter_dict[chapter_number] = chapter
-        
-        # 按章节号排序
-        chapters.sort(key=lambda x: x.number)
-        
-        return chapters
-    
+            index.append(1, "全文", 0, len(text))
+            return index
+
+        # 卷标题不结束上一章：卷标题行及其后到下一章之间的文字（卷简介，或正文中恰好单独成行的"卷一"）归入上一章；
+        # 第一章之前的卷标题与全书开头的文字一样不归入章节
+        headings = [h for h in headings if h.kind != VOLUME]
+        for i, heading in enumerate(headings):
+            # 正文从标题行的下一行开始，到下一个章节标题行之前的换行符为止
+            content_start = heading.line_end + 1
+            if i + 1 < len(headings):
+                content_end = headings[i + 1].line_start - 1
+            else:
+                content_end = len(text)
+            if content_start > content_end:
+                content_start = content_end
+            index.append(heading.number, heading.title, content_start, content_end, volume=heading.volume)
+
+        return index
+
+    def iter_chapters(self, chunks: Iterable[str], state: Optional[StructureState] = None) -> Iterator[Chapter]:
+        """
+        流式拆分章节：逐块消费文本，每遇到下一个标题就产出上一章
+
+        只在完整的行上扫描标题，块末尾不完整的行留到下一块，因此标题不会被块边界切断；
+        内存占用只与最长的一章有关，与全文大小无关。与 split_chapters 的区别：
+        章节按出现顺序产出，同一章节号重复出现时会分别产出（由调用方追加合并）。
+
+        Args:
+            chunks: 依次到达的文本块，如 iter_text_chunks 的输出
+            state: 层级状态，从某个标题处续读时传入该标题之前的状态；为None时从头开始
+
+        Yields:
+            带正文的章节；没有找到任何章节标记时，整个文本作为第1章"全文"
+        """
+        state = self.structure = state or StructureState(self.grammar)
+        pending = ""            # 尚未扫描的不完整行
+        current = None          # 当前章节 (章节号, 标题, 卷名)
+        found = False           # 是否已经出现过章节标题
+        parts: List[str] = []   # 当前章节（或第一个标题之前）的正文片段，含结尾换行
+        attached = None         # 章节之间的卷标题：[卷名, 卷标题行起已归入当前章节的字数]
+
+        def finish(terminated: bool) -> Chapter:
+            content = "".join(parts)
+            if terminated:
+                # 去掉下一个标题行之前的换行符，与 build_index 的切分方式一致
+                content = content[:-1]
+            return Chapter(current[0], current[1], content=content, volume=current[2])
+
+        def scan(block: str) -> Iterator[Chapter]:
+            nonlocal current, parts, found, attached
+            pos = 0
+            mark = 0                # 卷标题行在本块中的起点，统计归入上一章的字数
+            for heading in self.scan_structure(block, state):
+                if heading.kind == VOLUME:
+                    # 卷标题不结束上一章（与 build_index 一致），其后到下一章之间的文字归入上一章
+                    if current is not None and attached is None:
+                        attached = [heading.title, 0]
+                        mark = heading.line_start
+                    continue
+                parts.append(block[pos:heading.line_start])
+                if attached is not None:
+                    attached[1] += max(0, heading.line_start - 1 - mark)
+                    state.attached.append(tuple(attached))
+                    attached = None
+                if current is not None:
+                    yield finish(True)
+                elif not found:
+                    state.leading_chars = len("".join(parts).rstrip("\n"))
+                current = (heading.number, heading.title, heading.volume)
+                found = True
+                parts = []
+                pos = heading.line_end + 1
+            if pos <= len(block):
+                parts.append(block[pos:])
+            if attached is not None:
+                attached[1] += len(block) - mark
+
+        for chunk in chunks:
+            text = pending + chunk
+            # 与文本模式读取一致统一换行符；\r\n 可能被块边界拆开，末尾的 \r 留到下一块再处理
+            cut = len(text) - 1 if text.endswith('\r') else len(text)
+            text, pending = text[:cut].replace('\r\n', '\n').replace('\r', '\n'), text[cut:]
+            last_newline = text.rfind('\n')
+            if last_newline == -1:
+                pending = text + pending
+                continue
+            pending = text[last_newline + 1:] + pending
+            yield from scan(text[:last_newline + 1])
+
+        yield from scan(pending.replace('\r', '\n'))
+        if attached is not None:
+            state.attached.append(tuple(attached))
+        if current is not None:
+            yield finish(False)
+        elif not found:
+            yield Chapter(1, "全文", content="".join(parts))
+
     def get_text_statistics(self, chapters: List[Chapter]) -> Dict[str, any]:
         """
         获取文本统计信息
@@ -211,18 +394,18 @@ class TextProcessor:
         if end_idx is None:
             end_idx = len(chapters)
         
-        formatted_text = ""
+        parts = []
         for i in range(start_idx, min(end_idx, len(chapters))):
             chapter = chapters[i]
             # 处理第0章的特殊情况
             if chapter.number == 0:
-                formatted_text += f"\n序章 {chapter.title}\n"
+                parts.append(f"\n序章 {chapter.title}\n")
             else:
-                formatted_text += f"\n第{chapter.number}章 {chapter.title}\n"
-            formatted_text += f"{chapter.content}\n"
-            formatted_text += "-" * 50 + "\n"
+                parts.append(f"\n第{chapter.number}章 {chapter.title}\n")
+            parts.extend(chapter.iter_parts())
+            parts.append("\n" + "-" * 50 + "\n")
         
-        return formatted_text
+        return "".join(parts)
 
 
 # 测试代码
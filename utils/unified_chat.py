@@ -3,8 +3,12 @@
 支持多厂商API调用的统一接口
 """
 
+import re
 import json
 import time
+import random
+import hashlib
+import os
 from typing import Dict, Any, Optional
 
 
@@ -12,11 +16,14 @@ from typing import Dict, Any, Optional
 import sys
 import asyncio
 import json
+from dataclasses import dataclass, fields
 import google.generativeai as genai
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, APITimeoutError
 from typing import Any, Dict, Optional, Union, List
 
-from utils.paths import get_config_path
+from utils.paths import get_config_path, get_exe_dir
+from utils.text_processor import estimate_tokens
 
 # 从 JSON 文件加载配置（统一处理开发和打包场景）
 with open(get_config_path(), 'r', encoding='utf-8') as f:
@@ -32,17 +39,103 @@ DEFAULT_TEMPERATURE = config.get('DEFAULT_TEMPERATURE', None)
 DEFAULT_TOP_P = config.get('DEFAULT_TOP_P', None)
 DEFAULT_MAX_TOKENS = config.get('DEFAULT_MAX_TOKENS', 32000)
 DEFAULT_DOUBAO_THINKING = config.get('DEFAULT_DOUBAO_THINKING', 'disabled')
+# 请求超时（秒）：connect 建连、read 两次收到数据之间的最长间隔、total 整个请求的截止时间
+# 可在 PROVIDER_CONFIG 的 timeouts 中按厂商覆盖，再由生成参数档案按任务覆盖
+DEFAULT_TIMEOUTS = {"connect": 10, "read": 300, "total": 900, **config.get('DEFAULT_TIMEOUTS', {})}
+# 命名的生成参数档案，以及 模型/厂商 -> 档案名 的默认映射
+GENERATION_PROFILES = config.get('GENERATION_PROFILES', {})
+MODEL_PROFILES = config.get('MODEL_PROFILES', {})
+
+# 各厂商开关思维链的参数写法（可在 PROVIDER_CONFIG 中用 thinking_style 覆盖）
+# doubao/zhipu: {"thinking": {"type": "enabled" | "disabled" | "auto"}}
+# qwen: {"enable_thinking": true | false}（阿里云百炼、硅基流动）
+DEFAULT_THINKING_STYLES = {
+    "doubao": "doubao",
+    "zhipu": "zhipu",
+    "aliyun": "qwen",
+    "siliconflow": "qwen",
+}
+
+# 结构化输出（Query 指定 JSON Schema 时）的请求方式，可在 PROVIDER_CONFIG 中用 structured_output 按厂商覆盖
+# json_schema: response_format 附带 JSON Schema，由厂商约束生成
+# json_object: response_format={"type": "json_object"}，只保证输出合法JSON，schema 写在 prompt 中
+# none: 不下发，只靠 prompt 约束
+DEFAULT_STRUCTURED_OUTPUT = "json_object"
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """生成参数档案
+
+    一个档案描述一次调用的全部生成参数，Query 任务按名称选择档案，
+    不同任务可以在同一进程里并发使用不同的档案。
+    """
+    name: str = "default"
+    system_prompt: Optional[str] = DEFAULT_SYSTEM_PROMPT
+    stream: bool = DEFAULT_STREAM
+    temperature: Optional[float] = DEFAULT_TEMPERATURE
+    top_p: Optional[float] = DEFAULT_TOP_P
+    max_tokens: Optional[int] = DEFAULT_MAX_TOKENS
+    # 按输入规模估算输出上限：max_tokens = 输入token估算 * output_ratio（不超过 max_tokens）
+    output_ratio: Optional[float] = None
+    min_output_tokens: int = 1024
+    thinking: Optional[str] = None          # "enabled" / "disabled" / "auto"，None 表示不下发
+    reasoning_effort: Optional[str] = None  # "low" / "medium" / "high"，None 表示不下发
+    timeout: Optional[float] = None         # 单次请求总截止时间（秒），None 使用厂商/全局设置
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    # 按预计输出规模放宽截止时间：total = read + 输出上限/1000 * timeout_per_1k_tokens（不超过 total）
+    timeout_per_1k_tokens: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, name: str, data: Dict[str, Any]) -> "GenerationProfile":
+        """从配置字典构建档案，未知字段忽略，thinking 兼容布尔写法"""
+        known = {f.name for f in fields(cls)}
+        values = {k: v for k, v in data.items() if k in known and k != "name"}
+        thinking = values.get("thinking")
+        if isinstance(thinking, bool):
+            values["thinking"] = "enabled" if thinking else "disabled"
+        return cls(name=name, **values)
+
+    def resolve_max_tokens(self, message: str) -> Optional[int]:
+        """根据输入长度确定本次请求的输出上限"""
+        if self.output_ratio is None:
+            return self.max_tokens
+        sized = max(self.min_output_tokens, int(estimate_tokens(message) * self.output_ratio))
+        return min(sized, self.max_tokens) if self.max_tokens is not None else sized
+
+
+@dataclass(frozen=True)
+class RequestTimeouts:
+    """单次请求的超时设置（秒）"""
+    connect: float
+    read: float
+    total: float
+
+    def to_httpx(self) -> httpx.Timeout:
+        """转换为 OpenAI SDK 使用的 httpx 超时（read 即读空闲超时）"""
+        return httpx.Timeout(self.read, connect=self.connect)
+
+
+class RequestTimeoutError(Exception):
+    """请求超过截止时间"""
+
+
+# 视为超时的异常：总截止时间、httpx 连接/读空闲超时、OpenAI SDK 包装后的超时
+TIMEOUT_ERRORS = (asyncio.TimeoutError, httpx.TimeoutException, APITimeoutError, RequestTimeoutError)
+
 
 
 class AsyncOpenAICompatibleClient:
     """异步OpenAI SDK兼容客户端"""
     
-    def __init__(self, api_key: str, base_url: str):
-        # OpenAI SDK 使用秒作为单位，
+    def __init__(self, api_key: str, base_url: str, timeouts: Optional[RequestTimeouts] = None):
+        # OpenAI SDK 使用秒作为单位，总截止时间由 ModelRouter 统一控制
+        timeouts = timeouts or RequestTimeouts(**DEFAULT_TIMEOUTS)
         self.client = AsyncOpenAI(
             api_key=api_key,
             base_url=base_url,
-            timeout=900
+            timeout=timeouts.to_httpx()
         )
     
     async def create_completion(self, **kwargs) -> Any:
@@ -54,6 +147,11 @@ class AsyncOpenAICompatibleClient:
         temperature = kwargs.get("temperature")
         top_p = kwargs.get("top_p")
         max_tokens = kwargs.get("max_tokens")
+        thinking = kwargs.get("thinking")
+        thinking_style = kwargs.get("thinking_style")
+        reasoning_effort = kwargs.get("reasoning_effort")
+        timeout = kwargs.get("timeout")
+        response_format = kwargs.get("response_format")
         
         # 构建消息
         messages = []
@@ -75,6 +173,19 @@ class AsyncOpenAICompatibleClient:
             params["top_p"] = top_p
         if max_tokens is not None:
             params["max_tokens"] = max_tokens
+        if reasoning_effort is not None:
+            params["reasoning_effort"] = reasoning_effort
+        if timeout is not None:
+            params["timeout"] = timeout.to_httpx() if isinstance(timeout, RequestTimeouts) else timeout
+        if response_format is not None:
+            params["response_format"] = response_format
+
+        # 思维链开关不是OpenAI标准参数，按厂商写法放进 extra_body
+        if thinking is not None:
+            if thinking_style in ("doubao", "zhipu"):
+                params["extra_body"] = {"thinking": {"type": thinking}}
+            elif thinking_style == "qwen":
+                params["extra_body"] = {"enable_thinking": thinking != "disabled"}
         
         return await self.client.chat.completions.create(**params)
         #等待 xxx 这个异步操作完成，然后将它的最终结果作为当前函数的返回值返回
@@ -84,9 +195,14 @@ class AsyncOpenAICompatibleClient:
     def extract_response(self, response) -> Dict[str, str]:
         """提取响应内容"""
         message = response.choices[0].message
+        usage = getattr(response, "usage", None)
         return {
             "content": message.content or "",
-            "reasoning_content": getattr(message, 'reasoning_content', '') or ""
+            "reasoning_content": getattr(message, 'reasoning_content', '') or "",
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None)
+            } if usage is not None else None
         }
     
     def extract_streaming_response(self, chunk) -> Dict[str, str]:
@@ -104,11 +220,12 @@ class AsyncOpenAICompatibleClient:
 class AsyncGoogleClient:
     """异步Google Gemini官方客户端（支持思维链）"""
     
-    def __init__(self, api_key: str, base_url: str = None):
-        # google-genai 使用毫秒作为单位，5分钟 = 300000毫秒
+    def __init__(self, api_key: str, base_url: str = None, timeouts: Optional[RequestTimeouts] = None):
+        # google-genai 使用毫秒作为单位，只支持一个总超时
+        timeouts = timeouts or RequestTimeouts(**DEFAULT_TIMEOUTS)
         self.client = genai.Client(
             api_key=api_key,
-            http_options=types.HttpOptions(timeout=900000, base_url=base_url)
+            http_options=types.HttpOptions(timeout=int(timeouts.total * 1000), base_url=base_url)
         )
     
     async def create_completion(self, **kwargs) -> Any:
@@ -120,6 +237,8 @@ class AsyncGoogleClient:
         temperature = kwargs.get("temperature")
         top_p = kwargs.get("top_p")
         max_output_tokens = kwargs.get("max_tokens")
+        thinking = kwargs.get("thinking")
+        response_format = kwargs.get("response_format")
         
         # 构建内容列表，统一使用 list[types.Content] 格式
         contents = []
@@ -131,12 +250,12 @@ class AsyncGoogleClient:
         )
         contents.append(user_content)
         
-        # 构建配置参数（默认开启思维链）
-        config = types.GenerateContentConfig(
-            thinking_config=types.ThinkingConfig(
-                include_thoughts=True
-            )
-        )
+        # 构建配置参数（默认开启思维链，档案显式关闭时预算置0）
+        if thinking == "disabled":
+            thinking_config = types.ThinkingConfig(thinking_budget=0)
+        else:
+            thinking_config = types.ThinkingConfig(include_thoughts=True)
+        config = types.GenerateContentConfig(thinking_config=thinking_config)
         
         # 只在显式指定时添加参数
         if max_output_tokens is not None:
@@ -145,6 +264,9 @@ class AsyncGoogleClient:
             config.temperature = temperature
         if top_p is not None:
             config.top_p = top_p
+        # 结构化输出：只要求返回JSON，schema 由 prompt 约束
+        if response_format is not None:
+            config.response_mime_type = "application/json"
         
         # 添加系统提示词（Gemini 使用 system_instruction）
         if system_prompt is not None:
@@ -205,20 +327,199 @@ class AsyncGoogleClient:
         }
 
 
+class ReplayStore:
+    """录制/回放存储：JSONL 文件，每行一条 请求指纹 -> 响应 记录
+
+    只保存请求指纹与长度，不保存原始 prompt；同一指纹录制多次时回放按顺序轮换。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        record = json.loads(line)
+                        self.records.setdefault(record["key"], []).append(record)
+
+    @staticmethod
+    def request_key(params: Dict[str, Any]) -> str:
+        """请求指纹：只取影响输出的参数"""
+        fingerprint = {k: params.get(k) for k in (
+            "model", "system_prompt", "message", "temperature", "top_p", "max_tokens", "thinking", "reasoning_effort")}
+        # 结构化输出参数只在指定时计入，已有录制的指纹不变
+        if params.get("response_format") is not None:
+            fingerprint["response_format"] = params["response_format"]
+        return hashlib.sha256(json.dumps(fingerprint, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+    def append(self, record: Dict[str, Any]):
+        """追加一条记录并立即落盘"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.records.setdefault(record["key"], []).append(record)
+
+    def lookup(self, key: str, prompt_chars: int, nearest: bool = False) -> Optional[Dict[str, Any]]:
+        """按指纹查找记录；nearest 时未命中则取输入长度最接近的记录"""
+        candidates = self.records.get(key)
+        if not candidates:
+            if not nearest or not self.records:
+                return None
+            candidates = min(self.records.values(), key=lambda rs: abs(rs[0]["prompt_chars"] - prompt_chars))
+            key = candidates[0]["key"]
+        index = self._cursor.get(key, 0)
+        self._cursor[key] = index + 1
+        return candidates[index % len(candidates)]
+
+
+# 按路径共享存储，避免每次创建客户端都重新加载
+_REPLAY_STORES: Dict[str, ReplayStore] = {}
+
+
+def get_replay_store(path: str) -> ReplayStore:
+    """获取（必要时加载）指定路径的录制存储，相对路径基于项目根目录"""
+    if not os.path.isabs(path):
+        path = str(get_exe_dir() / path)
+    path = os.path.normpath(path)
+    if path not in _REPLAY_STORES:
+        _REPLAY_STORES[path] = ReplayStore(path)
+    return _REPLAY_STORES[path]
+
+
+class AsyncReplayClient:
+    """录制/回放客户端
+
+    record 模式把请求转发给 upstream 厂商，并记录响应、耗时、用量与错误；
+    replay 模式完全离线，按记录的耗时（乘以 latency_scale）返回响应，可按比例注入错误。
+    """
+
+    def __init__(self, provider_config: Dict[str, Any], timeouts: Optional[RequestTimeouts] = None):
+        self.mode = provider_config.get("mode", "replay")
+        self.store = get_replay_store(provider_config.get("store", "replay/replay.jsonl"))
+        self.latency_scale = float(provider_config.get("latency_scale", 1.0))
+        self.error_rate = float(provider_config.get("error_rate", 0.0))
+        self.timeout_rate = float(provider_config.get("timeout_rate", 0.0))
+        self.nearest = provider_config.get("miss_policy", "error") == "nearest"
+        self.random = random.Random(provider_config.get("seed"))
+        self.upstream = None
+        if self.mode == "record":
+            upstream = provider_config.get("upstream")
+            if upstream not in PROVIDER_CONFIG or PROVIDER_CONFIG[upstream].get("type") == "replay":
+                raise ValueError(f"录制模式需要有效的 upstream 厂商: {upstream}")
+            self.upstream = ClientFactory.create_client(PROVIDER_CONFIG[upstream], timeouts)
+        elif self.mode != "replay":
+            raise ValueError(f"不支持的录制回放模式: {self.mode}")
+
+    async def create_completion(self, **kwargs) -> Any:
+        """创建完成请求（响应统一为已提取的字典，流式为字典的异步生成器）"""
+        key = ReplayStore.request_key(kwargs)
+        if self.mode == "record":
+            return await self._record(key, kwargs)
+        return await self._replay(key, kwargs)
+
+    async def _record(self, key: str, kwargs: Dict[str, Any]) -> Any:
+        record = {"key": key, "model": kwargs.get("model"), "prompt_chars": len(kwargs.get("message", "")),
+                  "stream": bool(kwargs.get("stream"))}
+        start = time.perf_counter()
+        try:
+            response = await self.upstream.create_completion(**kwargs)
+        except Exception as e:
+            record.update(latency=time.perf_counter() - start, error=str(e) or type(e).__name__,
+                          error_type="timeout" if isinstance(e, TIMEOUT_ERRORS) else "error")
+            self.store.append(record)
+            raise
+
+        if not kwargs.get("stream"):
+            data = self.upstream.extract_response(response)
+            record.update(latency=time.perf_counter() - start, content=data["content"],
+                          reasoning_content=data["reasoning_content"], usage=data.get("usage"))
+            self.store.append(record)
+            return data
+
+        async def recording_generator():
+            content, reasoning, first = [], [], None
+            try:
+                async for chunk in response:
+                    data = self.upstream.extract_streaming_response(chunk)
+                    if first is None:
+                        first = time.perf_counter() - start
+                    content.append(data["content"])
+                    reasoning.append(data["reasoning_content"])
+                    yield data
+            except Exception as e:
+                record.update(error=str(e) or type(e).__name__,
+                              error_type="timeout" if isinstance(e, TIMEOUT_ERRORS) else "error")
+                raise
+            finally:
+                record.update(latency=time.perf_counter() - start, ttft=first,
+                              content="".join(content), reasoning_content="".join(reasoning))
+                self.store.append(record)
+
+        return recording_generator()
+
+    async def _replay(self, key: str, kwargs: Dict[str, Any]) -> Any:
+        record = self.store.lookup(key, len(kwargs.get("message", "")), self.nearest)
+        if record is None:
+            raise ValueError(f"回放存储中没有该请求的记录: {key}")
+
+        latency = record.get("latency", 0.0) * self.latency_scale
+        roll = self.random.random()
+        if roll < self.timeout_rate or record.get("error_type") == "timeout":
+            await asyncio.sleep(latency)
+            raise RequestTimeoutError(record.get("error") or "注入的超时错误")
+        if roll < self.timeout_rate + self.error_rate or record.get("error"):
+            await asyncio.sleep(latency)
+            raise Exception(record.get("error") or "注入的错误")
+
+        data = {"content": record.get("content", ""), "reasoning_content": record.get("reasoning_content", ""),
+                "usage": record.get("usage")}
+        if not kwargs.get("stream"):
+            await asyncio.sleep(latency)
+            return data
+
+        async def replay_generator():
+            # 先等首字耗时，剩余耗时均摊到各分片
+            ttft = (record.get("ttft") or 0.0) * self.latency_scale
+            await asyncio.sleep(ttft)
+            text = data["content"]
+            pieces = [text[i:i + 64] for i in range(0, len(text), 64)] or [""]
+            interval = max(latency - ttft, 0.0) / len(pieces)
+            if data["reasoning_content"]:
+                yield {"content": "", "reasoning_content": data["reasoning_content"]}
+            for piece in pieces:
+                await asyncio.sleep(interval)
+                yield {"content": piece, "reasoning_content": ""}
+
+        return replay_generator()
+
+    def extract_response(self, response) -> Dict[str, str]:
+        """提取响应内容"""
+        return response
+
+    def extract_streaming_response(self, chunk) -> Dict[str, str]:
+        """提取流式响应内容"""
+        return chunk
+
+
 class ClientFactory:
     """客户端工厂类"""
     
     @staticmethod
-    def create_client(provider_config: Dict[str, Any]) -> Any:
+    def create_client(provider_config: Dict[str, Any], timeouts: Optional[RequestTimeouts] = None) -> Any:
         """创建客户端实例"""
-        api_key = provider_config["api_key"]
-        base_url = provider_config["base_url"]
+        api_key = provider_config.get("api_key", "")
+        base_url = provider_config.get("base_url", "")
         client_type = provider_config["type"]
         
         if client_type == "gemini":
-            return AsyncGoogleClient(api_key, base_url)
+            return AsyncGoogleClient(api_key, base_url, timeouts)
         elif client_type == "openai":
-            return AsyncOpenAICompatibleClient(api_key, base_url)
+            return AsyncOpenAICompatibleClient(api_key, base_url, timeouts)
+        elif client_type == "replay":
+            return AsyncReplayClient(provider_config, timeouts)
         else:
             raise ValueError(f"不支持的客户端类型: {client_type}")
 
@@ -226,64 +527,175 @@ class ClientFactory:
 class ModelRouter:
     """统一模型路由类"""
     
-    def get_client(self, model_name: str, provider: str):
+    def get_client(self, model_name: str, provider: str, timeouts: Optional[RequestTimeouts] = None):
         """根据厂商获取对应的客户端"""
         if provider not in PROVIDER_CONFIG:
             raise ValueError(f"不支持的厂商: {provider}")
-        return ClientFactory.create_client(PROVIDER_CONFIG[provider])
-    
+        return ClientFactory.create_client(PROVIDER_CONFIG[provider], timeouts)
+
+    def resolve_timeouts(self,
+                         provider: str,
+                         gen: GenerationProfile,
+                         max_tokens: Optional[int] = None,
+                         deadline: Optional[float] = None) -> RequestTimeouts:
+        """确定本次请求的超时设置
+
+        优先级：生成参数档案 > PROVIDER_CONFIG 中的 timeouts > DEFAULT_TIMEOUTS；
+        deadline 为任务剩余时间（秒），总截止时间不会超过它。
+        """
+        base = {**DEFAULT_TIMEOUTS, **PROVIDER_CONFIG.get(provider, {}).get("timeouts", {})}
+        connect = gen.connect_timeout if gen.connect_timeout is not None else base["connect"]
+        read = gen.read_timeout if gen.read_timeout is not None else base["read"]
+        total = gen.timeout if gen.timeout is not None else base["total"]
+        if gen.timeout_per_1k_tokens is not None and max_tokens is not None:
+            total = min(total, read + max_tokens / 1000 * gen.timeout_per_1k_tokens)
+        if deadline is not None:
+            total = min(total, max(deadline, 0.0))
+        return RequestTimeouts(connect=connect, read=min(read, total), total=total)
+
+    def resolve_profile(self,
+                        model_name: str,
+                        provider: str,
+                        profile: Optional[Union[str, GenerationProfile]] = None) -> GenerationProfile:
+        """确定本次调用使用的生成参数档案
+
+        优先级：显式传入的档案 > MODEL_PROFILES 中 "厂商/模型"、模型、厂商 的映射 > 全局 DEFAULT_* 设置
+        """
+        if isinstance(profile, GenerationProfile):
+            return profile
+        if profile is None:
+            for key in (f"{provider}/{model_name}", model_name, provider):
+                if key in MODEL_PROFILES:
+                    profile = MODEL_PROFILES[key]
+                    break
+        if profile is None:
+            # 兼容旧配置：doubao 的思维链开关沿用 DEFAULT_DOUBAO_THINKING
+            thinking = DEFAULT_DOUBAO_THINKING if provider == "doubao" else None
+            return GenerationProfile(thinking=thinking)
+        if profile not in GENERATION_PROFILES:
+            raise ValueError(f"未定义的生成参数档案: {profile}")
+        return GenerationProfile.from_dict(profile, GENERATION_PROFILES[profile])
+
+    def resolve_response_format(self, provider: str, json_schema: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """结构化输出的 response_format；未指定 schema 或厂商设为 none 时返回None"""
+        if json_schema is None:
+            return None
+        provider_config = PROVIDER_CONFIG.get(provider, {})
+        if provider_config.get("type") == "replay" and provider_config.get("upstream") in PROVIDER_CONFIG:
+            provider_config = {**PROVIDER_CONFIG[provider_config["upstream"]], **provider_config}
+        style = provider_config.get("structured_output", DEFAULT_STRUCTURED_OUTPUT)
+        if style == "json_schema":
+            # name 只允许字母、数字、下划线与连字符
+            name = re.sub(r"[^A-Za-z0-9_-]", "", str(json_schema.get("title") or ""))[:64] or "result"
+            return {"type": "json_schema", "json_schema": {"name": name, "schema": json_schema}}
+        if style == "json_object":
+            return {"type": "json_object"}
+        return None
+
     async def chat(self, 
                    model_name: str,
                    provider: str,
-                   message: str) -> Dict[str, Any]:
+                   message: str,
+                   profile: Optional[Union[str, GenerationProfile]] = None,
+                   deadline: Optional[float] = None,
+                   json_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """统一聊天接口
         
         Args:
             model_name: 模型名称（必需）
             provider: 指定模型平台（必需）
             message: 用户消息（必需）
+            profile: 生成参数档案名或档案对象（可选，默认按 MODEL_PROFILES 映射）
+            deadline: 调用方剩余的时间预算（秒，可选），请求总截止时间不会超过它
+            json_schema: 要求输出符合该 JSON Schema（可选），按厂商的 structured_output 方式下发
         Returns:
-            Dict包含响应内容或错误信息
+            Dict包含响应内容或错误信息；超时时 error_type 为 "timeout"
         """
-        
-        # 所有配置参数都直接从config.py读取
-            
-        # 获取客户端
-        client = self.get_client(model_name, provider)
-        
-        # 构建参数（直接从config读取所有参数）
+        try:
+            # 获取生成参数档案、超时设置与客户端
+            gen = self.resolve_profile(model_name, provider, profile)
+            max_tokens = gen.resolve_max_tokens(message)
+            timeouts = self.resolve_timeouts(provider, gen, max_tokens, deadline)
+            client = self.get_client(model_name, provider, timeouts)
+        except Exception as e:
+            return {"error": str(e), "success": False}
+
+        provider_config = PROVIDER_CONFIG[provider]
         params = {
             "model": model_name,
             "message": message,
-            "system_prompt": DEFAULT_SYSTEM_PROMPT,
-            "stream": DEFAULT_STREAM,
-            "temperature": DEFAULT_TEMPERATURE,
-            "top_p": DEFAULT_TOP_P,
-            "max_tokens": DEFAULT_MAX_TOKENS,
-            
+            "system_prompt": gen.system_prompt,
+            "stream": gen.stream,
+            "temperature": gen.temperature,
+            "top_p": gen.top_p,
+            "max_tokens": max_tokens,
+            "thinking": gen.thinking,
+            "thinking_style": provider_config.get(
+                "thinking_style", DEFAULT_THINKING_STYLES.get(provider_config.get("upstream", provider))),
+            "reasoning_effort": gen.reasoning_effort,
+            "timeout": timeouts,
+            "response_format": self.resolve_response_format(provider, json_schema),
         }
-        # 仅当 provider 是 doubao 时，才添加 thinking 字段
-        if provider == "doubao":
-            params["thinking"] = {
-                "type": DEFAULT_DOUBAO_THINKING,  # 或根据需求改为 "auto" / "disabled"
-            }
         
         try:
-            if DEFAULT_STREAM:
-                return await self._handle_streaming_response(client, params)
+            if gen.stream:
+                return await self._handle_streaming_response(client, params, timeouts)
             else:
-                return await self._handle_normal_response(client, params)
+                return await self._handle_normal_response(client, params, timeouts)
                 
         except Exception as e:
             return {"error": str(e), "success": False}
+
+    @staticmethod
+    async def collect_stream(response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        把流式响应（档案中 stream 为 true 时 chat 返回的 chunks）拼接为与非流式相同的结果，
+        供需要完整回答的调用方（如 Query）使用；非流式响应与错误原样返回
+
+        Returns:
+            含 content、reasoning_content 的结果；读取中途超时时 error_type 为 "timeout"
+        """
+        if "chunks" not in response:
+            return response
+        content, reasoning = [], []
+        try:
+            async for chunk in response["chunks"]:
+                content.append(chunk.get("content") or "")
+                reasoning.append(chunk.get("reasoning_content") or "")
+        except TIMEOUT_ERRORS as e:
+            return {"error": f"流式响应超时: {str(e) or type(e).__name__}", "error_type": "timeout",
+                    "success": False, "model": response.get("model")}
+        except Exception as e:
+            return {"error": f"读取流式响应失败: {str(e)}", "success": False, "model": response.get("model")}
+        return {
+            "content": "".join(content),
+            "reasoning_content": "".join(reasoning),
+            "usage": None,
+            "success": True,
+            "model": response.get("model")
+        }
+
+    @staticmethod
+    def _timeout_result(params, timeouts: RequestTimeouts, e: Exception) -> Dict[str, Any]:
+        """超时统一返回 error_type=timeout，供调用方决定是否重试"""
+        return {
+            "error": f"请求超时（total={timeouts.total:.0f}s, read={timeouts.read:.0f}s）: {str(e) or type(e).__name__}",
+            "error_type": "timeout",
+            "success": False,
+            "model": params["model"]
+        }
     
-    async def _handle_streaming_response(self, client, params):
+    async def _handle_streaming_response(self, client, params, timeouts: RequestTimeouts):
         """处理异步流式响应"""
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + timeouts.total
         try:
-            response = await client.create_completion(**params)
+            response = await asyncio.wait_for(client.create_completion(**params), timeouts.total)
 
             async def async_chunk_generator():
                 async for chunk in response:
+                    if loop.time() > deadline_at:
+                        raise RequestTimeoutError(f"流式响应超过总截止时间 {timeouts.total:.0f}s")
                     chunk_data = client.extract_streaming_response(chunk)
                     yield chunk_data
 
@@ -293,22 +705,27 @@ class ModelRouter:
                 "model": params["model"]
             }
 
+        except TIMEOUT_ERRORS as e:
+            return self._timeout_result(params, timeouts, e)
         except Exception as e:
             return {"error": str(e), "success": False}
     
-    async def _handle_normal_response(self, client, params):
+    async def _handle_normal_response(self, client, params, timeouts: RequestTimeouts):
         """处理异步普通响应"""
         try:
-            response = await client.create_completion(**params)
+            response = await asyncio.wait_for(client.create_completion(**params), timeouts.total)
             response_data = client.extract_response(response)
             
             return {
                 "content": response_data["content"],
                 "reasoning_content": response_data["reasoning_content"],
+                "usage": response_data.get("usage"),
                 "success": True,
                 "model": params["model"]
             }
             
+        except TIMEOUT_ERRORS as e:
+            return self._timeout_result(params, timeouts, e)
         except Exception as e:
             return {"error": str(e), "success": False}
 